@@ -1,7 +1,9 @@
 from django.contrib import admin
+from django.utils import timezone
 from .models import (
     Usuario, EstadoChat, Profesional, Cliente, Producto,
-    HistorialEstadoCita, Cita, ProductoProfesional, ApiKey
+    HistorialEstadoCita, Cita, ProductoProfesional, ApiKey, ApiKeyUsageRollup,
+    HorarioAtencion, DiaFestivo, ExcepcionHorario, EventoCalendario, EstadoEventoCalendarioEnum
 )
 
 
@@ -57,7 +59,7 @@ class HistorialEstadoCitaAdmin(admin.ModelAdmin):
 @admin.register(Cita)
 class CitaAdmin(admin.ModelAdmin):
     list_display = ['get_cliente', 'get_producto', 'get_profesional', 'fecha_hora_inicio', 'get_estado']
-    list_filter = ['producto', 'profesional_asignado', 'estado_actual__estado_cita', 'fecha_hora_inicio']
+    list_filter = ['producto', 'profesional_asignado', 'estado', 'fecha_hora_inicio']
     search_fields = ['cliente__nombres', 'cliente__apellidos', 'observaciones']
     date_hierarchy = 'fecha_hora_inicio'
     
@@ -76,7 +78,7 @@ class CitaAdmin(admin.ModelAdmin):
     get_profesional.short_description = 'Profesional'
     
     def get_estado(self, obj):
-        return obj.estado_actual.estado_cita if obj.estado_actual else "Sin estado"
+        return obj.get_estado_actual_nombre()
     get_estado.short_description = 'Estado'
 
 
@@ -95,9 +97,59 @@ class ProductoProfesionalAdmin(admin.ModelAdmin):
     get_profesional.short_description = 'Profesional'
 
 
+@admin.register(HorarioAtencion)
+class HorarioAtencionAdmin(admin.ModelAdmin):
+    list_display = ['dia_semana', 'hora_apertura', 'hora_ultimo_inicio', 'hora_cierre']
+    ordering = ['dia_semana']
+
+
+@admin.register(DiaFestivo)
+class DiaFestivoAdmin(admin.ModelAdmin):
+    list_display = ['fecha', 'nombre']
+    search_fields = ['nombre']
+    date_hierarchy = 'fecha'
+    ordering = ['fecha']
+
+
+@admin.register(ExcepcionHorario)
+class ExcepcionHorarioAdmin(admin.ModelAdmin):
+    list_display = ['fecha', 'get_profesional', 'hora_apertura', 'hora_ultimo_inicio', 'hora_cierre', 'motivo']
+    list_filter = ['profesional']
+    search_fields = ['motivo', 'profesional__nombres', 'profesional__apellidos']
+    date_hierarchy = 'fecha'
+    ordering = ['-fecha']
+    
+    def get_profesional(self, obj):
+        if obj.profesional:
+            return f"{obj.profesional.nombres} {obj.profesional.apellidos}"
+        return "Todos"
+    get_profesional.short_description = 'Profesional'
+
+
+@admin.register(EventoCalendario)
+class EventoCalendarioAdmin(admin.ModelAdmin):
+    list_display = ['id', 'accion', 'cita', 'estado', 'intentos', 'proximo_intento', 'fecha_creacion', 'fecha_envio', 'ultimo_error']
+    list_filter = ['estado', 'accion']
+    search_fields = ['cita__id', 'google_calendar_event_id', 'ultimo_error']
+    readonly_fields = [field.name for field in EventoCalendario._meta.fields]
+    list_select_related = ['cita']
+    actions = ['reintentar']
+    
+    @admin.action(description='Reintentar los eventos seleccionados')
+    def reintentar(self, request, queryset):
+        actualizados = queryset.exclude(estado=EstadoEventoCalendarioEnum.ENVIADO).update(
+            estado=EstadoEventoCalendarioEnum.PENDIENTE, intentos=0, proximo_intento=timezone.now()
+        )
+        self.message_user(request, f"{actualizados} eventos vuelven a la cola")
+    
+    def has_add_permission(self, request):
+        return False
+
+
 @admin.register(ApiKey)
 class ApiKeyAdmin(admin.ModelAdmin):
-    list_display = ['name', 'key_preview', 'is_active', 'created_at', 'last_used', 'usage_count']
+    list_display = ['name', 'key_preview', 'is_active', 'rate_limit_per_minute', 'rate_limit_burst', 'created_at', 'last_used', 'usage_count']
+    list_editable = ['rate_limit_per_minute', 'rate_limit_burst']
     list_filter = ['is_active', 'created_at', 'last_used']
     search_fields = ['name', 'description']
     readonly_fields = ['key', 'created_at', 'last_used', 'usage_count']
@@ -107,3 +159,22 @@ class ApiKeyAdmin(admin.ModelAdmin):
         """Mostrar solo una vista previa de la key por seguridad"""
         if len(obj.key) > 8:
             return f"{obj.key[:4]}...{obj.key[-4:]}"
+
+
+@admin.register(ApiKeyUsageRollup)
+class ApiKeyUsageRollupAdmin(admin.ModelAdmin):
+    list_display = ['hour', 'api_key', 'endpoint', 'request_count', 'error_count', 'get_latencia_promedio']
+    list_filter = ['api_key', 'endpoint']
+    list_select_related = ['api_key']
+    date_hierarchy = 'hour'
+    ordering = ['-hour', '-request_count']
+    
+    def get_latencia_promedio(self, obj):
+        return f"{obj.avg_latency_ms:.1f} ms"
+    get_latencia_promedio.short_description = 'Latencia promedio'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
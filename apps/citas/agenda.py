@@ -0,0 +1,169 @@
+"""
+Índice en memoria de los horarios ocupados de cada profesional.
+
+Mientras un cliente negocia un horario se consulta una y otra vez el mismo día
+del mismo profesional. Cada worker guarda, por (profesional, día), los
+intervalos ocupados ya fusionados y ordenados, de modo que "¿está libre
+[inicio, fin)?" y "¿cuál es el siguiente horario libre?" se responden con una
+búsqueda binaria sin ir a la base de datos.
+
+El índice se carga al primer uso y se invalida con las señales de Cita (ver
+signals.py). Como la invalidación solo alcanza al worker que guardó la cita,
+AGENDA_CACHE_TTL acota cuánto puede estar desactualizado en los demás; la
+restricción cita_profesional_sin_solape sigue siendo la validación definitiva.
+"""
+from bisect import bisect_right
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+
+from . import calendario
+from .cache import TTLCache
+from .calendario import ZONA_COLOMBIA
+from .disponibilidad import MAX_DIAS_DISPONIBILIDAD
+from .models import Cita, EstadoCitaEnum
+
+
+class IndiceIntervalos:
+    """
+    Intervalos ocupados de un profesional en un día.
+
+    Los intervalos se fusionan al construir el índice, así que quedan
+    disjuntos y ordenados tanto por inicio como por fin: basta una búsqueda
+    binaria sobre los fines para encontrar el único bloque que puede cruzarse
+    con un horario.
+    """
+    __slots__ = ('inicios', 'fines')
+
+    def __init__(self, intervalos):
+        self.inicios = []
+        self.fines = []
+        for inicio, fin in sorted(intervalos):
+            if self.fines and inicio <= self.fines[-1]:
+                if fin > self.fines[-1]:
+                    self.fines[-1] = fin
+            else:
+                self.inicios.append(inicio)
+                self.fines.append(fin)
+
+    def esta_libre(self, inicio, fin):
+        """Indica si [inicio, fin) no se cruza con ningún intervalo ocupado"""
+        k = bisect_right(self.fines, inicio)
+        return k == len(self.fines) or self.inicios[k] >= fin
+
+    def siguiente_libre(self, desde, duracion, inicio_maximo):
+        """
+        Primer inicio t >= desde, con t <= inicio_maximo, tal que
+        [t, t + duracion) esté libre. Retorna None si no hay.
+        """
+        t = desde
+        k = bisect_right(self.fines, t)
+        while t <= inicio_maximo:
+            if k == len(self.fines) or self.inicios[k] >= t + duracion:
+                return t
+            # El bloque k se cruza: el siguiente candidato es su fin
+            t = self.fines[k]
+            k += 1
+        return None
+
+    def __len__(self):
+        return len(self.inicios)
+
+
+def dias_de(inicio, fin):
+    """Días (hora de Colombia) que toca el intervalo [inicio, fin)"""
+    dia = inicio.astimezone(ZONA_COLOMBIA).date()
+    ultimo = (fin - timedelta(microseconds=1)).astimezone(ZONA_COLOMBIA).date()
+    dias = [dia]
+    while dia < ultimo:
+        dia += timedelta(days=1)
+        dias.append(dia)
+    return dias
+
+
+def limites_dia(dia):
+    """Inicio y fin (UTC) del día en hora de Colombia"""
+    inicio = datetime.combine(dia, time.min, tzinfo=ZONA_COLOMBIA).astimezone(dt_timezone.utc)
+    return inicio, inicio + timedelta(days=1)
+
+
+class AgendaCache:
+    """Caché por worker de IndiceIntervalos con clave (profesional_id, día)"""
+
+    def __init__(self, max_size=4096, ttl=30):
+        self._cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    def indice(self, profesional_id, dia):
+        """Índice del día para el profesional; se carga de la BD si no está en caché"""
+        clave = (profesional_id, dia)
+        indice = self._cache.get(clave)
+        if indice is None:
+            indice = self._cargar(profesional_id, dia)
+            self._cache.set(clave, indice)
+        return indice
+
+    def _cargar(self, profesional_id, dia):
+        inicio_dia, fin_dia = limites_dia(dia)
+        intervalos = Cita.objects.filter(
+            profesional_asignado_id=profesional_id,
+            fecha_hora_inicio__lt=fin_dia,
+            fecha_hora_fin__gt=inicio_dia,
+            # Cota inferior para usar cita_profesional_fecha_idx (ninguna cita dura más de un día)
+            fecha_hora_inicio__gte=inicio_dia - timedelta(days=1),
+        ).exclude(
+            estado=EstadoCitaEnum.CANCELADO
+        ).values_list('fecha_hora_inicio', 'fecha_hora_fin')
+        return IndiceIntervalos(intervalos)
+
+    def esta_libre(self, profesional_id, inicio, fin):
+        """Indica si el profesional no tiene citas no canceladas en [inicio, fin)"""
+        inicio = inicio.astimezone(dt_timezone.utc)
+        fin = fin.astimezone(dt_timezone.utc)
+        return all(
+            self.indice(profesional_id, dia).esta_libre(inicio, fin)
+            for dia in dias_de(inicio, fin)
+        )
+
+    def siguiente_libre(self, profesional_id, desde, duracion, max_dias=MAX_DIAS_DISPONIBILIDAD):
+        """
+        Primer horario libre del profesional que inicia en o después de ``desde``
+        y cabe en su jornada (ver calendario: horario semanal, festivos y
+        excepciones).
+
+        Retorna (inicio, fin) en UTC, o None si no hay hueco en ``max_dias`` días.
+        """
+        desde = desde.astimezone(dt_timezone.utc)
+        dia = desde.astimezone(ZONA_COLOMBIA).date()
+        for _ in range(max_dias):
+            jornada = calendario.jornada(dia, profesional_id)
+            if jornada:
+                apertura, ultimo_inicio, cierre = jornada
+                inicio_maximo = min(ultimo_inicio, cierre - duracion)
+                if desde <= inicio_maximo:
+                    inicio = self.indice(profesional_id, dia).siguiente_libre(
+                        max(desde, apertura), duracion, inicio_maximo
+                    )
+                    if inicio is not None:
+                        return inicio, inicio + duracion
+            dia += timedelta(days=1)
+        return None
+
+    def invalidar(self, profesional_id, inicio, fin):
+        """Descartar los días del profesional que toca [inicio, fin)"""
+        if profesional_id is None or inicio is None or fin is None:
+            return
+        for dia in dias_de(inicio, fin):
+            self._cache.delete((profesional_id, dia))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        """Contadores de aciertos/fallos del worker actual"""
+        return self._cache.stats()
+
+
+agenda_cache = AgendaCache(
+    max_size=getattr(settings, 'AGENDA_CACHE_MAX_SIZE', 4096),
+    ttl=getattr(settings, 'AGENDA_CACHE_TTL', 30),
+)
@@ -12,3 +12,6 @@ class CitasConfig(AppConfig):
             import apps.citas.signals  # noqa F401
         except ImportError:
             pass
+        
+        from .throttling import verificar_configuracion
+        verificar_configuracion()
@@ -1,9 +1,32 @@
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from .cache import TTLCache
 from .models import ApiKey
 
 
+# Caché por worker de API Keys activas. Las señales de ApiKey invalidan la
+# entrada local al guardar o eliminar; el resto de workers la ven caducar como
+# máximo tras API_KEY_CACHE_TTL segundos.
+api_key_cache = TTLCache(
+    max_size=getattr(settings, 'API_KEY_CACHE_MAX_SIZE', 1024),
+    ttl=getattr(settings, 'API_KEY_CACHE_TTL', 60),
+)
+# Keys inválidas, en una LRU aparte y más pequeña: una ráfaga de keys aleatorias
+# solo expulsa otras keys inválidas, nunca las válidas de api_key_cache
+api_key_invalida_cache = TTLCache(
+    max_size=getattr(settings, 'API_KEY_NEGATIVE_CACHE_MAX_SIZE', 256),
+    ttl=getattr(settings, 'API_KEY_NEGATIVE_CACHE_TTL', 10),
+)
+
+
+def invalidate_api_key(key):
+    """Eliminar una API Key de la caché local (válida o marcada como inválida)"""
+    api_key_cache.delete(key)
+    api_key_invalida_cache.delete(key)
+
+
 class ApiKeyAuthentication(BaseAuthentication):
     """
     Autenticación personalizada usando API Keys.
@@ -28,17 +51,39 @@ class ApiKeyAuthentication(BaseAuthentication):
             
         api_key = auth_parts[1]
         
+        key_obj = self.get_api_key(api_key)
+        if key_obj is None:
+            raise AuthenticationFailed('API Key inválida o inactiva')
+        
+        # Actualizar estadísticas de uso
+        key_obj.update_usage()
+        
+        # Retornar un usuario especial para API Keys
+        api_user = ApiKeyUser(api_key=key_obj)
+        return (api_user, key_obj)
+    
+    def get_api_key(self, api_key):
+        """
+        Obtener la API Key activa usando la caché del worker.
+        
+        Retorna None si la key no existe o está inactiva; ese resultado también
+        se cachea (en api_key_invalida_cache, API_KEY_NEGATIVE_CACHE_TTL) para
+        no consultar la BD en cada intento con una key inválida.
+        """
+        key_obj = api_key_cache.get(api_key)
+        if key_obj is not None:
+            return key_obj
+        if api_key_invalida_cache.get(api_key) is not None:
+            return None
+        
         try:
             key_obj = ApiKey.objects.get(key=api_key, is_active=True)
-            # Actualizar estadísticas de uso
-            key_obj.update_usage()
-            
-            # Retornar un usuario especial para API Keys
-            api_user = ApiKeyUser(api_key=key_obj)
-            return (api_user, key_obj)
-            
         except ApiKey.DoesNotExist:
-            raise AuthenticationFailed('API Key inválida o inactiva')
+            api_key_invalida_cache.set(api_key, True)
+            return None
+        
+        api_key_cache.set(api_key, key_obj)
+        return key_obj
     
     def authenticate_header(self, request):
         """
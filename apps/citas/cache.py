@@ -0,0 +1,70 @@
+"""
+Cachés en memoria por proceso (worker de gunicorn).
+
+Cada worker mantiene su propia copia; la invalidación explícita solo afecta
+al proceso que la ejecuta, por lo que el TTL acota el tiempo máximo en que
+otros workers pueden servir un valor desactualizado.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Caché LRU con tiempo de vida por entrada y tamaño máximo.
+
+    Es segura para hilos y no depende de Django, de modo que puede usarse
+    desde autenticación, señales o comandos de gestión.
+    """
+    _MISSING = object()
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Obtener un valor vigente o ``default`` si no existe o expiró"""
+        with self._lock:
+            item = self._data.get(key, self._MISSING)
+            if item is self._MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Guardar un valor; expulsa la entrada menos usada si se supera el tamaño"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Contadores de aciertos/fallos para diagnóstico"""
+        with self._lock:
+            return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
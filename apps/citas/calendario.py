@@ -0,0 +1,151 @@
+"""
+Calendario laboral: horario semanal, festivos y excepciones por profesional.
+
+Los horarios abiertos se precalculan por mes (tres consultas: horario semanal,
+festivos y excepciones del mes) y se guardan en una caché por worker, de modo
+que consultar un mes completo no hace una consulta por día. La caché se
+invalida con las señales de HorarioAtencion, DiaFestivo y ExcepcionHorario
+(ver signals.py); en los demás workers expira tras CALENDARIO_CACHE_TTL.
+"""
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+
+from .cache import TTLCache
+from .models import DiaFestivo, ExcepcionHorario, HorarioAtencion
+
+ZONA_COLOMBIA = ZoneInfo('America/Bogota')
+
+calendario_cache = TTLCache(
+    max_size=getattr(settings, 'CALENDARIO_CACHE_MAX_SIZE', 64),
+    ttl=getattr(settings, 'CALENDARIO_CACHE_TTL', 300),
+)
+
+
+class MesLaboral:
+    """
+    Horarios de un mes ya resueltos.
+
+    general: {fecha: (apertura, último inicio, cierre) o None}
+    excepciones: {(profesional_id, fecha): (apertura, último inicio, cierre) o None}
+    """
+    __slots__ = ('general', 'excepciones', 'profesionales_con_excepcion')
+
+    def __init__(self, general, excepciones):
+        self.general = general
+        self.excepciones = excepciones
+        self.profesionales_con_excepcion = {profesional_id for profesional_id, _ in excepciones}
+
+    def horario(self, fecha, profesional_id=None):
+        if profesional_id is not None:
+            clave = (profesional_id, fecha)
+            if clave in self.excepciones:
+                return self.excepciones[clave]
+        return self.general.get(fecha)
+
+
+def _horas(registro):
+    if registro.hora_apertura is None:
+        return None
+    return (registro.hora_apertura, registro.hora_ultimo_inicio, registro.hora_cierre)
+
+
+def _cargar_mes(anio, mes):
+    primero = date(anio, mes, 1)
+    siguiente = date(anio + mes // 12, mes % 12 + 1, 1)
+
+    semanal = {h.dia_semana: _horas(h) for h in HorarioAtencion.objects.all()}
+    festivos = set(
+        DiaFestivo.objects.filter(fecha__gte=primero, fecha__lt=siguiente).values_list('fecha', flat=True)
+    )
+    general = {}
+    excepciones = {}
+    for excepcion in ExcepcionHorario.objects.filter(fecha__gte=primero, fecha__lt=siguiente):
+        if excepcion.profesional_id is None:
+            general[excepcion.fecha] = _horas(excepcion)
+        else:
+            excepciones[(excepcion.profesional_id, excepcion.fecha)] = _horas(excepcion)
+
+    fecha = primero
+    while fecha < siguiente:
+        if fecha not in general:
+            general[fecha] = None if fecha in festivos else semanal.get(fecha.weekday())
+        fecha += timedelta(days=1)
+    return MesLaboral(general, excepciones)
+
+
+def mes_laboral(anio, mes):
+    """MesLaboral del mes, desde la caché del worker o cargado de la BD"""
+    clave = (anio, mes)
+    resultado = calendario_cache.get(clave)
+    if resultado is None:
+        resultado = _cargar_mes(anio, mes)
+        calendario_cache.set(clave, resultado)
+    return resultado
+
+
+def horario_del_dia(fecha, profesional_id=None):
+    """(apertura, último inicio, cierre) como time, o None si ese día no hay atención"""
+    return mes_laboral(fecha.year, fecha.month).horario(fecha, profesional_id)
+
+
+def jornada(fecha, profesional_id=None):
+    """Jornada del día como datetimes UTC (apertura, último inicio, cierre), o None"""
+    horario = horario_del_dia(fecha, profesional_id)
+    if horario is None:
+        return None
+    return tuple(
+        datetime.combine(fecha, hora, tzinfo=ZONA_COLOMBIA).astimezone(dt_timezone.utc)
+        for hora in horario
+    )
+
+
+def jornadas(fecha_desde, fecha_hasta, profesional_id=None):
+    """Lista de jornadas (UTC) con atención entre dos fechas, inclusive"""
+    resultado = []
+    fecha = fecha_desde
+    while fecha <= fecha_hasta:
+        actual = jornada(fecha, profesional_id)
+        if actual:
+            resultado.append(actual)
+        fecha += timedelta(days=1)
+    return resultado
+
+
+def jornadas_por_profesional(profesional_ids, fecha_desde, fecha_hasta):
+    """
+    {profesional_id: [jornadas]} para varios profesionales.
+
+    Los profesionales sin excepciones en el rango comparten la misma lista de
+    jornadas generales, que se calcula una sola vez.
+    """
+    meses = []
+    anio, mes = fecha_desde.year, fecha_desde.month
+    while (anio, mes) <= (fecha_hasta.year, fecha_hasta.month):
+        meses.append(mes_laboral(anio, mes))
+        anio, mes = (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+    con_excepcion = set().union(*(m.profesionales_con_excepcion for m in meses))
+
+    generales = jornadas(fecha_desde, fecha_hasta)
+    return {
+        profesional_id: (
+            jornadas(fecha_desde, fecha_hasta, profesional_id)
+            if profesional_id in con_excepcion else generales
+        )
+        for profesional_id in profesional_ids
+    }
+
+
+def dentro_de_horario(profesional_id, inicio, fin):
+    """Indica si [inicio, fin) cabe en la jornada del profesional ese día"""
+    actual = jornada(inicio.astimezone(ZONA_COLOMBIA).date(), profesional_id)
+    if actual is None:
+        return False
+    apertura, ultimo_inicio, cierre = actual
+    return apertura <= inicio <= ultimo_inicio and fin <= cierre
+
+
+def invalidar():
+    """Descartar los meses precalculados del worker"""
+    calendario_cache.clear()
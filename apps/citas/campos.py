@@ -0,0 +1,147 @@
+"""
+Campos dispersos (sparse fieldsets): ``?fields=a,b`` y ``?exclude=c``.
+
+Los serializadores con CamposDinamicosMixin quitan los campos no pedidos en
+``get_fields()``, antes de serializar: un SerializerMethodField o un
+serializador anidado que no se pidió no se calcula ni hace sus consultas.
+``limitar_queryset()`` lleva los mismos campos a ``QuerySet.only()`` y deja en
+select_related solo las relaciones que se van a leer.
+
+Solo aplica al serializador raíz de una respuesta (o al hijo de su
+ListSerializer) y solo al serializar: un serializador con ``data=`` valida con
+todos sus campos. Los nombres desconocidos se ignoran.
+"""
+from django.core.exceptions import FieldDoesNotExist
+
+PARAMETRO_CAMPOS = 'fields'
+PARAMETRO_EXCLUIR = 'exclude'
+
+
+def _lista(valor):
+    return {nombre.strip() for nombre in valor.split(',') if nombre.strip()} if valor else set()
+
+
+def campos_de_solicitud(request):
+    """(campos pedidos o None, campos excluidos) de los parámetros de la solicitud"""
+    if request is None:
+        return None, set()
+    parametros = getattr(request, 'query_params', request.GET)
+    campos = _lista(parametros.get(PARAMETRO_CAMPOS))
+    return campos or None, _lista(parametros.get(PARAMETRO_EXCLUIR))
+
+
+def filtrar_dict(datos, request):
+    """Aplicar ?fields= / ?exclude= a una respuesta construida como dict plano"""
+    campos, excluir = campos_de_solicitud(request)
+    return {
+        nombre: valor for nombre, valor in datos.items()
+        if (campos is None or nombre in campos) and nombre not in excluir
+    }
+
+
+def ruta_modelo(modelo, atributos):
+    """
+    Ruta ORM ('cliente__nombres') de los source_attrs de un campo.
+
+    None si algún atributo no es un campo concreto del modelo (propiedad,
+    método o relación inversa): en ese caso no se puede usar only().
+    """
+    partes = []
+    for atributo in atributos:
+        if modelo is None:
+            break
+        try:
+            campo = modelo._meta.get_field(atributo)
+        except FieldDoesNotExist:
+            return None
+        if not campo.concrete:
+            return None
+        partes.append(campo.name)
+        modelo = campo.related_model if campo.is_relation else None
+    return '__'.join(partes) or None
+
+
+def _rutas_select_related(arbol, prefijo=''):
+    for nombre, hijos in arbol.items():
+        ruta = f'{prefijo}{nombre}'
+        yield ruta
+        yield from _rutas_select_related(hijos, f'{ruta}__')
+
+
+class CamposDinamicosMixin:
+    """
+    Mixin de ModelSerializer para ``?fields=`` / ``?exclude=``.
+
+    ``campos_calculados`` declara las salidas que no salen de un campo del
+    modelo (SerializerMethodField o claves agregadas en to_representation) y
+    las rutas del modelo que necesitan, para only().
+
+    También acepta ``campos=`` / ``excluir=`` al instanciarlo.
+    """
+    campos_calculados = {}
+
+    def __init__(self, *args, campos=None, excluir=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if campos is None and excluir is None and not hasattr(self, 'initial_data'):
+            campos, excluir = campos_de_solicitud(self._context.get('request'))
+        self._campos = set(campos) if campos is not None else None
+        self._excluir = set(excluir or ())
+
+    @property
+    def filtra_campos(self):
+        return self._campos is not None or bool(self._excluir)
+
+    def incluye(self, nombre):
+        """True si el campo de salida ``nombre`` se debe calcular"""
+        return (self._campos is None or nombre in self._campos) and nombre not in self._excluir
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.filtra_campos:
+            return fields
+        # Los campos write_only se conservan: no se renderizan y no cuestan nada
+        return {
+            nombre: campo for nombre, campo in fields.items()
+            if campo.write_only or self.incluye(nombre)
+        }
+
+    def campos_modelo(self):
+        """Rutas para only() de los campos que se van a renderizar; None si no se puede limitar"""
+        modelo = self.Meta.model
+        rutas = {modelo._meta.pk.name}
+        for nombre, campo in self.fields.items():
+            if campo.write_only or nombre in self.campos_calculados:
+                continue
+            if campo.source == '*':
+                return None
+            ruta = ruta_modelo(modelo, campo.source_attrs)
+            if ruta is None:
+                return None
+            rutas.add(ruta)
+        for nombre, rutas_calculadas in self.campos_calculados.items():
+            if self.incluye(nombre):
+                rutas.update(rutas_calculadas)
+        return rutas
+
+    def limitar_queryset(self, queryset, *siempre):
+        """
+        Aplicar only() con los campos pedidos (más ``siempre``, p. ej. el orden
+        de la paginación) y quitar de select_related las relaciones sin usar.
+        """
+        if not self.filtra_campos:
+            return queryset
+        rutas = self.campos_modelo()
+        if rutas is None:
+            return queryset
+        rutas.update(siempre)
+
+        relacionadas = queryset.query.select_related
+        if isinstance(relacionadas, dict):
+            usadas = [
+                relacion for relacion in _rutas_select_related(relacionadas)
+                if any(ruta == relacion or ruta.startswith(f'{relacion}__') for ruta in rutas)
+            ]
+            queryset = queryset.select_related(None)
+            if usadas:
+                queryset = queryset.select_related(*usadas)
+        return queryset.only(*rutas)
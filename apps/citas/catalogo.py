@@ -0,0 +1,88 @@
+"""
+Catálogo de productos materializado en memoria del worker.
+
+Guarda, ya en el formato de respuesta, los productos con sus profesionales y la
+matriz producto -> profesionales (ProductoProfesional). Se construye con los
+serializadores de producto sobre un queryset con prefetch (dos consultas, sin
+importar cuántos productos haya) y se sirve tal cual en ``productos/`` y ``productos/obtener-por-id/``.
+
+La versión del catálogo son las versiones de las tablas de
+versiones.TABLAS_PRODUCTOS (Producto, ProductoProfesional, Usuario,
+Profesional): en cada uso se leen (una consulta por PK) y, si alguna cambió, se
+reconstruye. Las señales además descartan el catálogo del worker que hizo el
+cambio, sin esperar a que se confirme el incremento de versión.
+"""
+import threading
+
+from .models import Producto
+from .serializers import (
+    ProductoListSerializer, ProductoSerializer, prefetch_profesionales, profesionales_de_producto,
+)
+from . import versiones
+
+
+class Catalogo:
+    """
+    Catálogo de una versión; no se modifica después de construirse.
+
+    productos: [dict con el formato de ProductoSerializer] ordenados por id
+    listado: [dict con el formato de ProductoListSerializer] ordenados por id
+    por_id: {producto_id: dict de ``productos``}
+    matriz: {producto_id: (profesional_id, ...)}
+    """
+    __slots__ = ('version', 'productos', 'listado', 'por_id', 'matriz')
+
+    def __init__(self, version, productos, listado, matriz):
+        self.version = version
+        self.productos = productos
+        self.listado = listado
+        self.por_id = {producto['producto_id']: producto for producto in productos}
+        self.matriz = matriz
+
+    def profesionales_de(self, producto_id):
+        return self.matriz.get(producto_id, ())
+
+
+def construir(version):
+    """Leer productos y profesionales (dos consultas, con prefetch) y armar el catálogo"""
+    productos = list(Producto.objects.order_by('id').prefetch_related(prefetch_profesionales()))
+    matriz = {
+        producto.id: tuple(usuario.id for usuario in profesionales_de_producto(producto))
+        for producto in productos
+    }
+    matriz = {producto_id: ids for producto_id, ids in matriz.items() if ids}
+    completos = [dict(datos) for datos in ProductoSerializer(productos, many=True).data]
+    listado = [dict(datos) for datos in ProductoListSerializer(productos, many=True).data]
+    return Catalogo(version, completos, listado, matriz)
+
+
+_catalogo = None
+_lock = threading.Lock()
+
+
+def obtener(versiones_actuales=None):
+    """
+    Catálogo vigente; lo reconstruye si cambió alguna tabla.
+
+    ``versiones_actuales``: resultado de ``versiones.leer(TABLAS_PRODUCTOS)``
+    si ya se leyó (p. ej. para el ETag), para no repetir la consulta.
+    """
+    global _catalogo
+    if versiones_actuales is None:
+        versiones_actuales = versiones.leer(versiones.TABLAS_PRODUCTOS)
+    version = tuple((tabla, numero) for tabla, (numero, _) in sorted(versiones_actuales.items()))
+
+    catalogo = _catalogo
+    if catalogo is not None and catalogo.version == version:
+        return catalogo
+    with _lock:
+        # Otro hilo pudo reconstruirlo mientras se esperaba el lock
+        if _catalogo is None or _catalogo.version != version:
+            _catalogo = construir(version)
+        return _catalogo
+
+
+def invalidar():
+    """Descartar el catálogo de este worker (lo llaman las señales)"""
+    global _catalogo
+    _catalogo = None
@@ -0,0 +1,186 @@
+"""
+Motor de disponibilidad: calcula horarios libres de profesionales.
+
+Los intervalos ocupados se leen con una sola consulta sobre Cita (excluyendo
+las canceladas) y los huecos se calculan en Python recorriendo en paralelo la
+lista ordenada de citas de cada profesional y los horarios candidatos del día.
+Las jornadas (horario semanal, festivos y excepciones) vienen de calendario.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import calendario
+from .calendario import ZONA_COLOMBIA
+from .filtros import rango_desde_parametros
+from .models import Cita, EstadoCitaEnum, ProductoProfesional
+
+MAX_DIAS_DISPONIBILIDAD = 31
+
+
+def parse_fecha_hora(valor):
+    """Convertir 'dd/mm/aaaa hh:mm' (hora de Colombia) en datetime; lanza ValueError si es inválido"""
+    return datetime.strptime(valor, '%d/%m/%Y %H:%M').replace(tzinfo=ZONA_COLOMBIA)
+
+
+def rango_consulta(parametros):
+    """
+    Rango de una consulta de disponibilidad a partir de ``fecha_inicio`` /
+    ``fecha_fin`` (por defecto igual a fecha_inicio), con el parser compartido
+    de filtros.py: acepta días completos o fecha y hora de Colombia.
+
+    Retorna (desde, hasta, fecha_desde, fecha_hasta): los límites [desde, hasta)
+    y los días de Colombia que cubren. Lanza ValueError con el mensaje para el
+    cliente si el formato o el rango son inválidos.
+    """
+    fecha_inicio = parametros.get('fecha_inicio')
+    desde, hasta = rango_desde_parametros(
+        {'fecha_inicio': fecha_inicio, 'fecha_fin': parametros.get('fecha_fin') or fecha_inicio},
+        requerido=True, max_dias=MAX_DIAS_DISPONIBILIDAD,
+    )
+    fecha_desde = desde.astimezone(ZONA_COLOMBIA).date()
+    # hasta es exclusivo: el último día es el del instante anterior
+    fecha_hasta = (hasta - timedelta(microseconds=1)).astimezone(ZONA_COLOMBIA).date()
+    return desde, hasta, fecha_desde, fecha_hasta
+
+
+def citas_ocupadas(profesional_ids, desde, hasta):
+    """
+    Intervalos ocupados por profesional en [desde, hasta), en una sola consulta.
+
+    Retorna {profesional_id: [(inicio, fin), ...]} ordenado por inicio. Las
+    citas canceladas no ocupan horario.
+    """
+    queryset = Cita.objects.filter(
+        profesional_asignado_id__in=profesional_ids,
+        fecha_hora_inicio__lt=hasta,
+        fecha_hora_fin__gt=desde,
+        # Cota inferior sobre fecha_hora_inicio para que el rango use
+        # cita_profesional_fecha_idx (ninguna cita dura más de un día)
+        fecha_hora_inicio__gte=desde - timedelta(days=1),
+    ).exclude(
+        estado=EstadoCitaEnum.CANCELADO
+    ).order_by(
+        'profesional_asignado_id', 'fecha_hora_inicio'
+    ).values_list('profesional_asignado_id', 'fecha_hora_inicio', 'fecha_hora_fin')
+
+    ocupados = defaultdict(list)
+    for profesional_id, inicio, fin in queryset:
+        ocupados[profesional_id].append((inicio, fin))
+    return ocupados
+
+
+def slots_libres(ocupados, jornadas_rango, duracion, paso, desde=None, hasta=None):
+    """
+    Horarios libres de un profesional.
+
+    ocupados: lista de (inicio, fin) ordenada por inicio.
+    jornadas_rango: iterable de (apertura, último inicio, cierre).
+    duracion / paso: timedelta de la cita y entre horarios candidatos.
+    desde: no se ofrecen horarios que inicien antes de este instante.
+    hasta: no se ofrecen horarios que terminen después de este instante.
+
+    Retorna una lista de (inicio, fin).
+    """
+    libres = []
+    i = 0
+    total = len(ocupados)
+    for apertura, ultimo_inicio, cierre in jornadas_rango:
+        inicio = apertura
+        while inicio <= ultimo_inicio:
+            fin = inicio + duracion
+            if fin > cierre or (hasta is not None and fin > hasta):
+                break
+            if desde is not None and inicio < desde:
+                inicio += paso
+                continue
+            # Descartar citas que terminan antes del candidato; como los
+            # candidatos avanzan en orden, el índice nunca retrocede
+            while i < total and ocupados[i][1] <= inicio:
+                i += 1
+            conflicto = False
+            j = i
+            while j < total and ocupados[j][0] < fin:
+                if ocupados[j][1] > inicio:
+                    conflicto = True
+                    break
+                j += 1
+            if not conflicto:
+                libres.append((inicio, fin))
+            inicio += paso
+    return libres
+
+
+def profesionales_del_producto(producto_id):
+    """IDs de usuario de los profesionales autorizados para el producto"""
+    return list(
+        ProductoProfesional.objects.filter(producto_id=producto_id)
+        .order_by('profesional_id')
+        .values_list('profesional_id', flat=True)
+    )
+
+
+def profesionales_con_nombre(producto_id):
+    """Profesionales autorizados para el producto como dicts con id, nombres y apellidos"""
+    return [
+        {'profesional_id': profesional_id, 'nombres': nombres, 'apellidos': apellidos}
+        for profesional_id, nombres, apellidos in ProductoProfesional.objects.filter(
+            producto_id=producto_id
+        ).order_by('profesional_id').values_list(
+            'profesional_id', 'profesional__nombres', 'profesional__apellidos'
+        )
+    ]
+
+
+def disponibilidad_por_profesional(producto, profesional_ids, fecha_desde, fecha_hasta, paso=None, limites=None):
+    """
+    Calcular los horarios libres de cada profesional para un producto.
+
+    limites: (desde, hasta) opcionales de rango_consulta(); los horarios deben
+    quedar dentro de [desde, hasta).
+
+    Retorna {profesional_id: [(inicio, fin), ...]}.
+    """
+    duracion = timedelta(minutes=producto.duracion_minutos)
+    paso = paso or timedelta(minutes=getattr(settings, 'DISPONIBILIDAD_INTERVALO_MINUTOS', 30))
+    # Jornadas en UTC, igual que las fechas que retorna la BD: comparar datetimes
+    # con la misma tzinfo evita calcular el offset de Bogotá en cada comparación
+    jornadas = calendario.jornadas_por_profesional(profesional_ids, fecha_desde, fecha_hasta)
+    con_jornadas = [j for j in jornadas.values() if j]
+    if not con_jornadas:
+        return {profesional_id: [] for profesional_id in profesional_ids}
+
+    desde = min(j[0][0] for j in con_jornadas)
+    hasta = max(j[-1][2] for j in con_jornadas)
+    ocupados = citas_ocupadas(profesional_ids, desde, hasta)
+    minimo, maximo = timezone.now(), None
+    if limites is not None:
+        minimo, maximo = max(minimo, limites[0]), limites[1]
+
+    return {
+        profesional_id: slots_libres(
+            ocupados.get(profesional_id, []), jornadas[profesional_id], duracion, paso,
+            desde=minimo, hasta=maximo,
+        )
+        for profesional_id in profesional_ids
+    }
+
+
+def combinar_slots(libres_por_profesional):
+    """
+    Unir los horarios libres de varios profesionales.
+
+    Retorna una lista ordenada de (inicio, fin, [profesional_ids libres]).
+    """
+    por_horario = defaultdict(list)
+    for profesional_id, libres in libres_por_profesional.items():
+        for inicio, fin in libres:
+            por_horario[(inicio, fin)].append(profesional_id)
+    return [(inicio, fin, sorted(ids)) for (inicio, fin), ids in sorted(por_horario.items())]
+
+
+def formatear_fecha(valor):
+    """Formato dd/mm/aaaa hh:mm en hora de Colombia, igual que el resto de la API"""
+    return valor.astimezone(ZONA_COLOMBIA).strftime('%d/%m/%Y %H:%M')
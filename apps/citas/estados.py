@@ -0,0 +1,163 @@
+"""
+Cambio de estado de citas en lote.
+
+Equivale a llamar Cita.cambiar_estado por cada cita, pero dentro de una sola
+transacción: las citas se bloquean con una consulta, los HistorialEstadoCita y
+los eventos de calendario (cancelaciones y reactivaciones) se insertan con
+``bulk_create`` y estado_actual / estado / observaciones / next_action_at /
+version se actualizan con un único UPDATE (``bulk_update``).
+"""
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .agenda import agenda_cache
+from .models import Cita, EstadoCitaEnum, EventoCalendario, HistorialEstadoCita, es_solapamiento_profesional
+from .recordatorios import misma_accion, proxima_accion
+from .sincronizacion_calendario import acciones_por_cambio, evento_para
+
+logger = logging.getLogger(__name__)
+
+MAX_CAMBIOS_LOTE = 500
+
+CAMPOS_ACTUALIZADOS = ['estado_actual', 'estado', 'observaciones', 'next_action_at', 'version']
+
+ERROR_ESTADO_CAMBIADO = 'La cita ya no está en un estado de origen de la transición'
+
+
+def _resultado_error(cita_id, error):
+    return {'cita_id': cita_id, 'exito': False, 'error': error}
+
+
+def _validar(cambios):
+    """Separar los cambios válidos de los inválidos; retorna (validos, resultados por índice)"""
+    estados_validos = [choice[0] for choice in EstadoCitaEnum.choices]
+    validos = []
+    resultados = {}
+    vistos = set()
+    for indice, cambio in enumerate(cambios):
+        if not isinstance(cambio, dict):
+            resultados[indice] = _resultado_error(None, 'Cada cambio debe ser un objeto JSON')
+            continue
+        cita_id = cambio.get('cita_id')
+        nuevo_estado = cambio.get('estado_cita')
+        if not isinstance(cita_id, int) or isinstance(cita_id, bool):
+            resultados[indice] = _resultado_error(cita_id, 'cita_id es requerido y debe ser un número entero')
+        elif nuevo_estado not in estados_validos:
+            resultados[indice] = _resultado_error(cita_id, f'estado_cita inválido. Estados válidos: {estados_validos}')
+        elif not isinstance(cambio.get('estados_origen', ()), (list, tuple)):
+            resultados[indice] = _resultado_error(cita_id, 'estados_origen debe ser una lista de estados')
+        elif cita_id in vistos:
+            resultados[indice] = _resultado_error(cita_id, 'La cita está repetida en el lote')
+        else:
+            vistos.add(cita_id)
+            validos.append((indice, cambio))
+    return validos, resultados
+
+
+def _aplicar(pendientes):
+    """
+    Insertar el historial y actualizar las citas de ``pendientes``.
+
+    pendientes: lista de (indice, cambio, cita). Las citas en memoria no se
+    modifican; el UPDATE se construye con instancias nuevas.
+    """
+    historiales = HistorialEstadoCita.objects.bulk_create([
+        HistorialEstadoCita(cita_id=cita.id, estado_cita=cambio['estado_cita'])
+        for _, cambio, cita in pendientes
+    ])
+    actualizadas = []
+    for (_, cambio, cita), historial in zip(pendientes, historiales):
+        observaciones = cita.observaciones
+        if cambio.get('observaciones'):
+            observaciones = cita.observaciones_con(cambio['observaciones'], historial.fecha_registro)
+        # Con la misma acción pendiente se conserva el plazo de un worker que la reclamó
+        if misma_accion(cita.estado, cambio['estado_cita']):
+            next_action_at = cita.next_action_at
+        else:
+            next_action_at = proxima_accion(cambio['estado_cita'], cita.fecha_hora_inicio)[1]
+        actualizadas.append(Cita(
+            id=cita.id,
+            estado_actual_id=historial.id,
+            estado=cambio['estado_cita'],
+            observaciones=observaciones,
+            next_action_at=next_action_at,
+            version=F('version') + 1,
+        ))
+    Cita.objects.bulk_update(actualizadas, CAMPOS_ACTUALIZADOS)
+    # bulk_update no emite post_save: encolar aquí la sincronización de calendario
+    EventoCalendario.objects.bulk_create([
+        evento_para(cita, accion)
+        for _, cambio, cita in pendientes
+        for accion in acciones_por_cambio(False, cita.estado, cambio['estado_cita'], False)
+    ])
+    return historiales
+
+
+def cambiar_estados(cambios):
+    """
+    Aplicar una lista de cambios {cita_id, estado_cita, observaciones?, cliente_id?, estados_origen?}.
+
+    Retorna un resultado por cambio, en el mismo orden. Los cambios inválidos,
+    de citas inexistentes o que no pertenecen a cliente_id se reportan sin
+    afectar a los demás. Con ``estados_origen`` el cambio solo se aplica si,
+    ya con la cita bloqueada, su estado sigue siendo uno de esos (si no, error
+    ERROR_ESTADO_CAMBIADO): así quien leyó los IDs sin bloqueo (el programador)
+    no pisa una cancelación o confirmación hecha entre la lectura y el bloqueo. Si alguna cita reactivada choca con otra del mismo
+    profesional (restricción cita_profesional_sin_solape) el lote se reintenta
+    cita por cita, cada una en su propio savepoint, para aislar la que falla.
+    """
+    validos, resultados = _validar(cambios)
+
+    with transaction.atomic():
+        citas = Cita.objects.select_for_update().in_bulk([cambio['cita_id'] for _, cambio in validos])
+        pendientes = []
+        for indice, cambio in validos:
+            cita = citas.get(cambio['cita_id'])
+            cliente_id = cambio.get('cliente_id')
+            estados_origen = cambio.get('estados_origen')
+            if cita is None or (cliente_id is not None and cita.cliente_id != cliente_id):
+                resultados[indice] = _resultado_error(
+                    cambio['cita_id'], 'Cita no encontrada o no pertenece al cliente especificado'
+                )
+            elif estados_origen is not None and cita.estado not in estados_origen:
+                resultados[indice] = _resultado_error(cambio['cita_id'], ERROR_ESTADO_CAMBIADO)
+            else:
+                pendientes.append((indice, cambio, cita))
+
+        aplicados = []
+        if pendientes:
+            try:
+                with transaction.atomic():
+                    historiales = _aplicar(pendientes)
+                aplicados = list(zip(pendientes, historiales))
+            except IntegrityError as e:
+                if not es_solapamiento_profesional(e):
+                    raise
+                logger.warning("Cruce de horario en cambio de estado en lote, aplicando cita por cita")
+                for pendiente in pendientes:
+                    try:
+                        with transaction.atomic():
+                            historiales = _aplicar([pendiente])
+                        aplicados.append((pendiente, historiales[0]))
+                    except IntegrityError as e:
+                        if not es_solapamiento_profesional(e):
+                            raise
+                        resultados[pendiente[0]] = _resultado_error(
+                            pendiente[1]['cita_id'], 'El profesional ya tiene una cita en ese horario'
+                        )
+
+    for (indice, cambio, cita), historial in aplicados:
+        # bulk_update no emite post_save: invalidar la agenda aquí
+        agenda_cache.invalidar(cita.profesional_asignado_id, cita.fecha_hora_inicio, cita.fecha_hora_fin)
+        resultados[indice] = {
+            'cita_id': cita.id,
+            'exito': True,
+            'estado_anterior': cita.estado,
+            'estado_actual': cambio['estado_cita'],
+            'historial_id': historial.id,
+            'fecha_cambio': historial.fecha_registro,
+        }
+
+    return [resultados[indice] for indice in range(len(cambios))]
@@ -0,0 +1,162 @@
+"""
+Filas de citas con información completa (cita, cliente, profesional, producto).
+
+Las usan por-fecha-completo (una página) y la exportación en streaming
+(todo un rango de fechas en NDJSON o CSV). Ninguna función consulta la base
+de datos por fila: las citas deben venir de ``citas_completas()`` o con el
+mismo select_related.
+"""
+import csv
+import json
+import logging
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .calendario import ZONA_COLOMBIA
+from .models import Cita
+
+logger = logging.getLogger(__name__)
+
+# Filas que se leen del cursor del servidor por viaje a la base de datos
+CHUNK_SIZE = 2000
+MAX_DIAS_EXPORTACION = 366
+
+CAMPOS_CITA = [
+    'id', 'fecha_hora_inicio', 'fecha_hora_fin', 'observaciones',
+    'google_calendar_event_id', 'google_calendar_url_event', 'estado_actual',
+]
+CAMPOS_CLIENTE = [
+    'usuario_id', 'nombres', 'apellidos', 'tipo_documento', 'numero_documento', 'email', 'celular',
+    'edad', 'barrio', 'direccion', 'nombre_acudiente', 'remitido_colegio', 'colegio',
+]
+CAMPOS_PROFESIONAL = [
+    'profesional_id', 'nombres', 'apellidos', 'tipo_documento', 'numero_documento', 'email', 'celular',
+    'cargo', 'numero_whatsapp',
+]
+CAMPOS_PRODUCTO = ['producto_id', 'nombre', 'descripcion', 'es_agendable_por_bot', 'duracion_minutos']
+
+GRUPOS_CSV = [
+    ('cita', CAMPOS_CITA),
+    ('cliente', CAMPOS_CLIENTE),
+    ('profesional', CAMPOS_PROFESIONAL),
+    ('producto', CAMPOS_PRODUCTO),
+]
+COLUMNAS_CSV = [f'{grupo}_{campo}' for grupo, campos in GRUPOS_CSV for campo in campos]
+
+
+def citas_completas():
+    """Citas con cliente, profesional (con sus perfiles) y producto en la misma consulta"""
+    return Cita.objects.select_related(
+        'cliente__cliente', 'producto', 'profesional_asignado__profesional'
+    ).order_by('fecha_hora_inicio', 'id')
+
+
+def _fecha_colombia(fecha):
+    return fecha.astimezone(ZONA_COLOMBIA).strftime('%d/%m/%Y %H:%M') if fecha else None
+
+
+def _datos_cliente(usuario):
+    # Perfil Cliente precargado con select_related('cliente__cliente'); None si no existe
+    perfil = getattr(usuario, 'cliente', None)
+    return {
+        'usuario_id': usuario.id,
+        'nombres': usuario.nombres,
+        'apellidos': usuario.apellidos,
+        'tipo_documento': usuario.tipo_documento,
+        'numero_documento': usuario.numero_documento,
+        'email': usuario.email,
+        'celular': usuario.celular,
+        'edad': perfil.edad if perfil else None,
+        'barrio': perfil.barrio if perfil else None,
+        'direccion': perfil.direccion if perfil else None,
+        'nombre_acudiente': perfil.nombre_acudiente if perfil else None,
+        'remitido_colegio': perfil.remitido_colegio if perfil else None,
+        'colegio': perfil.colegio if perfil else None,
+    }
+
+
+def _datos_profesional(usuario):
+    # Perfil Profesional precargado con select_related('profesional_asignado__profesional')
+    perfil = getattr(usuario, 'profesional', None)
+    return {
+        'profesional_id': usuario.id,
+        'nombres': usuario.nombres,
+        'apellidos': usuario.apellidos,
+        'tipo_documento': usuario.tipo_documento,
+        'numero_documento': usuario.numero_documento,
+        'email': usuario.email,
+        'celular': usuario.celular,
+        'cargo': perfil.cargo if perfil else None,
+        'numero_whatsapp': perfil.numero_whatsapp if perfil else None,
+    }
+
+
+def fila_cita_completa(cita):
+    cliente = cita.cliente
+    profesional = cita.profesional_asignado
+    producto = cita.producto
+    return {
+        'cita': {
+            'id': cita.id,
+            'fecha_hora_inicio': _fecha_colombia(cita.fecha_hora_inicio),
+            'fecha_hora_fin': _fecha_colombia(cita.fecha_hora_fin),
+            'observaciones': cita.observaciones,
+            'google_calendar_event_id': cita.google_calendar_event_id,
+            'google_calendar_url_event': cita.google_calendar_url_event,
+            'estado_actual': cita.get_estado_actual_nombre(),
+        },
+        'cliente': _datos_cliente(cliente) if cliente else None,
+        'profesional': _datos_profesional(profesional) if profesional else None,
+        'producto': {
+            'producto_id': producto.id,
+            'nombre': producto.nombre,
+            'descripcion': producto.descripcion,
+            'es_agendable_por_bot': producto.es_agendable_por_bot,
+            'duracion_minutos': producto.duracion_minutos,
+        } if producto else None,
+    }
+
+
+def filas_citas_completas(citas):
+    """Filas de por-fecha-completo para una página de citas"""
+    filas = []
+    sin_perfil = 0
+    for cita in citas:
+        cliente = cita.cliente
+        profesional = cita.profesional_asignado
+        if getattr(cliente, 'cliente', None) is None or (profesional and getattr(profesional, 'profesional', None) is None):
+            sin_perfil += 1
+        filas.append(fila_cita_completa(cita))
+    if sin_perfil:
+        logger.warning(f"{sin_perfil} citas con usuario sin perfil Cliente/Profesional")
+    return filas
+
+
+def aplanar(fila):
+    """Fila completa -> lista de valores en el orden de COLUMNAS_CSV"""
+    valores = []
+    for grupo, campos in GRUPOS_CSV:
+        datos = fila[grupo] or {}
+        valores.extend(datos.get(campo) for campo in campos)
+    return valores
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: retorna la línea en vez de guardarla"""
+
+    def write(self, valor):
+        return valor
+
+
+def lineas_ndjson(queryset):
+    """Una línea JSON por cita, leyendo el queryset por bloques de CHUNK_SIZE"""
+    for cita in queryset.iterator(chunk_size=CHUNK_SIZE):
+        yield json.dumps(fila_cita_completa(cita), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def lineas_csv(queryset):
+    """Encabezado y una línea CSV por cita, leyendo el queryset por bloques de CHUNK_SIZE"""
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(COLUMNAS_CSV)
+    for cita in queryset.iterator(chunk_size=CHUNK_SIZE):
+        yield escritor.writerow(aplanar(fila_cita_completa(cita)))
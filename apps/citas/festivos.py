@@ -0,0 +1,78 @@
+"""
+Cálculo de los festivos nacionales de Colombia.
+
+Según la Ley 51 de 1983 (Ley Emiliani) varios festivos se trasladan al lunes
+siguiente; los de Semana Santa y los que dependen de ella se calculan a partir
+del domingo de Pascua.
+"""
+from datetime import date, timedelta
+
+# Festivos de fecha fija
+FIJOS = [
+    ((1, 1), 'Año Nuevo'),
+    ((5, 1), 'Día del Trabajo'),
+    ((7, 20), 'Día de la Independencia'),
+    ((8, 7), 'Batalla de Boyacá'),
+    ((12, 8), 'Inmaculada Concepción'),
+    ((12, 25), 'Navidad'),
+]
+
+# Festivos que se trasladan al lunes siguiente
+TRASLADABLES = [
+    ((1, 6), 'Día de los Reyes Magos'),
+    ((3, 19), 'Día de San José'),
+    ((6, 29), 'San Pedro y San Pablo'),
+    ((8, 15), 'Asunción de la Virgen'),
+    ((10, 12), 'Día de la Raza'),
+    ((11, 1), 'Todos los Santos'),
+    ((11, 11), 'Independencia de Cartagena'),
+]
+
+# Días después del domingo de Pascua y si se trasladan al lunes siguiente
+RELATIVOS_PASCUA = [
+    (-3, False, 'Jueves Santo'),
+    (-2, False, 'Viernes Santo'),
+    (39, True, 'Ascensión del Señor'),
+    (60, True, 'Corpus Christi'),
+    (68, True, 'Sagrado Corazón'),
+]
+
+
+def domingo_de_pascua(anio):
+    """Fecha del domingo de Pascua (algoritmo de Meeus/Jones/Butcher)"""
+    a = anio % 19
+    b, c = divmod(anio, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes, dia = divmod(h + l - 7 * m + 114, 31)
+    return date(anio, mes, dia + 1)
+
+
+def siguiente_lunes(fecha):
+    """La misma fecha si es lunes; si no, el lunes siguiente"""
+    return fecha + timedelta(days=(7 - fecha.weekday()) % 7)
+
+
+def festivos_colombia(anio):
+    """
+    Lista ordenada de (fecha, nombre) con los festivos del año.
+
+    Si dos festivos caen el mismo día (p. ej. Sagrado Corazón y San Pedro en
+    2025) se retorna una sola fecha con ambos nombres.
+    """
+    festivos = [(date(anio, mes, dia), nombre) for (mes, dia), nombre in FIJOS]
+    festivos += [(siguiente_lunes(date(anio, mes, dia)), nombre) for (mes, dia), nombre in TRASLADABLES]
+    pascua = domingo_de_pascua(anio)
+    for dias, trasladable, nombre in RELATIVOS_PASCUA:
+        fecha = pascua + timedelta(days=dias)
+        festivos.append((siguiente_lunes(fecha) if trasladable else fecha, nombre))
+
+    por_fecha = {}
+    for fecha, nombre in sorted(festivos):
+        por_fecha[fecha] = f"{por_fecha[fecha]} / {nombre}" if fecha in por_fecha else nombre
+    return list(por_fecha.items())
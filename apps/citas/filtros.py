@@ -0,0 +1,84 @@
+"""
+Filtro de rango de fechas para los endpoints que listan citas y los de
+disponibilidad (ver disponibilidad.rango_consulta).
+
+Los parámetros ``fecha_inicio`` / ``fecha_fin`` se convierten en límites
+``[desde, hasta)`` con zona horaria de Colombia y se aplican directamente sobre
+la columna (``fecha_hora_inicio >= desde AND fecha_hora_inicio < hasta``), que
+PostgreSQL resuelve con un range scan del índice. Filtrar con ``__date``
+envuelve la columna en una conversión de zona horaria y cast a fecha y obliga a
+recorrer toda la tabla.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .calendario import ZONA_COLOMBIA
+
+MENSAJE_FORMATO = '{nombre} debe tener formato YYYY-MM-DD o YYYY-MM-DDTHH:MM[:SS]'
+
+
+def parse_limite(valor, nombre, es_fin=False):
+    """
+    Convertir un parámetro de fecha en un datetime con zona horaria.
+
+    - 'YYYY-MM-DD': inicio de ese día en Colombia; si ``es_fin``, inicio del
+      día siguiente (el día completo queda incluido).
+    - 'YYYY-MM-DDTHH:MM[:SS][±HH:MM]': ese instante; sin zona se toma como hora
+      de Colombia. Como límite final es exclusivo.
+
+    Lanza ValueError con el mensaje para el cliente si el formato es inválido.
+    """
+    valor = valor.strip()
+    try:
+        fecha = datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        pass
+    else:
+        if es_fin:
+            fecha += timedelta(days=1)
+        return datetime.combine(fecha, time.min, tzinfo=ZONA_COLOMBIA)
+
+    try:
+        momento = parse_datetime(valor)
+    except ValueError:
+        momento = None
+    if momento is None:
+        raise ValueError(MENSAJE_FORMATO.format(nombre=nombre))
+    if timezone.is_naive(momento):
+        momento = momento.replace(tzinfo=ZONA_COLOMBIA)
+    return momento
+
+
+def rango_desde_parametros(parametros, requerido=False, max_dias=None,
+                           nombre_inicio='fecha_inicio', nombre_fin='fecha_fin'):
+    """
+    Límites (desde, hasta) de los parámetros de la solicitud; None si no se enviaron.
+
+    Lanza ValueError con el mensaje para el cliente si faltan fechas
+    requeridas, el formato es inválido, el rango está invertido o supera
+    ``max_dias``.
+    """
+    fecha_inicio = parametros.get(nombre_inicio) or None
+    fecha_fin = parametros.get(nombre_fin) or None
+    if requerido and (fecha_inicio is None or fecha_fin is None):
+        raise ValueError(f'{nombre_inicio} y {nombre_fin} son requeridos (YYYY-MM-DD)')
+
+    desde = parse_limite(fecha_inicio, nombre_inicio) if fecha_inicio else None
+    hasta = parse_limite(fecha_fin, nombre_fin, es_fin=True) if fecha_fin else None
+    if desde and hasta:
+        if hasta <= desde:
+            raise ValueError(f'{nombre_fin} debe ser igual o posterior a {nombre_inicio}')
+        if max_dias and hasta - desde > timedelta(days=max_dias):
+            raise ValueError(f'El rango máximo es de {max_dias} días')
+    return desde, hasta
+
+
+def filtrar_rango(queryset, desde, hasta, campo='fecha_hora_inicio'):
+    """Aplicar ``campo >= desde`` y ``campo < hasta`` (los límites None se omiten)"""
+    if desde is not None:
+        queryset = queryset.filter(**{f'{campo}__gte': desde})
+    if hasta is not None:
+        queryset = queryset.filter(**{f'{campo}__lt': hasta})
+    return queryset
@@ -0,0 +1,135 @@
+import random
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from apps.citas import calendario, disponibilidad
+from apps.citas.models import (
+    Usuario, Profesional, Producto, ProductoProfesional, Cita, HistorialEstadoCita,
+    TipoUsuarioEnum, TipoDocumentoEnum, EstadoCitaEnum
+)
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Medir el motor de disponibilidad sobre un volumen sintético de citas. "
+        "Los datos se crean dentro de una transacción que se revierte al final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--citas', type=int, default=100000)
+        parser.add_argument('--profesionales', type=int, default=40)
+        parser.add_argument('--dias', type=int, default=365, help='Días sobre los que se reparten las citas')
+        parser.add_argument('--rango', type=int, default=7, help='Días consultados por medición')
+        parser.add_argument('--repeticiones', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise _Rollback()
+        except _Rollback:
+            self.stdout.write("Datos sintéticos revertidos")
+
+    def run(self, options):
+        inicio_datos = date.today() + timedelta(days=1)
+        producto, profesional_ids = self.crear_catalogo(options['profesionales'])
+
+        t0 = time.perf_counter()
+        self.crear_citas(options['citas'], profesional_ids, producto, inicio_datos, options['dias'])
+        self.stdout.write(f"{options['citas']} citas creadas en {time.perf_counter() - t0:.1f}s")
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Cita._meta.db_table}, {HistorialEstadoCita._meta.db_table}")
+
+        tiempos = []
+        total_slots = 0
+        for _ in range(options['repeticiones']):
+            desde = inicio_datos + timedelta(days=random.randrange(max(options['dias'] - options['rango'], 1)))
+            hasta = desde + timedelta(days=options['rango'] - 1)
+            t0 = time.perf_counter()
+            libres = disponibilidad.disponibilidad_por_profesional(producto, profesional_ids, desde, hasta)
+            slots = disponibilidad.combinar_slots(libres)
+            tiempos.append((time.perf_counter() - t0) * 1000)
+            total_slots += len(slots)
+
+        tiempos.sort()
+        self.stdout.write(self.style.SUCCESS(
+            f"Disponibilidad {options['rango']} días x {len(profesional_ids)} profesionales: "
+            f"p50={tiempos[len(tiempos) // 2]:.1f}ms "
+            f"p95={tiempos[int(len(tiempos) * 0.95) - 1]:.1f}ms "
+            f"max={tiempos[-1]:.1f}ms "
+            f"(slots promedio: {total_slots // len(tiempos)})"
+        ))
+
+    def crear_catalogo(self, cantidad):
+        producto = Producto.objects.create(nombre='Benchmark disponibilidad', duracion_minutos=60)
+        profesional_ids = []
+        for n in range(cantidad):
+            usuario = Usuario.objects.create(
+                nombres=f'Profesional {n}', apellidos='Benchmark',
+                tipo_documento=TipoDocumentoEnum.CC, numero_documento=f'bench-prof-{n}',
+                celular='3000000000', tipo=TipoUsuarioEnum.PROFESIONAL
+            )
+            Profesional.objects.create(usuario=usuario, numero_whatsapp=f'57300{n:07d}')
+            ProductoProfesional.objects.create(producto=producto, profesional=usuario)
+            profesional_ids.append(usuario.id)
+        return producto, profesional_ids
+
+    def crear_citas(self, cantidad, profesional_ids, producto, inicio_datos, dias):
+        cliente = Usuario.objects.create(
+            nombres='Cliente', apellidos='Benchmark',
+            tipo_documento=TipoDocumentoEnum.CC, numero_documento='bench-cliente',
+            celular='3000000000', tipo=TipoUsuarioEnum.CLIENTE
+        )
+        # Horarios candidatos en bloques de una hora dentro del horario de atención.
+        # Las citas activas no pueden cruzarse (restricción cita_profesional_sin_solape),
+        # así que se toman sin repetir; las canceladas (10%) pueden caer en cualquiera.
+        duracion = timedelta(minutes=producto.duracion_minutos)
+        candidatos = []
+        for jornada in calendario.jornadas(inicio_datos, inicio_datos + timedelta(days=dias - 1)):
+            apertura, ultimo_inicio, cierre = jornada
+            inicio = apertura
+            while inicio <= ultimo_inicio and inicio + duracion <= cierre:
+                candidatos.extend((profesional_id, inicio) for profesional_id in profesional_ids)
+                inicio += max(duracion, timedelta(hours=1))
+        canceladas = sum(1 for _ in range(cantidad) if random.random() < 0.1)
+        activas = min(cantidad - canceladas, len(candidatos))
+        if activas < cantidad - canceladas:
+            self.stdout.write(self.style.WARNING(
+                f"Solo caben {activas} citas activas sin cruces; use más --profesionales o --dias"
+            ))
+
+        horarios = [(h, EstadoCitaEnum.AGENDADO) for h in random.sample(candidatos, activas)]
+        horarios += [(random.choice(candidatos), EstadoCitaEnum.CANCELADO) for _ in range(canceladas)]
+        lote = [
+            Cita(
+                cliente=cliente, producto=producto,
+                profesional_asignado_id=profesional_id,
+                fecha_hora_inicio=inicio,
+                fecha_hora_fin=inicio + duracion,
+                estado=estado,
+            )
+            for (profesional_id, inicio), estado in horarios
+        ]
+        citas = Cita.objects.bulk_create(lote, batch_size=5000)
+
+        # Historial inicial de cada cita y enlace a estado_actual en una sentencia
+        HistorialEstadoCita.objects.bulk_create([
+            HistorialEstadoCita(cita=cita, estado_cita=cita.estado)
+            for cita in citas
+        ], batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                UPDATE {Cita._meta.db_table} c SET estado_actual_id = h.id
+                FROM {HistorialEstadoCita._meta.db_table} h
+                WHERE h.cita_id = c.id AND c.cliente_id = %s
+            """, [cliente.id])
@@ -0,0 +1,28 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from apps.citas.festivos import festivos_colombia
+from apps.citas.models import DiaFestivo
+
+
+class Command(BaseCommand):
+    help = (
+        "Cargar los festivos nacionales de Colombia de uno o varios años. "
+        "Las fechas que ya existen no se modifican."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'anios', nargs='*', type=int,
+            help='Años a cargar (por defecto el actual y el siguiente)'
+        )
+
+    def handle(self, *args, **options):
+        anios = options['anios'] or [date.today().year, date.today().year + 1]
+        for anio in anios:
+            creados = DiaFestivo.objects.bulk_create(
+                [DiaFestivo(fecha=fecha, nombre=nombre) for fecha, nombre in festivos_colombia(anio)],
+                ignore_conflicts=True,
+            )
+            self.stdout.write(self.style.SUCCESS(f"{anio}: {len(creados)} festivos procesados"))
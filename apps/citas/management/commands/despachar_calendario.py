@@ -0,0 +1,66 @@
+import logging
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+
+from apps.citas import sincronizacion_calendario
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Enviar a Google Calendar los eventos pendientes de la outbox de citas, "
+        "con reintentos y espera exponencial. Puede correr en varias réplicas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=int, default=10, help='Segundos de espera cuando no hay eventos')
+        parser.add_argument('--lote', type=int, default=sincronizacion_calendario.MAX_LOTE, help='Eventos por lote')
+        parser.add_argument('--una-vez', action='store_true', help='Vaciar la cola una vez y terminar (cron)')
+
+    def handle(self, *args, **options):
+        self.detener = False
+        signal.signal(signal.SIGTERM, self.solicitar_detener)
+        signal.signal(signal.SIGINT, self.solicitar_detener)
+
+        transporte = sincronizacion_calendario.obtener_transporte()
+        totales = {'enviados': 0, 'descartados': 0, 'reintentos': 0, 'fallidos': 0}
+        try:
+            while not self.detener:
+                lote_completo = False
+                try:
+                    resumen = sincronizacion_calendario.despachar(options['lote'], transporte)
+                    procesados = sum(resumen.values())
+                    lote_completo = procesados >= options['lote']
+                    if procesados:
+                        for clave, cantidad in resumen.items():
+                            totales[clave] += cantidad
+                        self.stdout.write(
+                            ', '.join(f'{clave}={cantidad}' for clave, cantidad in resumen.items())
+                        )
+                except DatabaseError as e:
+                    logger.error(f"Error de base de datos en el despachador de calendario: {str(e)}")
+                    connection.close()
+
+                # Con un lote completo probablemente quedan más: seguir sin esperar
+                if lote_completo and not self.detener:
+                    continue
+                if options['una_vez']:
+                    break
+                self.esperar(options['intervalo'])
+        finally:
+            self.stdout.write(
+                "Despachador detenido: " + ', '.join(f'{clave}={cantidad}' for clave, cantidad in totales.items())
+            )
+
+    def solicitar_detener(self, signum, frame):
+        self.detener = True
+
+    def esperar(self, segundos):
+        # Dormir en pasos cortos para atender SIGTERM sin esperar el intervalo completo
+        limite = time.monotonic() + segundos
+        while not self.detener and time.monotonic() < limite:
+            time.sleep(min(1, limite - time.monotonic()))
@@ -0,0 +1,76 @@
+import logging
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+
+from apps.citas import programador
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Avanzar automáticamente los estados de las citas según la hora "
+        "(Pendiente 24h, Pendiente 6h, Finalizado / No Asistió). Puede correr en "
+        "varias réplicas: solo la que tiene el advisory lock aplica cambios."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=int, default=60, help='Segundos entre ciclos')
+        parser.add_argument('--lote', type=int, default=200, help='Citas por transacción')
+        parser.add_argument('--dry-run', action='store_true', help='Solo reportar las transiciones vencidas')
+        parser.add_argument('--una-vez', action='store_true', help='Ejecutar un solo ciclo y terminar (cron)')
+
+    def handle(self, *args, **options):
+        self.detener = False
+        signal.signal(signal.SIGTERM, self.solicitar_detener)
+        signal.signal(signal.SIGINT, self.solicitar_detener)
+
+        metricas = programador.Metricas()
+        es_lider = False
+        try:
+            while not self.detener:
+                try:
+                    if not options['dry_run'] and not es_lider:
+                        es_lider = programador.tomar_liderazgo()
+                        if es_lider:
+                            self.stdout.write(self.style.SUCCESS("Liderazgo obtenido; aplicando transiciones"))
+                        else:
+                            logger.info("Otra réplica tiene el liderazgo; en espera")
+
+                    if options['dry_run'] or es_lider:
+                        t0 = time.perf_counter()
+                        movidas = programador.ejecutar_ciclo(options['lote'], dry_run=options['dry_run'])
+                        segundos = time.perf_counter() - t0
+                        metricas.registrar(movidas, segundos)
+                        prefijo = '[dry-run] ' if options['dry_run'] else ''
+                        self.stdout.write(prefijo + metricas.resumen(movidas, segundos))
+                except DatabaseError as e:
+                    # Si se pierde la conexión se pierde el lock: volver a competir por él
+                    logger.error(f"Error de base de datos en el programador: {str(e)}")
+                    es_lider = False
+                    connection.close()
+
+                if options['una_vez']:
+                    break
+                self.esperar(options['intervalo'])
+        finally:
+            if es_lider:
+                try:
+                    programador.soltar_liderazgo()
+                except DatabaseError:
+                    pass
+            self.stdout.write(
+                f"Programador detenido: {metricas.movidas} citas en {metricas.ciclos} ciclos"
+            )
+
+    def solicitar_detener(self, signum, frame):
+        self.detener = True
+
+    def esperar(self, segundos):
+        # Dormir en pasos cortos para atender SIGTERM sin esperar el intervalo completo
+        limite = time.monotonic() + segundos
+        while not self.detener and time.monotonic() < limite:
+            time.sleep(min(1, limite - time.monotonic()))
@@ -0,0 +1,36 @@
+import time
+
+from .authentication import ApiKeyUser
+from .usage import usage_buffer
+
+
+class ApiKeyUsageMiddleware:
+    """
+    Registrar cada request autenticado con API Key en los agregados por hora.
+
+    Solo acumula en memoria (ver apps.citas.usage); la escritura en la base de
+    datos ocurre en lote con el resto de estadísticas de uso.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        inicio = time.monotonic()
+        response = self.get_response(request)
+
+        # DRF asigna el usuario autenticado también al HttpRequest original
+        user = getattr(request, 'user', None)
+        if isinstance(user, ApiKeyUser):
+            latency_ms = (time.monotonic() - inicio) * 1000
+            usage_buffer.record_request(
+                user.api_key.pk, self.get_endpoint(request), response.status_code, latency_ms
+            )
+
+        return response
+
+    @staticmethod
+    def get_endpoint(request):
+        match = getattr(request, 'resolver_match', None)
+        nombre = match.view_name if match and match.view_name else request.path
+        return f"{request.method} {nombre}"[:200]
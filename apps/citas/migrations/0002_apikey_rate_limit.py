@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiKeyTokenBucket',
+            fields=[
+                ('api_key', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='token_bucket', serialize=False, to='citas.apikey')),
+                ('tokens', models.FloatField()),
+                ('updated_at', models.DateTimeField()),
+                ('allowed', models.BooleanField(default=True)),
+            ],
+            options={
+                'verbose_name': 'Token bucket de API Key',
+                'verbose_name_plural': 'Token buckets de API Keys',
+            },
+        ),
+        migrations.AddField(
+            model_name='apikey',
+            name='rate_limit_burst',
+            field=models.PositiveIntegerField(blank=True, help_text='Ráfaga máxima de solicitudes seguidas (vacío = igual al límite por minuto)', null=True),
+        ),
+        migrations.AddField(
+            model_name='apikey',
+            name='rate_limit_per_minute',
+            field=models.PositiveIntegerField(blank=True, help_text='Solicitudes por minuto permitidas (vacío = límite global por defecto, 0 = sin límite)', null=True),
+        ),
+    ]
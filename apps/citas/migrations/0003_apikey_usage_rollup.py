@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0002_apikey_rate_limit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiKeyUsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(help_text='Inicio de la hora agregada')),
+                ('endpoint', models.CharField(help_text='Método HTTP y nombre de la ruta', max_length=200)),
+                ('request_count', models.PositiveIntegerField(default=0)),
+                ('error_count', models.PositiveIntegerField(default=0)),
+                ('total_latency_ms', models.FloatField(default=0)),
+                ('api_key', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_rollups', to='citas.apikey')),
+            ],
+            options={
+                'verbose_name': 'Uso por hora de API Key',
+                'verbose_name_plural': 'Uso por hora de API Keys',
+                'ordering': ['-hour'],
+                'indexes': [models.Index(fields=['-hour'], name='apikey_rollup_hour_desc_idx')],
+                'constraints': [models.UniqueConstraint(fields=('api_key', 'hour', 'endpoint'), name='apikey_rollup_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:09
+
+import apps.citas.models
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+
+MAX_SOLAPAMIENTOS_REPORTE = 50
+
+
+def verificar_solapamientos(apps, schema_editor):
+    """
+    Abortar con la lista de citas en conflicto si ya hay citas no canceladas
+    del mismo profesional que se solapan (la restricción fallaría con un
+    IntegrityError sin indicar cuáles). No se resuelven automáticamente:
+    hay que cancelar o reprogramar una de cada par y volver a migrar.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            """
+                SELECT a.profesional_asignado_id, a.id, a.fecha_hora_inicio, a.fecha_hora_fin,
+                       b.id, b.fecha_hora_inicio, b.fecha_hora_fin
+                FROM citas_cita a
+                JOIN citas_cita b
+                  ON b.profesional_asignado_id = a.profesional_asignado_id
+                 AND b.id > a.id
+                 AND tstzrange(a.fecha_hora_inicio, a.fecha_hora_fin) && tstzrange(b.fecha_hora_inicio, b.fecha_hora_fin)
+                WHERE a.estado <> 'Cancelado' AND b.estado <> 'Cancelado'
+                ORDER BY a.profesional_asignado_id, a.fecha_hora_inicio, a.id, b.id
+                LIMIT %s
+            """,
+            [MAX_SOLAPAMIENTOS_REPORTE + 1],
+        )
+        filas = cursor.fetchall()
+    if not filas:
+        return
+
+    lineas = [
+        f'  profesional {profesional_id}: cita {id_a} ({inicio_a:%Y-%m-%d %H:%M}-{fin_a:%H:%M}) '
+        f'y cita {id_b} ({inicio_b:%Y-%m-%d %H:%M}-{fin_b:%H:%M})'
+        for profesional_id, id_a, inicio_a, fin_a, id_b, inicio_b, fin_b in filas[:MAX_SOLAPAMIENTOS_REPORTE]
+    ]
+    if len(filas) > MAX_SOLAPAMIENTOS_REPORTE:
+        lineas.append(f'  ... (se muestran los primeros {MAX_SOLAPAMIENTOS_REPORTE})')
+    raise RuntimeError(
+        'No se puede crear la restricción cita_profesional_sin_solape: hay citas no canceladas '
+        'del mismo profesional que se solapan (horas en UTC). Cancele o reprograme una de cada '
+        'par y vuelva a ejecutar migrate.\n' + '\n'.join(lineas)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0003_apikey_usage_rollup'),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.AddField(
+            model_name='cita',
+            name='estado',
+            field=models.CharField(choices=[('Agendado', 'Agendado'), ('Notificado Profesional', 'Notificado Profesional'), ('Pendiente Primer Confirmación 24 Horas', 'Pendiente Primer Confirmación 24 Horas'), ('Pendiente Primer Confirmación 24 Horas Mensaje Enviado', 'Pendiente Primer Confirmación 24 Horas Mensaje Enviado'), ('Primer Confirmado', 'Primer Confirmado'), ('Pendiente Segunda Confirmación 6 Horas', 'Pendiente Segunda Confirmación 6 Horas'), ('Pendiente Segunda Confirmación 6 Horas Mensaje Enviado', 'Pendiente Segunda Confirmación 6 Horas Mensaje Enviado'), ('Segundo Confirmado', 'Segundo Confirmado'), ('Informado Agente 3h', 'Informado Agente 3h'), ('Finalizado', 'Finalizado'), ('Cancelado', 'Cancelado'), ('No Asistió', 'No Asistió')], default='Agendado', editable=False, max_length=100),
+        ),
+        # Copiar el estado actual de las citas existentes antes de crear la restricción
+        migrations.RunSQL(
+            sql="""
+                UPDATE citas_cita c SET estado = h.estado_cita
+                FROM citas_historialestadocita h
+                WHERE h.id = c.estado_actual_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunPython(verificar_solapamientos, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cita',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('estado', 'Cancelado'), _negated=True), expressions=[('profesional_asignado', '='), (apps.citas.models.TsTzRange('fecha_hora_inicio', 'fecha_hora_fin', django.contrib.postgres.fields.ranges.RangeBoundary()), '&&')], name='cita_profesional_sin_solape', violation_error_message='El profesional ya tiene una cita en ese horario'),
+        ),
+    ]
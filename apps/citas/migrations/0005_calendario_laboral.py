@@ -0,0 +1,83 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:15
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def cargar_calendario_inicial(apps, schema_editor):
+    """Horario que antes estaba fijo en el código y festivos de Colombia 2025-2030"""
+    from apps.citas.festivos import festivos_colombia
+
+    HorarioAtencion = apps.get_model('citas', 'HorarioAtencion')
+    DiaFestivo = apps.get_model('citas', 'DiaFestivo')
+
+    semana = (datetime.time(8, 0), datetime.time(18, 0), datetime.time(19, 0))
+    sabado = (datetime.time(8, 0), datetime.time(12, 0), datetime.time(13, 0))
+    HorarioAtencion.objects.bulk_create([
+        HorarioAtencion(dia_semana=dia, hora_apertura=apertura, hora_ultimo_inicio=ultimo_inicio, hora_cierre=cierre)
+        for dia, (apertura, ultimo_inicio, cierre) in [(d, semana) for d in range(5)] + [(5, sabado)]
+    ])
+    DiaFestivo.objects.bulk_create([
+        DiaFestivo(fecha=fecha, nombre=nombre)
+        for anio in range(2025, 2031)
+        for fecha, nombre in festivos_colombia(anio)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0004_cita_profesional_sin_solape'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiaFestivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(unique=True)),
+                ('nombre', models.CharField(max_length=150)),
+            ],
+            options={
+                'verbose_name': 'Día festivo',
+                'verbose_name_plural': 'Días festivos',
+                'ordering': ['fecha'],
+            },
+        ),
+        migrations.CreateModel(
+            name='HorarioAtencion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia_semana', models.PositiveSmallIntegerField(choices=[(0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'), (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo')], unique=True)),
+                ('hora_apertura', models.TimeField()),
+                ('hora_ultimo_inicio', models.TimeField(help_text='Última hora a la que puede iniciar una cita')),
+                ('hora_cierre', models.TimeField(help_text='Hora límite de finalización de las citas')),
+            ],
+            options={
+                'verbose_name': 'Horario de atención',
+                'verbose_name_plural': 'Horarios de atención',
+                'ordering': ['dia_semana'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ExcepcionHorario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(db_index=True)),
+                ('hora_apertura', models.TimeField(blank=True, null=True)),
+                ('hora_ultimo_inicio', models.TimeField(blank=True, null=True)),
+                ('hora_cierre', models.TimeField(blank=True, null=True)),
+                ('motivo', models.CharField(blank=True, max_length=255)),
+                ('profesional', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='excepciones_horario', to='citas.usuario')),
+            ],
+            options={
+                'verbose_name': 'Excepción de horario',
+                'verbose_name_plural': 'Excepciones de horario',
+                'ordering': ['fecha'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('profesional__isnull', False)), fields=('profesional', 'fecha'), name='excepcion_profesional_fecha_unique'), models.UniqueConstraint(condition=models.Q(('profesional__isnull', True)), fields=('fecha',), name='excepcion_general_fecha_unique'), models.CheckConstraint(condition=models.Q(models.Q(('hora_apertura__isnull', True), ('hora_cierre__isnull', True), ('hora_ultimo_inicio__isnull', True)), models.Q(('hora_apertura__isnull', False), ('hora_cierre__isnull', False), ('hora_ultimo_inicio__isnull', False)), _connector='OR'), name='excepcion_horas_completas')],
+            },
+        ),
+        migrations.RunPython(cargar_calendario_inicial, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0005_calendario_laboral'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cita',
+            name='next_action_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        # Siguiente recordatorio de las citas futuras (mismo cálculo que recordatorios.proxima_accion)
+        migrations.RunSQL(
+            sql="""
+                UPDATE citas_cita SET next_action_at = fecha_hora_inicio - CASE
+                    WHEN estado IN ('Agendado', 'Notificado Profesional', 'Pendiente Primer Confirmación 24 Horas')
+                        THEN INTERVAL '24 hours'
+                    WHEN estado IN ('Pendiente Primer Confirmación 24 Horas Mensaje Enviado', 'Primer Confirmado', 'Pendiente Segunda Confirmación 6 Horas')
+                        THEN INTERVAL '6 hours'
+                    WHEN estado IN ('Pendiente Segunda Confirmación 6 Horas Mensaje Enviado', 'Segundo Confirmado')
+                        THEN INTERVAL '3 hours'
+                END
+                WHERE fecha_hora_inicio > now()
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(condition=models.Q(('next_action_at__isnull', False)), fields=['next_action_at'], name='cita_next_action_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0006_cita_next_action_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='cita',
+            name='cita_estado_fecha_idx',
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(condition=models.Q(('estado__in', ('Agendado', 'Notificado Profesional', 'Pendiente Primer Confirmación 24 Horas', 'Pendiente Primer Confirmación 24 Horas Mensaje Enviado', 'Primer Confirmado', 'Pendiente Segunda Confirmación 6 Horas', 'Pendiente Segunda Confirmación 6 Horas Mensaje Enviado', 'Segundo Confirmado', 'Informado Agente 3h'))), fields=['fecha_hora_inicio'], include=('id',), name='cita_activa_inicio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(condition=models.Q(('estado__in', ('Agendado', 'Notificado Profesional', 'Pendiente Primer Confirmación 24 Horas', 'Pendiente Primer Confirmación 24 Horas Mensaje Enviado', 'Primer Confirmado', 'Pendiente Segunda Confirmación 6 Horas', 'Pendiente Segunda Confirmación 6 Horas Mensaje Enviado', 'Segundo Confirmado', 'Informado Agente 3h'))), fields=['estado', 'fecha_hora_inicio'], include=('id',), name='cita_activa_estado_inicio_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0007_cita_indices_activas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoCalendario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('accion', models.CharField(choices=[('crear', 'Crear evento'), ('actualizar', 'Actualizar evento'), ('eliminar', 'Eliminar evento')], max_length=20)),
+                ('google_calendar_event_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('enviado', 'Enviado'), ('fallido', 'Fallido'), ('descartado', 'Descartado')], default='pendiente', max_length=20)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('proximo_intento', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ultimo_error', models.TextField(blank=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_envio', models.DateTimeField(blank=True, null=True)),
+                ('cita', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='eventos_calendario', to='citas.cita')),
+            ],
+            options={
+                'verbose_name': 'Evento de calendario',
+                'verbose_name_plural': 'Eventos de calendario',
+                'ordering': ['-id'],
+                'indexes': [models.Index(condition=models.Q(('estado', 'pendiente')), fields=['proximo_intento'], name='evento_cal_pendiente_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0008_evento_calendario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionTabla',
+            fields=[
+                ('tabla', models.CharField(max_length=63, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=0)),
+                ('fecha_modificacion', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Versión de tabla',
+                'verbose_name_plural': 'Versiones de tablas',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0009_version_tabla'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historialestadocita',
+            name='estado_cita',
+            field=models.CharField(choices=[('Agendado', 'Agendado'), ('Notificado Profesional', 'Notificado Profesional'), ('Pendiente Primer Confirmación 24 Horas', 'Pendiente Primer Confirmación 24 Horas'), ('Pendiente Primer Confirmación 24 Horas Mensaje Enviado', 'Pendiente Primer Confirmación 24 Horas Mensaje Enviado'), ('Primer Confirmado', 'Primer Confirmado'), ('Pendiente Segunda Confirmación 6 Horas', 'Pendiente Segunda Confirmación 6 Horas'), ('Pendiente Segunda Confirmación 6 Horas Mensaje Enviado', 'Pendiente Segunda Confirmación 6 Horas Mensaje Enviado'), ('Segundo Confirmado', 'Segundo Confirmado'), ('Informado Agente 3h', 'Informado Agente 3h'), ('Finalizado', 'Finalizado'), ('Cancelado', 'Cancelado'), ('No Asistió', 'No Asistió')], db_index=True, max_length=100),
+        ),
+    ]
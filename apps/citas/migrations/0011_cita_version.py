@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0010_historialestadocita_estado_cita_choices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cita',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -1,5 +1,9 @@
-from django.db import models
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeBoundary, RangeOperators
+from django.db import connections, models, transaction
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+import re
 import secrets
 import string
 
@@ -30,6 +34,41 @@ class EstadoCitaEnum(models.TextChoices):
     NO_ASISTIO = 'No Asistió', _('No Asistió')
 
 
+# Estados tras los cuales la cita ya no avanza en el pipeline
+ESTADOS_TERMINALES = (EstadoCitaEnum.FINALIZADO, EstadoCitaEnum.CANCELADO, EstadoCitaEnum.NO_ASISTIO)
+# Citas activas: las que cubren los índices parciales de Cita
+ESTADOS_ACTIVOS = tuple(estado for estado in EstadoCitaEnum if estado not in ESTADOS_TERMINALES)
+
+
+class AccionCalendarioEnum(models.TextChoices):
+    CREAR = 'crear', _('Crear evento')
+    ACTUALIZAR = 'actualizar', _('Actualizar evento')
+    ELIMINAR = 'eliminar', _('Eliminar evento')
+
+
+class EstadoEventoCalendarioEnum(models.TextChoices):
+    PENDIENTE = 'pendiente', _('Pendiente')
+    ENVIADO = 'enviado', _('Enviado')
+    FALLIDO = 'fallido', _('Fallido')
+    DESCARTADO = 'descartado', _('Descartado')
+
+
+class DiaSemanaEnum(models.IntegerChoices):
+    LUNES = 0, _('Lunes')
+    MARTES = 1, _('Martes')
+    MIERCOLES = 2, _('Miércoles')
+    JUEVES = 3, _('Jueves')
+    VIERNES = 4, _('Viernes')
+    SABADO = 5, _('Sábado')
+    DOMINGO = 6, _('Domingo')
+
+
+class TsTzRange(models.Func):
+    """Rango tstzrange de PostgreSQL a partir de dos columnas de fecha"""
+    function = 'TSTZRANGE'
+    output_field = DateTimeRangeField()
+
+
 class Usuario(models.Model):
     nombres = models.CharField(max_length=255, db_index=True)
     apellidos = models.CharField(max_length=255, db_index=True)
@@ -50,10 +89,190 @@ class Usuario(models.Model):
         return f"{self.nombres} {self.apellidos} ({self.tipo})"
 
 
+def _sql_merge_patch(raiz, parche, a_json, ruta=()):
+    """
+    (sql, params) de aplicar el merge patch RFC 7396 ``parche`` sobre la
+    expresión jsonb ``raiz`` en la posición ``ruta``.
+
+    Un objeto se fusiona clave por clave (null elimina la clave, un objeto se
+    fusiona recursivamente); cualquier otro valor reemplaza al destino. Un
+    destino que no es objeto se trata como ``{}``.
+    """
+    if not isinstance(parche, dict):
+        return '%s::jsonb', [a_json(parche)]
+    if ruta:
+        destino, params_destino = f'({raiz} #> %s::text[])', [list(ruta)]
+    else:
+        destino, params_destino = raiz, []
+    sql = f"(CASE WHEN jsonb_typeof({destino}) = 'object' THEN {destino} ELSE '{{}}'::jsonb END)"
+    params = params_destino * 2
+
+    eliminar = [clave for clave, valor in parche.items() if valor is None]
+    if eliminar:
+        sql = f'({sql} - %s::text[])'
+        params.append(eliminar)
+    for clave, valor in parche.items():
+        if valor is None:
+            continue
+        sql_valor, params_valor = _sql_merge_patch(raiz, valor, a_json, ruta + (clave,))
+        sql = f'({sql} || jsonb_build_object(%s::text, {sql_valor}))'
+        params += [clave] + params_valor
+    return sql, params
+
+
+_INDICE = re.compile(r'-?[0-9]+')
+
+
+class RutasNoAplicables(Exception):
+    """
+    Operaciones por ruta de EstadoChat.objects.fusionar() que no se pueden
+    aplicar al estado guardado; ``indices`` son sus posiciones en ``rutas``.
+    """
+
+    def __init__(self, indices):
+        super().__init__(f'Rutas no aplicables: {indices}')
+        self.indices = indices
+
+
+def _sql_rutas(rutas, a_json):
+    """
+    (sql, params, aplicables) de las operaciones por ruta ({'ruta': [...],
+    'valor': x} o {'ruta': [...], 'eliminar': True}) como una cadena de
+    LATERAL: el paso ``r{n}`` parte del estado ``r{n-1}.estado``.
+
+    Una asignación es aplicable si existe el objeto o arreglo padre (en un
+    arreglo la última clave debe ser un índice) y una eliminación si existe la
+    ruta. Una operación no aplicable deja el estado igual; ``aplicables`` son
+    las columnas booleanas de cada operación, en orden.
+    """
+    sql, params, aplicables = [], [], []
+    for n, operacion in enumerate(rutas, start=1):
+        anterior = f'r{n - 1}.estado'
+        ruta = list(operacion['ruta'])
+        if operacion.get('eliminar'):
+            condicion, params_condicion = f'({anterior} #> %s::text[]) IS NOT NULL', [ruta]
+            cambio, params_cambio = f'({anterior} #- %s::text[])', [ruta]
+        else:
+            condicion = (
+                f"CASE jsonb_typeof({anterior} #> %s::text[]) "
+                f"WHEN 'object' THEN true WHEN 'array' THEN %s ELSE false END"
+            )
+            params_condicion = [ruta[:-1], bool(_INDICE.fullmatch(ruta[-1]))]
+            cambio = f'jsonb_set({anterior}, %s::text[], %s::jsonb, true)'
+            params_cambio = [ruta, a_json(operacion['valor'])]
+        sql.append(
+            f'CROSS JOIN LATERAL (SELECT {condicion}) AS a{n}(aplicable) '
+            f'CROSS JOIN LATERAL (SELECT CASE WHEN a{n}.aplicable THEN {cambio} ELSE {anterior} END) AS r{n}(estado)'
+        )
+        params += params_condicion + params_cambio
+        aplicables.append(f'a{n}.aplicable')
+    return ' '.join(sql), params, aplicables
+
+
+class EstadoChatManager(models.Manager):
+    """Escrituras de EstadoChat en una sola consulta (sin SELECT previo ni posterior)"""
+
+    def guardar(self, numero_whatsapp, estado_conversacion):
+        """
+        Crear o reemplazar el estado del número con
+        ``INSERT ... ON CONFLICT (numero_whatsapp) DO UPDATE ... RETURNING``.
+
+        Retorna (estado_chat, creado). Dos escrituras concurrentes del mismo
+        número no chocan con la restricción única: la segunda actualiza.
+        """
+        tabla = self.model._meta.db_table
+        sql = (
+            f'INSERT INTO {tabla} (numero_whatsapp, estado_conversacion) VALUES (%s, %s) '
+            f'ON CONFLICT (numero_whatsapp) DO UPDATE SET estado_conversacion = EXCLUDED.estado_conversacion '
+            f'RETURNING id, (xmax = 0) AS creado'
+        )
+        estado_chat_id, creado = self._ejecutar(sql, [numero_whatsapp, self._json(estado_conversacion)])
+        return self._instancia(estado_chat_id, numero_whatsapp, estado_conversacion), creado
+
+    def actualizar(self, numero_whatsapp, estado_conversacion):
+        """Reemplazar el estado de un número existente (UPDATE ... RETURNING); None si no existe"""
+        tabla = self.model._meta.db_table
+        sql = f'UPDATE {tabla} SET estado_conversacion = %s WHERE numero_whatsapp = %s RETURNING id'
+        fila = self._ejecutar(sql, [self._json(estado_conversacion), numero_whatsapp])
+        if fila is None:
+            return None
+        return self._instancia(fila[0], numero_whatsapp, estado_conversacion)
+
+    def fusionar(self, numero_whatsapp, parche=None, rutas=()):
+        """
+        Modificar estado_conversacion en la base de datos, sin leerlo antes.
+
+        ``parche`` es un merge patch (RFC 7396) y ``rutas`` una lista de
+        operaciones ``{'ruta': ['a', 'b'], 'valor': x}`` (jsonb_set) o
+        ``{'ruta': [...], 'eliminar': True}`` (#-), aplicadas después del
+        parche. jsonb_set no crea objetos intermedios: para anidar claves
+        nuevas se usa el parche.
+
+        Todo se resuelve en una consulta: el SELECT ... FOR UPDATE calcula el
+        estado nuevo sobre la fila vigente (así dos webhooks simultáneos del
+        mismo número no pierden las claves del otro) y el UPDATE lo guarda
+        solo si todas las rutas son aplicables.
+
+        Retorna el estado_chat con el estado resultante, o None si el número
+        no tiene estado. Si alguna ruta no es aplicable (padre inexistente o
+        escalar, clave a eliminar inexistente) no modifica nada y lanza
+        RutasNoAplicables.
+        """
+        tabla = self.model._meta.db_table
+        sql_estado, params = 't.estado_conversacion', []
+        if parche is not None:
+            sql_estado, params = _sql_merge_patch(sql_estado, parche, self._json)
+        sql_rutas, params_rutas, aplicables = _sql_rutas(rutas, self._json)
+        sql = (
+            f'WITH calculo AS ('
+            f'SELECT t.id, r{len(aplicables)}.estado, ARRAY[{", ".join(aplicables)}]::boolean[] AS aplicables '
+            f'FROM {tabla} t CROSS JOIN LATERAL (SELECT {sql_estado}) AS r0(estado) {sql_rutas} '
+            f'WHERE t.numero_whatsapp = %s FOR UPDATE OF t'
+            f'), actualizada AS ('
+            f'UPDATE {tabla} SET estado_conversacion = calculo.estado FROM calculo '
+            f'WHERE {tabla}.id = calculo.id AND true = ALL(calculo.aplicables)'
+            f') SELECT id, estado, aplicables FROM calculo'
+        )
+        fila = self._ejecutar(sql, params + params_rutas + [numero_whatsapp])
+        if fila is None:
+            return None
+        estado_chat_id, estado, resultados = fila
+        no_aplicables = [indice for indice, aplicable in enumerate(resultados) if not aplicable]
+        if no_aplicables:
+            raise RutasNoAplicables(no_aplicables)
+        campo = self.model._meta.get_field('estado_conversacion')
+        estado_conversacion = campo.from_db_value(estado, None, connections[self.db])
+        return self._instancia(estado_chat_id, numero_whatsapp, estado_conversacion)
+
+    def _json(self, valor):
+        if valor is None:
+            # null de JSON (p. ej. asignado por ruta), no NULL de SQL
+            return 'null'
+        campo = self.model._meta.get_field('estado_conversacion')
+        return campo.get_db_prep_save(valor, connections[self.db])
+
+    def _ejecutar(self, sql, params):
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()
+
+    def _instancia(self, estado_chat_id, numero_whatsapp, estado_conversacion):
+        estado_chat = self.model(
+            id=estado_chat_id,
+            numero_whatsapp=numero_whatsapp,
+            estado_conversacion=estado_conversacion,
+        )
+        estado_chat._state.adding = False
+        estado_chat._state.db = self.db
+        return estado_chat
+
+
 class EstadoChat(models.Model):
     numero_whatsapp = models.CharField(max_length=20, unique=True)  # Ahora es único
     estado_conversacion = models.JSONField()
 
+    objects = EstadoChatManager()
+
     class Meta:
         indexes = [
             models.Index(fields=['numero_whatsapp'], name='estadochat_whatsapp_idx'),
@@ -141,7 +360,14 @@ class Cita(models.Model):
     google_calendar_event_id = models.CharField(max_length=255, null=True, blank=True, db_index=True)
     google_calendar_url_event = models.CharField(max_length=255, null=True, blank=True)
     estado_actual = models.ForeignKey(HistorialEstadoCita, null=True, blank=True, related_name='cita_con_este_estado', on_delete=models.SET_NULL, db_index=True)
+    # Copia de estado_actual.estado_cita para filtrar sin unir con el historial
+    # (y para la restricción de no solapamiento); la sincronizan save() y cambiar_estado()
+    estado = models.CharField(max_length=100, choices=EstadoCitaEnum.choices, default=EstadoCitaEnum.AGENDADO, editable=False)
     observaciones = models.TextField(null=True, blank=True)
+    # Vencimiento del siguiente recordatorio del pipeline 24h/6h/3h (ver apps.citas.recordatorios)
+    next_action_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Se incrementa en cada modificación de la fila; da el ETag de GET /api/citas/{id}/
+    version = models.PositiveIntegerField(default=1, editable=False)
 
     class Meta:
         indexes = [
@@ -149,27 +375,94 @@ class Cita(models.Model):
             models.Index(fields=['cliente', 'fecha_hora_inicio'], name='cita_cliente_fecha_idx'),
             models.Index(fields=['profesional_asignado', 'fecha_hora_inicio'], name='cita_profesional_fecha_idx'),
             models.Index(fields=['producto', 'fecha_hora_inicio'], name='cita_producto_fecha_idx'),
-            models.Index(fields=['estado_actual', 'fecha_hora_inicio'], name='cita_estado_fecha_idx'),
             models.Index(fields=['-fecha_hora_inicio'], name='cita_fecha_desc_idx'),
             models.Index(fields=['google_calendar_event_id'], name='cita_calendar_event_idx'),
+            models.Index(
+                fields=['next_action_at'], name='cita_next_action_idx',
+                condition=models.Q(next_action_at__isnull=False)
+            ),
+            # Índices parciales solo sobre citas activas: no crecen con el histórico de
+            # citas finalizadas/canceladas e incluyen id para escaneos solo-índice
+            models.Index(
+                fields=['fecha_hora_inicio'], include=['id'], name='cita_activa_inicio_idx',
+                condition=models.Q(estado__in=ESTADOS_ACTIVOS)
+            ),
+            models.Index(
+                fields=['estado', 'fecha_hora_inicio'], include=['id'], name='cita_activa_estado_inicio_idx',
+                condition=models.Q(estado__in=ESTADOS_ACTIVOS)
+            ),
+        ]
+        constraints = [
+            # Un profesional no puede tener dos citas no canceladas que se crucen
+            ExclusionConstraint(
+                name='cita_profesional_sin_solape',
+                expressions=[
+                    ('profesional_asignado', RangeOperators.EQUAL),
+                    (TsTzRange('fecha_hora_inicio', 'fecha_hora_fin', RangeBoundary()), RangeOperators.OVERLAPS),
+                ],
+                condition=~models.Q(estado=EstadoCitaEnum.CANCELADO),
+                violation_error_message='El profesional ya tiene una cita en ese horario',
+            ),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Estado y hora con que se cargó, para recalcular next_action_at solo si cambian
+        instance._accion_original = (instance.__dict__.get('estado'), instance.__dict__.get('fecha_hora_inicio'))
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._accion_original = (self.__dict__.get('estado'), self.__dict__.get('fecha_hora_inicio'))
+
     def save(self, *args, **kwargs):
         """Override save para crear estado inicial en citas nuevas"""
+        from .recordatorios import misma_accion, proxima_accion
+        
         is_new = self.pk is None
+        # Mantener estado sincronizado cuando estado_actual se asigna directamente
+        # (p. ej. estado_actual_id desde el serializador)
+        if self.estado_actual_id is not None and kwargs.get('update_fields') is None:
+            self.estado = self.estado_actual.estado_cita
         
-        # Guardar la cita primero
-        super().save(*args, **kwargs)
+        # Recalcular el siguiente recordatorio si cambió la hora o la acción pendiente;
+        # si no, se conserva el valor actual (puede estar aplazado por un worker que la reclamó)
+        accion_actual = (self.estado, self.fecha_hora_inicio)
+        accion_original = getattr(self, '_accion_original', None)
+        if is_new or accion_original is None or accion_actual[1] != accion_original[1] or (
+            accion_actual[0] != accion_original[0] and not misma_accion(accion_original[0], accion_actual[0])
+        ):
+            self.next_action_at = proxima_accion(*accion_actual)[1]
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'next_action_at' not in update_fields:
+                kwargs['update_fields'] = [*update_fields, 'next_action_at']
         
-        # Si es una cita nueva y no tiene estado actual, crear el primer estado
-        if is_new and not self.estado_actual:
-            primer_estado = HistorialEstadoCita.objects.create(
-                cita=self,
-                estado_cita=EstadoCitaEnum.AGENDADO
-            )
-            # Actualizar la cita con el primer estado (sin triggerar save otra vez)
-            Cita.objects.filter(pk=self.pk).update(estado_actual=primer_estado)
-            self.estado_actual = primer_estado
+        # Nueva versión de la fila en el mismo UPDATE (F evita perder incrementos concurrentes)
+        if not is_new:
+            self.version = models.F('version') + 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'version' not in update_fields:
+                kwargs['update_fields'] = [*update_fields, 'version']
+        
+        # Cita, primer estado y evento de calendario (post_save) en una sola transacción
+        with transaction.atomic():
+            # Guardar la cita primero
+            super().save(*args, **kwargs)
+            
+            # Si es una cita nueva y no tiene estado actual, crear el primer estado
+            if is_new and not self.estado_actual:
+                primer_estado = HistorialEstadoCita.objects.create(
+                    cita=self,
+                    estado_cita=EstadoCitaEnum.AGENDADO
+                )
+                # Actualizar la cita con el primer estado (sin triggerar save otra vez)
+                Cita.objects.filter(pk=self.pk).update(estado_actual=primer_estado)
+                self.estado_actual = primer_estado
+        if not is_new:
+            # Descartar la expresión: el valor guardado se lee de la base al accederlo
+            del self.version
+        self._accion_original = accion_actual
 
     def cambiar_estado(self, nuevo_estado, observaciones_adicionales=None):
         """
@@ -187,30 +480,36 @@ class Cita(models.Model):
         if nuevo_estado not in estados_validos:
             raise ValueError(f"Estado '{nuevo_estado}' no es válido. Estados válidos: {estados_validos}")
         
-        # Crear registro en historial
-        historial = HistorialEstadoCita.objects.create(
-            cita=self,
-            estado_cita=nuevo_estado
-        )
-        
-        # Actualizar estado actual de la cita
-        self.estado_actual = historial
-        
-        # Agregar observaciones adicionales si se proporcionan
-        if observaciones_adicionales:
-            if self.observaciones:
-                self.observaciones += f"\n--- {historial.fecha_registro.strftime('%Y-%m-%d %H:%M')} ---\n{observaciones_adicionales}"
-            else:
-                self.observaciones = f"--- {historial.fecha_registro.strftime('%Y-%m-%d %H:%M')} ---\n{observaciones_adicionales}"
-        
-        # Guardar solo los campos necesarios para evitar recursión
-        self.save(update_fields=['estado_actual', 'observaciones'])
+        # Historial y cita en la misma transacción: si el nuevo estado choca con
+        # la restricción de no solapamiento no queda historial huérfano
+        with transaction.atomic():
+            # Crear registro en historial
+            historial = HistorialEstadoCita.objects.create(
+                cita=self,
+                estado_cita=nuevo_estado
+            )
+            
+            # Actualizar estado actual de la cita
+            self.estado_actual = historial
+            self.estado = nuevo_estado
+            
+            # Agregar observaciones adicionales si se proporcionan
+            if observaciones_adicionales:
+                self.observaciones = self.observaciones_con(observaciones_adicionales, historial.fecha_registro)
+            
+            # Guardar solo los campos necesarios para evitar recursión
+            self.save(update_fields=['estado_actual', 'estado', 'observaciones'])
         
         return historial
 
+    def observaciones_con(self, observaciones_adicionales, fecha):
+        """Observaciones actuales más un bloque nuevo encabezado con la fecha"""
+        bloque = f"--- {fecha.strftime('%Y-%m-%d %H:%M')} ---\n{observaciones_adicionales}"
+        return f"{self.observaciones}\n{bloque}" if self.observaciones else bloque
+
     def get_estado_actual_nombre(self):
-        """Obtener el nombre del estado actual"""
-        return self.estado_actual.estado_cita if self.estado_actual else "Sin estado"
+        """Obtener el nombre del estado actual (columna desnormalizada, sin consultar el historial)"""
+        return self.estado if self.estado_actual_id else "Sin estado"
 
     def get_historial_completo(self):
         """Obtener todo el historial de estados ordenado por fecha"""
@@ -220,6 +519,12 @@ class Cita(models.Model):
         return f"Cita de {self.cliente} el {self.fecha_hora_inicio}"
 
 
+def es_solapamiento_profesional(error):
+    """Indica si un IntegrityError proviene de la restricción de no solapamiento de citas"""
+    diag = getattr(error.__cause__, 'diag', None)
+    return getattr(diag, 'constraint_name', None) == 'cita_profesional_sin_solape'
+
+
 class ProductoProfesional(models.Model):
     producto = models.ForeignKey(Producto, on_delete=models.CASCADE, db_index=True)
     profesional = models.ForeignKey(Usuario, on_delete=models.CASCADE, db_index=True)
@@ -234,6 +539,118 @@ class ProductoProfesional(models.Model):
         return f"{self.producto} - {self.profesional}"
 
 
+class HorarioAtencion(models.Model):
+    """Horario de atención por día de la semana (un día sin registro no tiene atención)"""
+    dia_semana = models.PositiveSmallIntegerField(choices=DiaSemanaEnum.choices, unique=True)
+    hora_apertura = models.TimeField()
+    hora_ultimo_inicio = models.TimeField(help_text="Última hora a la que puede iniciar una cita")
+    hora_cierre = models.TimeField(help_text="Hora límite de finalización de las citas")
+
+    class Meta:
+        verbose_name = "Horario de atención"
+        verbose_name_plural = "Horarios de atención"
+        ordering = ['dia_semana']
+
+    def __str__(self):
+        return f"{self.get_dia_semana_display()} {self.hora_apertura:%H:%M}-{self.hora_cierre:%H:%M}"
+
+
+class DiaFestivo(models.Model):
+    """Festivo nacional: no hay atención"""
+    fecha = models.DateField(unique=True)
+    nombre = models.CharField(max_length=150)
+
+    class Meta:
+        verbose_name = "Día festivo"
+        verbose_name_plural = "Días festivos"
+        ordering = ['fecha']
+
+    def __str__(self):
+        return f"{self.fecha} - {self.nombre}"
+
+
+class ExcepcionHorario(models.Model):
+    """
+    Cambio de horario para una fecha puntual.
+
+    Sin profesional aplica a todos; sin horas indica que ese día no hay
+    atención. La excepción de un profesional prevalece sobre la general, y
+    ambas sobre festivos y el horario semanal.
+    """
+    profesional = models.ForeignKey(Usuario, null=True, blank=True, related_name='excepciones_horario', on_delete=models.CASCADE)
+    fecha = models.DateField(db_index=True)
+    hora_apertura = models.TimeField(null=True, blank=True)
+    hora_ultimo_inicio = models.TimeField(null=True, blank=True)
+    hora_cierre = models.TimeField(null=True, blank=True)
+    motivo = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        verbose_name = "Excepción de horario"
+        verbose_name_plural = "Excepciones de horario"
+        ordering = ['fecha']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['profesional', 'fecha'], condition=models.Q(profesional__isnull=False),
+                name='excepcion_profesional_fecha_unique'
+            ),
+            models.UniqueConstraint(
+                fields=['fecha'], condition=models.Q(profesional__isnull=True),
+                name='excepcion_general_fecha_unique'
+            ),
+            models.CheckConstraint(
+                condition=(
+                    models.Q(hora_apertura__isnull=True, hora_ultimo_inicio__isnull=True, hora_cierre__isnull=True)
+                    | models.Q(hora_apertura__isnull=False, hora_ultimo_inicio__isnull=False, hora_cierre__isnull=False)
+                ),
+                name='excepcion_horas_completas'
+            ),
+        ]
+
+    @property
+    def sin_atencion(self):
+        return self.hora_apertura is None
+
+    def __str__(self):
+        quien = self.profesional or 'Todos'
+        if self.sin_atencion:
+            return f"{self.fecha} - {quien}: sin atención"
+        return f"{self.fecha} - {quien}: {self.hora_apertura:%H:%M}-{self.hora_cierre:%H:%M}"
+
+
+class EventoCalendario(models.Model):
+    """
+    Outbox de sincronización con Google Calendar.
+
+    Se inserta en la misma transacción que crea, mueve o cancela la cita y lo
+    envía después el comando despachar_calendario (ver
+    apps.citas.sincronizacion_calendario).
+    """
+    cita = models.ForeignKey(Cita, null=True, blank=True, related_name='eventos_calendario', on_delete=models.SET_NULL)
+    accion = models.CharField(max_length=20, choices=AccionCalendarioEnum.choices)
+    # Evento a eliminar cuando la cita ya no existe
+    google_calendar_event_id = models.CharField(max_length=255, null=True, blank=True)
+    estado = models.CharField(max_length=20, choices=EstadoEventoCalendarioEnum.choices, default=EstadoEventoCalendarioEnum.PENDIENTE)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    ultimo_error = models.TextField(blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_envio = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Evento de calendario"
+        verbose_name_plural = "Eventos de calendario"
+        ordering = ['-id']
+        indexes = [
+            models.Index(
+                fields=['proximo_intento'], name='evento_cal_pendiente_idx',
+                condition=models.Q(estado=EstadoEventoCalendarioEnum.PENDIENTE)
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_accion_display()} - Cita {self.cita_id} - {self.estado}"
+
+
 class ApiKey(models.Model):
     """Modelo para gestionar API Keys para chatbots y servicios externos"""
     name = models.CharField(max_length=100, help_text="Nombre descriptivo para la API Key", db_index=True)
@@ -243,6 +660,14 @@ class ApiKey(models.Model):
     last_used = models.DateTimeField(null=True, blank=True, db_index=True)
     usage_count = models.PositiveIntegerField(default=0, db_index=True)
     description = models.TextField(blank=True, help_text="Descripción del uso de esta API Key")
+    rate_limit_per_minute = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text="Solicitudes por minuto permitidas (vacío = límite global por defecto, 0 = sin límite)"
+    )
+    rate_limit_burst = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text="Ráfaga máxima de solicitudes seguidas (vacío = igual al límite por minuto)"
+    )
     
     class Meta:
         verbose_name = "API Key"
@@ -269,11 +694,78 @@ class ApiKey(models.Model):
         return ''.join(secrets.choice(alphabet) for _ in range(48))
     
     def update_usage(self):
-        """Actualizar estadísticas de uso"""
+        """
+        Registrar un uso de la API Key
+        
+        El conteo se acumula en memoria del worker y se escribe en lote
+        (ver apps.citas.usage); aquí solo se reflejan los valores en la instancia.
+        """
         from django.utils import timezone
+        from .usage import usage_buffer
         self.last_used = timezone.now()
         self.usage_count += 1
-        self.save(update_fields=['last_used', 'usage_count'])
+        usage_buffer.record(self.pk, self.last_used)
     
     def __str__(self):
         return f"{self.name} ({'Activa' if self.is_active else 'Inactiva'})"
+
+
+class ApiKeyTokenBucket(models.Model):
+    """Estado del token bucket de rate limiting de cada API Key (compartido entre workers)"""
+    api_key = models.OneToOneField(ApiKey, primary_key=True, related_name='token_bucket', on_delete=models.CASCADE)
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField()
+    allowed = models.BooleanField(default=True)
+
+    class Meta:
+        verbose_name = "Token bucket de API Key"
+        verbose_name_plural = "Token buckets de API Keys"
+
+    def __str__(self):
+        return f"{self.api_key.name}: {self.tokens:.2f} tokens"
+
+
+class VersionTabla(models.Model):
+    """
+    Contador de cambios por tabla (lo incrementan las señales, ver
+    apps.citas.versiones). Los ETag de las lecturas condicionales se calculan
+    con estos contadores, sin ejecutar la consulta ni el serializador.
+    """
+    tabla = models.CharField(max_length=63, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    fecha_modificacion = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Versión de tabla"
+        verbose_name_plural = "Versiones de tablas"
+
+    def __str__(self):
+        return f"{self.tabla} v{self.version}"
+
+
+class ApiKeyUsageRollup(models.Model):
+    """Uso agregado por API Key, hora y endpoint (lo escribe el buffer de apps.citas.usage)"""
+    api_key = models.ForeignKey(ApiKey, related_name='usage_rollups', on_delete=models.CASCADE)
+    hour = models.DateTimeField(help_text="Inicio de la hora agregada")
+    endpoint = models.CharField(max_length=200, help_text="Método HTTP y nombre de la ruta")
+    request_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    total_latency_ms = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = "Uso por hora de API Key"
+        verbose_name_plural = "Uso por hora de API Keys"
+        ordering = ['-hour']
+        constraints = [
+            models.UniqueConstraint(fields=['api_key', 'hour', 'endpoint'], name='apikey_rollup_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['-hour'], name='apikey_rollup_hour_desc_idx'),
+        ]
+
+    @property
+    def avg_latency_ms(self):
+        return self.total_latency_ms / self.request_count if self.request_count else 0
+
+    def __str__(self):
+        return f"{self.api_key.name} - {self.endpoint} - {self.hour:%Y-%m-%d %H:00}"
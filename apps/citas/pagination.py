@@ -0,0 +1,238 @@
+"""
+Paginación de los listados de citas.
+
+CursorFechaPagination: cursor (keyset) para listados de citas ordenados por
+fecha. A diferencia de PageNumberPagination (OFFSET), cada página se pide con
+``WHERE (fecha_hora_inicio, id) > (última fila de la página anterior)``, así
+que la página N cuesta lo mismo que la primera y las filas no se corren entre
+páginas si se insertan o borran citas mientras se recorre el listado.
+
+El total se obtiene con ``contar()``: se cachea por worker durante
+CONTEO_CACHE_TTL segundos por (endpoint, consulta filtrada) y, si el rango
+supera CONTEO_EXACTO_MAXIMO filas, se usa la estimación del planificador de
+PostgreSQL en vez del COUNT(*). La respuesta indica en ``count_exacto`` si el
+total es exacto o estimado.
+"""
+import base64
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .cache import TTLCache
+
+conteo_cache = TTLCache(
+    max_size=getattr(settings, 'CONTEO_CACHE_MAX_SIZE', 512),
+    ttl=getattr(settings, 'CONTEO_CACHE_TTL', 30),
+)
+
+
+def estimar_filas(queryset):
+    """Filas que el planificador de PostgreSQL estima para la consulta (EXPLAIN, sin ejecutarla)"""
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def contar(queryset, clave=''):
+    """
+    Total de filas de la consulta como (total, exacto).
+
+    Cuenta como máximo CONTEO_EXACTO_MAXIMO + 1 filas; si hay más, retorna la
+    estimación del planificador (exacto=False). El resultado se cachea por
+    (clave, SQL con parámetros), así que un alta o baja tarda hasta
+    CONTEO_CACHE_TTL segundos en reflejarse en el total.
+    """
+    queryset = queryset.order_by()
+    sql, params = queryset.query.sql_with_params()
+    llave = (clave, sql, str(params))
+    resultado = conteo_cache.get(llave)
+    if resultado is not None:
+        return resultado
+
+    maximo = getattr(settings, 'CONTEO_EXACTO_MAXIMO', 10000)
+    total = queryset[:maximo + 1].count()
+    if total <= maximo:
+        resultado = (total, True)
+    elif connections[queryset.db].vendor == 'postgresql':
+        resultado = (max(estimar_filas(queryset), total), False)
+    else:
+        resultado = (queryset.count(), True)
+    conteo_cache.set(llave, resultado)
+    return resultado
+
+
+PROPIEDAD_COUNT_EXACTO = {
+    'type': 'boolean',
+    'example': True,
+    'description': 'false si count es una estimación del planificador (rangos muy grandes)',
+}
+
+
+class CursorFechaPagination(BasePagination):
+    """
+    Cursor sobre (fecha_hora_inicio, id).
+
+    Parámetros:
+    - cursor: valor opaco tomado de ``next`` / ``previous``
+    - page_size: tamaño de página (máximo ``max_page_size``)
+    - incluir_total=false: omitir ``count`` y ahorrar el COUNT(*) del rango
+    """
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    total_query_param = 'incluir_total'
+    campo_fecha = 'fecha_hora_inicio'
+    invalid_cursor_message = 'Cursor inválido'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.tamano = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        incluir_total = request.query_params.get(self.total_query_param, 'true').lower() not in ('false', '0', 'no')
+        self.total, self.total_exacto = contar(queryset, request.path) if incluir_total else (None, None)
+
+        campo = self.campo_fecha
+        if cursor is None:
+            queryset = queryset.order_by(campo, 'id')
+            reverso = False
+        else:
+            fecha, cita_id, reverso = cursor
+            if reverso:
+                # Página anterior: recorrer hacia atrás y voltear el resultado
+                queryset = queryset.filter(
+                    Q(**{f'{campo}__lt': fecha}) | Q(**{campo: fecha, 'id__lt': cita_id}),
+                    **{f'{campo}__lte': fecha}
+                ).order_by(f'-{campo}', '-id')
+            else:
+                # La condición redundante sobre la fecha es la que usa el índice
+                queryset = queryset.filter(
+                    Q(**{f'{campo}__gt': fecha}) | Q(**{campo: fecha, 'id__gt': cita_id}),
+                    **{f'{campo}__gte': fecha}
+                ).order_by(campo, 'id')
+
+        filas = list(queryset[:self.tamano + 1])
+        hay_mas = len(filas) > self.tamano
+        filas = filas[:self.tamano]
+        if reverso:
+            filas.reverse()
+            self.hay_siguiente, self.hay_anterior = True, hay_mas
+        else:
+            self.hay_siguiente, self.hay_anterior = hay_mas, cursor is not None
+        self.filas = filas
+        return filas
+
+    def get_page_size(self, request):
+        try:
+            tamano = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(tamano, self.max_page_size))
+
+    def decode_cursor(self, request):
+        """(fecha, id, reverso) del cursor recibido, o None si es la primera página"""
+        valor = request.query_params.get(self.cursor_query_param)
+        if not valor:
+            return None
+        try:
+            datos = json.loads(base64.urlsafe_b64decode(valor.encode('ascii')))
+            fecha = parse_datetime(datos['f'])
+            cita_id = int(datos['id'])
+            reverso = bool(datos.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if fecha is None:
+            raise NotFound(self.invalid_cursor_message)
+        return fecha, cita_id, reverso
+
+    def encode_cursor(self, cita, reverso):
+        datos = {'f': getattr(cita, self.campo_fecha).isoformat(), 'id': cita.id}
+        if reverso:
+            datos['r'] = 1
+        valor = base64.urlsafe_b64encode(json.dumps(datos).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, valor)
+
+    def get_next_link(self):
+        if not self.hay_siguiente or not self.filas:
+            return None
+        return self.encode_cursor(self.filas[-1], reverso=False)
+
+    def get_previous_link(self):
+        if not self.hay_anterior:
+            return None
+        if not self.filas:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.filas[0], reverso=True)
+
+    def get_paginated_response(self, data):
+        respuesta = OrderedDict()
+        if self.total is not None:
+            respuesta['count'] = self.total
+            respuesta['count_exacto'] = self.total_exacto
+        respuesta['next'] = self.get_next_link()
+        respuesta['previous'] = self.get_previous_link()
+        respuesta['results'] = data
+        return Response(respuesta)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {
+                    'type': 'integer',
+                    'example': 123,
+                    'description': f'Total del rango; se omite con {self.total_query_param}=false',
+                },
+                'count_exacto': PROPIEDAD_COUNT_EXACTO,
+                'next': {
+                    'type': 'string', 'nullable': True, 'format': 'uri',
+                    'example': f'http://api.example.org/citas/por-fecha/?{self.cursor_query_param}=eyJmIjogIi4uLiJ9',
+                },
+                'previous': {
+                    'type': 'string', 'nullable': True, 'format': 'uri',
+                    'example': f'http://api.example.org/citas/por-fecha/?{self.cursor_query_param}=eyJmIjogIi4uLiJ9',
+                },
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cursor de paginación (tomado de next / previous)',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': f'Resultados por página (máximo {self.max_page_size})',
+                'schema': {'type': 'integer'},
+            },
+            {
+                'name': self.total_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'false para omitir el total (count) y su consulta',
+                'schema': {'type': 'boolean', 'default': True},
+            },
+        ]
+
@@ -0,0 +1,183 @@
+"""
+Programador de transiciones de estado por tiempo.
+
+Calcula a partir de fecha_hora_inicio / fecha_hora_fin qué citas deben avanzar
+en el pipeline de recordatorios y las mueve en lotes con
+estados.cambiar_estados. Lo ejecuta el comando ``programador_recordatorios``;
+varias réplicas pueden correrlo a la vez porque solo la que obtiene el
+advisory lock de PostgreSQL aplica cambios.
+
+Las transiciones que requieren una acción del bot (enviar el mensaje, informar
+al agente) no se hacen aquí: las entrega la cola de recordatorios.py y el bot
+registra el estado resultante.
+"""
+import logging
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from .estados import ERROR_ESTADO_CAMBIADO, cambiar_estados
+from .models import Cita, EstadoCitaEnum
+
+logger = logging.getLogger(__name__)
+
+# Clave del advisory lock de PostgreSQL del programador (entero de 64 bits arbitrario y fijo)
+ADVISORY_LOCK_ID = 7_412_203_981
+
+
+@dataclass(frozen=True)
+class Transicion:
+    """
+    Mover las citas en ``origen`` a ``destino`` cuando ``referencia`` (campo de
+    fecha de la cita) más ``desfase`` ya pasó.
+    """
+    nombre: str
+    origen: tuple
+    destino: str
+    referencia: str
+    desfase: timedelta
+
+    def queryset(self, ahora):
+        """Citas con la transición vencida en ``ahora``"""
+        filtros = {
+            'estado__in': self.origen,
+            f'{self.referencia}__lte': ahora - self.desfase,
+        }
+        if self.referencia == 'fecha_hora_inicio':
+            # Las transiciones previas a la cita no aplican si ya inició
+            filtros['fecha_hora_inicio__gt'] = ahora
+        else:
+            # Cota redundante (inicio < fin) para recorrer los índices parciales de
+            # citas activas en vez del índice de fecha_hora_fin de todo el histórico
+            filtros['fecha_hora_inicio__lt'] = ahora - self.desfase
+        return Cita.objects.filter(**filtros)
+
+    def vencidas(self, ahora, limite):
+        """IDs de hasta ``limite`` citas con la transición vencida, las más antiguas primero"""
+        return list(
+            self.queryset(ahora).order_by(self.referencia).values_list('id', flat=True)[:limite]
+        )
+
+
+TRANSICIONES = [
+    Transicion(
+        nombre='pendiente_24h',
+        origen=(EstadoCitaEnum.AGENDADO, EstadoCitaEnum.NOTIFICADO_PROFESIONAL),
+        destino=EstadoCitaEnum.PENDIENTE_24H,
+        referencia='fecha_hora_inicio',
+        desfase=-timedelta(hours=24),
+    ),
+    Transicion(
+        nombre='pendiente_6h',
+        origen=(EstadoCitaEnum.PENDIENTE_24H_MSG_ENVIADO, EstadoCitaEnum.PRIMER_CONFIRMADO),
+        destino=EstadoCitaEnum.PENDIENTE_6H,
+        referencia='fecha_hora_inicio',
+        desfase=-timedelta(hours=6),
+    ),
+    Transicion(
+        nombre='finalizado',
+        origen=(
+            EstadoCitaEnum.PRIMER_CONFIRMADO, EstadoCitaEnum.SEGUNDO_CONFIRMADO,
+            EstadoCitaEnum.INFORMADO_AGENTE_3h,
+        ),
+        destino=EstadoCitaEnum.FINALIZADO,
+        referencia='fecha_hora_fin',
+        desfase=timedelta(hours=1),
+    ),
+    Transicion(
+        nombre='no_asistio',
+        origen=(
+            EstadoCitaEnum.AGENDADO, EstadoCitaEnum.NOTIFICADO_PROFESIONAL,
+            EstadoCitaEnum.PENDIENTE_24H, EstadoCitaEnum.PENDIENTE_24H_MSG_ENVIADO,
+            EstadoCitaEnum.PENDIENTE_6H, EstadoCitaEnum.PENDIENTE_6H_MSG_ENVIADO,
+        ),
+        destino=EstadoCitaEnum.NO_ASISTIO,
+        referencia='fecha_hora_fin',
+        desfase=timedelta(hours=1),
+    ),
+]
+
+
+def tomar_liderazgo():
+    """Intentar tomar el advisory lock (de sesión) del programador; no bloquea"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [ADVISORY_LOCK_ID])
+        return cursor.fetchone()[0]
+
+
+def soltar_liderazgo():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", [ADVISORY_LOCK_ID])
+
+
+def ejecutar_ciclo(lote, dry_run=False, ahora=None):
+    """
+    Aplicar todas las transiciones vencidas, en lotes de ``lote`` citas.
+
+    Retorna {nombre de transición: citas movidas (o que se moverían en dry-run)}.
+    """
+    ahora = ahora or timezone.now()
+    movidas = {}
+    for transicion in TRANSICIONES:
+        if dry_run:
+            movidas[transicion.nombre] = transicion.queryset(ahora).count()
+            if movidas[transicion.nombre]:
+                logger.info(
+                    f"[dry-run] {transicion.nombre}: {movidas[transicion.nombre]} citas -> {transicion.destino} "
+                    f"(ej. {transicion.vencidas(ahora, 10)})"
+                )
+            continue
+        total = 0
+        while True:
+            ids = transicion.vencidas(ahora, lote)
+            if not ids:
+                break
+            resultados = cambiar_estados([
+                {
+                    'cita_id': cita_id,
+                    'estado_cita': transicion.destino,
+                    'observaciones': f'Cambio automático por tiempo ({transicion.nombre})',
+                    # Los IDs se leyeron sin bloqueo: se revalida el estado con la fila bloqueada
+                    'estados_origen': transicion.origen,
+                }
+                for cita_id in ids
+            ])
+            aplicadas = sum(1 for resultado in resultados if resultado['exito'])
+            # Las que cambiaron de estado entre la lectura y el bloqueo ya no son vencidas
+            omitidas = sum(1 for resultado in resultados if resultado.get('error') == ERROR_ESTADO_CAMBIADO)
+            total += aplicadas
+            if aplicadas + omitidas < len(ids):
+                # Evitar un ciclo infinito con citas que no se pueden mover
+                logger.warning(f"{transicion.nombre}: {len(ids) - aplicadas} citas no se pudieron mover")
+                break
+            if len(ids) < lote:
+                break
+        movidas[transicion.nombre] = total
+    return movidas
+
+
+class Metricas:
+    """Contadores acumulados del programador para el log de cada ciclo"""
+
+    def __init__(self):
+        self.ciclos = 0
+        self.movidas = 0
+        self.segundos_trabajo = 0.0
+
+    def registrar(self, movidas, segundos):
+        self.ciclos += 1
+        self.movidas += sum(movidas.values())
+        self.segundos_trabajo += segundos
+
+    def resumen(self, movidas, segundos):
+        del_ciclo = sum(movidas.values())
+        throughput = del_ciclo / segundos if segundos else 0.0
+        detalle = ', '.join(f'{nombre}={cantidad}' for nombre, cantidad in movidas.items())
+        return (
+            f"Ciclo {self.ciclos}: {del_ciclo} citas en {segundos * 1000:.0f}ms "
+            f"({throughput:.0f} citas/s) [{detalle}] - "
+            f"acumulado: {self.movidas} citas en {self.ciclos} ciclos, "
+            f"{self.movidas / self.segundos_trabajo if self.segundos_trabajo else 0:.0f} citas/s de trabajo"
+        )
@@ -0,0 +1,91 @@
+"""
+Cola de recordatorios de confirmación (24h / 6h / 3h).
+
+Cada cita guarda en ``next_action_at`` cuándo vence su siguiente paso del
+pipeline de EstadoCitaEnum; el valor se recalcula al guardar la cita cuando
+cambia su hora de inicio o pasa a un estado con otra acción pendiente. Los workers del bot reclaman lotes con
+``SELECT ... FOR UPDATE SKIP LOCKED``: dos workers nunca reciben la misma cita
+y, al reclamarla, su ``next_action_at`` se aplaza RECORDATORIOS_LEASE_SEGUNDOS.
+Si el worker registra el siguiente estado (p. ej. "Mensaje Enviado") la cita
+avanza en el pipeline; si falla, vuelve a estar disponible al vencer el plazo.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Cita, EstadoCitaEnum
+
+RECORDATORIO_24H = 'recordatorio_24h'
+RECORDATORIO_6H = 'recordatorio_6h'
+INFORMAR_AGENTE_3H = 'informar_agente_3h'
+
+# Estado actual -> (acción pendiente, anticipación respecto al inicio de la cita).
+# Los estados que no aparecen no tienen más recordatorios.
+SIGUIENTE_ACCION = {
+    EstadoCitaEnum.AGENDADO: (RECORDATORIO_24H, timedelta(hours=24)),
+    EstadoCitaEnum.NOTIFICADO_PROFESIONAL: (RECORDATORIO_24H, timedelta(hours=24)),
+    EstadoCitaEnum.PENDIENTE_24H: (RECORDATORIO_24H, timedelta(hours=24)),
+    EstadoCitaEnum.PENDIENTE_24H_MSG_ENVIADO: (RECORDATORIO_6H, timedelta(hours=6)),
+    EstadoCitaEnum.PRIMER_CONFIRMADO: (RECORDATORIO_6H, timedelta(hours=6)),
+    EstadoCitaEnum.PENDIENTE_6H: (RECORDATORIO_6H, timedelta(hours=6)),
+    EstadoCitaEnum.PENDIENTE_6H_MSG_ENVIADO: (INFORMAR_AGENTE_3H, timedelta(hours=3)),
+    EstadoCitaEnum.SEGUNDO_CONFIRMADO: (INFORMAR_AGENTE_3H, timedelta(hours=3)),
+}
+
+MAX_LOTE = 100
+
+
+def proxima_accion(estado, fecha_hora_inicio):
+    """
+    (acción, vencimiento) del siguiente recordatorio de una cita.
+
+    Retorna (None, None) si el estado no tiene más recordatorios o la cita ya
+    inició.
+    """
+    siguiente = SIGUIENTE_ACCION.get(estado)
+    if siguiente is None or fecha_hora_inicio is None or fecha_hora_inicio <= timezone.now():
+        return None, None
+    accion, anticipacion = siguiente
+    return accion, fecha_hora_inicio - anticipacion
+
+
+def misma_accion(estado_anterior, estado_nuevo):
+    """
+    Indica si el cambio de estado deja pendiente la misma acción (p. ej.
+    Agendado -> Pendiente 24h). En ese caso se conserva ``next_action_at``:
+    puede ser el plazo de un worker que reclamó la cita, y recalcularlo la
+    dejaría disponible para otro worker antes de tiempo.
+    """
+    accion = SIGUIENTE_ACCION.get(estado_anterior, (None,))[0]
+    return accion is not None and accion == SIGUIENTE_ACCION.get(estado_nuevo, (None,))[0]
+
+
+def reclamar(limite, lease=None):
+    """
+    Reclamar hasta ``limite`` citas con recordatorio vencido, las más atrasadas primero.
+
+    Las filas bloqueadas por otro worker se saltan (SKIP LOCKED) y las
+    reclamadas se aplazan ``lease`` segundos antes de liberar el bloqueo, así
+    que ninguna cita se entrega dos veces mientras dure el plazo. A cada cita
+    retornada se le asigna el atributo ``accion``.
+    """
+    lease = lease or getattr(settings, 'RECORDATORIOS_LEASE_SEGUNDOS', 300)
+    ahora = timezone.now()
+    with transaction.atomic():
+        citas = list(
+            Cita.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(next_action_at__lte=ahora, fecha_hora_inicio__gt=ahora)
+            .select_related('cliente', 'producto', 'profesional_asignado', 'estado_actual')
+            .order_by('next_action_at')[:limite]
+        )
+        if not citas:
+            return []
+        aplazado = ahora + timedelta(seconds=lease)
+        Cita.objects.filter(id__in=[cita.id for cita in citas]).update(next_action_at=aplazado)
+
+    for cita in citas:
+        cita.next_action_at = aplazado
+        cita.accion = SIGUIENTE_ACCION[cita.estado][0]
+    return citas
@@ -0,0 +1,45 @@
+"""
+Renderers de la exportación de citas.
+
+El cuerpo de la exportación es un StreamingHttpResponse que no pasa por estos
+renderers; se usan para negociar el formato (header Accept o ?format=) y para
+devolver los errores en el formato pedido.
+"""
+import csv
+import io
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        filas = data if isinstance(data, list) else [data]
+        return ''.join(
+            json.dumps(fila, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for fila in filas
+        ).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Un objeto (p. ej. {'error': ...}) se escribe como encabezado + una fila"""
+        if data is None:
+            return b''
+        filas = data if isinstance(data, list) else [data]
+        salida = io.StringIO()
+        if filas:
+            escritor = csv.DictWriter(salida, fieldnames=list(filas[0]))
+            escritor.writeheader()
+            escritor.writerows(filas)
+        return salida.getvalue().encode(self.charset)
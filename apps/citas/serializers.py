@@ -1,5 +1,6 @@
 from rest_framework import serializers
 import logging
+from django.db.models import Prefetch
 from datetime import datetime, timezone
 from django.utils import timezone as django_timezone
 from zoneinfo import ZoneInfo
@@ -9,12 +10,14 @@ from .models import (
     TipoDocumentoEnum, TipoUsuarioEnum, EstadoCitaEnum,
     ApiKey
 )
+from . import calendario
+from .campos import CamposDinamicosMixin
 
 # Logger específico para serializadores
 logger = logging.getLogger(__name__)
 
 
-class UsuarioSerializer(serializers.ModelSerializer):
+class UsuarioSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador para el modelo Usuario"""
     
     class Meta:
@@ -42,7 +45,7 @@ class UsuarioSerializer(serializers.ModelSerializer):
         return value
 
 
-class EstadoChatSerializer(serializers.ModelSerializer):
+class EstadoChatSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador para el modelo EstadoChat"""
     
     class Meta:
@@ -56,7 +59,52 @@ class EstadoChatSerializer(serializers.ModelSerializer):
         return value
 
 
-class ProfesionalSerializer(serializers.ModelSerializer):
+class EstadoChatGuardarSerializer(serializers.Serializer):
+    """
+    Entrada de las escrituras por número (guardar / actualizar; actualizar la
+    usa con partial=True). A diferencia de EstadoChatSerializer no valida la
+    unicidad del número con una consulta: de eso se encarga el ON CONFLICT de
+    EstadoChat.objects.guardar().
+    """
+    numero_whatsapp = serializers.CharField(max_length=20)
+    estado_conversacion = serializers.JSONField()
+
+    validate_numero_whatsapp = EstadoChatSerializer.validate_numero_whatsapp
+
+
+class OperacionRutaSerializer(serializers.Serializer):
+    """Operación sobre una ruta de estado_conversacion: asignar ``valor`` o ``eliminar``"""
+    ruta = serializers.ListField(child=serializers.CharField(allow_blank=True), min_length=1)
+    valor = serializers.JSONField(required=False, allow_null=True)
+    eliminar = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if data['eliminar'] == ('valor' in data):
+            raise serializers.ValidationError("Cada operación debe tener 'valor' o 'eliminar': true (no ambos)")
+        return data
+
+
+class EstadoChatFusionarSerializer(serializers.Serializer):
+    """Entrada de la modificación parcial de estado_conversacion (merge patch y/o rutas)"""
+    numero_whatsapp = serializers.CharField(max_length=20)
+    parche = serializers.JSONField(required=False, help_text='Merge patch RFC 7396: null elimina la clave')
+    rutas = OperacionRutaSerializer(many=True, required=False)
+
+    validate_numero_whatsapp = EstadoChatSerializer.validate_numero_whatsapp
+
+    def validate_parche(self, value):
+        # Un parche que no es objeto reemplazaría el estado completo
+        if not isinstance(value, dict):
+            raise serializers.ValidationError('El parche debe ser un objeto JSON')
+        return value
+
+    def validate(self, data):
+        if data.get('parche') is None and not data.get('rutas'):
+            raise serializers.ValidationError('Se requiere parche o rutas')
+        return data
+
+
+class ProfesionalSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador para el modelo Profesional"""
     usuario = UsuarioSerializer(read_only=True)
     usuario_id = serializers.IntegerField(write_only=True)
@@ -82,7 +130,7 @@ class ProfesionalSerializer(serializers.ModelSerializer):
         return value
 
 
-class ClienteSerializer(serializers.ModelSerializer):
+class ClienteSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador para el modelo Cliente"""
     usuario = UsuarioSerializer(read_only=True)
     usuario_id = serializers.IntegerField(write_only=True)
@@ -117,26 +165,50 @@ class ClienteSerializer(serializers.ModelSerializer):
         """Personalizar la representación del cliente para incluir el nombre completo"""
         representation = super().to_representation(instance)
         # Quitar el ID del cliente y solo dejar el ID del modelo usuario
-        representation.pop('id')
+        representation.pop('id', None)
         return representation
 
 
-class ProductoSerializer(serializers.ModelSerializer):
+def prefetch_profesionales():
+    """
+    Prefetch de ProductoProfesional con el usuario y su perfil Profesional.
+
+    Con ``Producto.objects.prefetch_related(prefetch_profesionales())``,
+    ProductoSerializer y ProductoListSerializer arman los profesionales de
+    todos los productos sin consultas adicionales.
+    """
+    return Prefetch(
+        'productoprofesional_set',
+        queryset=ProductoProfesional.objects.select_related('profesional__profesional').order_by('id')
+    )
+
+
+def profesionales_de_producto(producto):
+    """Usuarios profesionales del producto, del prefetch si existe o con una consulta"""
+    if 'productoprofesional_set' in getattr(producto, '_prefetched_objects_cache', {}):
+        return [
+            relacion.profesional for relacion in producto.productoprofesional_set.all()
+            if relacion.profesional.tipo == TipoUsuarioEnum.PROFESIONAL
+        ]
+    return Usuario.objects.filter(
+        productoprofesional__producto=producto,
+        tipo=TipoUsuarioEnum.PROFESIONAL
+    ).select_related('profesional').order_by('productoprofesional__id')
+
+
+class ProductoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador para el modelo Producto"""
     producto_id = serializers.IntegerField(source='id', read_only=True)
     profesionales = serializers.SerializerMethodField()
+    campos_calculados = {'profesionales': []}
     
     class Meta:
         model = Producto
         fields = ['producto_id', 'nombre', 'descripcion', 'es_agendable_por_bot', 'duracion_minutos', 'profesionales']
 
     def get_profesionales(self, obj):
-        """Obtener profesionales asignados a este producto"""
-        # Ahora ProductoProfesional apunta directamente a Usuario
-        usuarios_profesionales = Usuario.objects.filter(
-            productoprofesional__producto=obj,
-            tipo=TipoUsuarioEnum.PROFESIONAL
-        ).select_related('profesional')
+        """Obtener profesionales asignados a este producto (ver prefetch_profesionales)"""
+        usuarios_profesionales = profesionales_de_producto(obj)
         return [{
             'profesional_id': usuario.id,
             'nombres': usuario.nombres,
@@ -159,7 +231,7 @@ class ProductoSerializer(serializers.ModelSerializer):
         return value.strip()
 
 
-class HistorialEstadoCitaSerializer(serializers.ModelSerializer):
+class HistorialEstadoCitaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador para el modelo HistorialEstadoCita"""
     cita_id = serializers.IntegerField(write_only=True, required=False)
     
@@ -169,7 +241,7 @@ class HistorialEstadoCitaSerializer(serializers.ModelSerializer):
         read_only_fields = ['fecha_registro', 'cita']
 
 
-class CitaSerializer(serializers.ModelSerializer):
+class CitaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador para el modelo Cita"""
     cliente = UsuarioSerializer(read_only=True)
     cliente_id = serializers.IntegerField(write_only=True)
@@ -184,6 +256,15 @@ class CitaSerializer(serializers.ModelSerializer):
     fecha_hora_inicio = serializers.CharField(write_only=True)
     fecha_hora_fin = serializers.CharField(write_only=True)
     
+    # Salidas agregadas en to_representation y columnas que necesitan
+    campos_calculados = {
+        'cita_id': ['id'],
+        'cliente_id': ['cliente'],
+        'profesional_id': ['profesional_asignado'],
+        'fecha_hora_inicio': ['fecha_hora_inicio'],
+        'fecha_hora_fin': ['fecha_hora_fin'],
+    }
+    
     class Meta:
         model = Cita
         fields = [
@@ -199,17 +280,20 @@ class CitaSerializer(serializers.ModelSerializer):
         data = super().to_representation(instance)
         
         # Agregar campos adicionales para mejor identificación
-        data['cita_id'] = instance.id
-        data['cliente_id'] = instance.cliente.id if instance.cliente else None
-        data['profesional_id'] = instance.profesional_asignado.id if instance.profesional_asignado else None
+        if self.incluye('cita_id'):
+            data['cita_id'] = instance.id
+        if self.incluye('cliente_id'):
+            data['cliente_id'] = instance.cliente_id
+        if self.incluye('profesional_id'):
+            data['profesional_id'] = instance.profesional_asignado_id
         
         # Formatear fechas en la respuesta (dd/mm/aaaa hh:mm) - convertir de UTC a Colombia
-        if instance.fecha_hora_inicio:
+        if self.incluye('fecha_hora_inicio') and instance.fecha_hora_inicio:
             # Convertir de UTC a zona horaria de Colombia
             zona_colombia = ZoneInfo('America/Bogota')
             fecha_colombia = instance.fecha_hora_inicio.astimezone(zona_colombia)
             data['fecha_hora_inicio'] = fecha_colombia.strftime('%d/%m/%Y %H:%M')
-        if instance.fecha_hora_fin:
+        if self.incluye('fecha_hora_fin') and instance.fecha_hora_fin:
             # Convertir de UTC a zona horaria de Colombia
             zona_colombia = ZoneInfo('America/Bogota')
             fecha_colombia = instance.fecha_hora_fin.astimezone(zona_colombia)
@@ -348,10 +432,14 @@ class CitaSerializer(serializers.ModelSerializer):
         fecha_inicio = data.get('fecha_hora_inicio')
         fecha_fin = data.get('fecha_hora_fin')
         
-        # Validar fechas
-        if fecha_inicio and fecha_fin:
-            logger.info(f"Validando fechas - Inicio: {fecha_inicio}, Fin: {fecha_fin}")
-            if fecha_inicio >= fecha_fin:
+        # Validar fechas; en una actualización parcial la que falta es la de la
+        # cita guardada (la restricción de no solapamiento exige inicio <= fin)
+        instance = self.instance
+        inicio = fecha_inicio or (instance.fecha_hora_inicio if instance else None)
+        fin = fecha_fin or (instance.fecha_hora_fin if instance else None)
+        if (fecha_inicio or fecha_fin) and inicio and fin:
+            logger.info(f"Validando fechas - Inicio: {inicio}, Fin: {fin}")
+            if inicio >= fin:
                 logger.error("Error de validación: Fecha fin debe ser posterior a fecha inicio")
                 raise serializers.ValidationError({
                     'fecha_hora_fin': 'La fecha de fin debe ser posterior a la fecha de inicio'
@@ -396,11 +484,25 @@ class CitaSerializer(serializers.ModelSerializer):
             else:
                 logger.info("Relación Profesional-Producto validada exitosamente")
         
+        # Validar que la cita quede dentro del horario de atención (semanal,
+        # festivos y excepciones del profesional)
+        if fecha_inicio or fecha_fin or 'profesional_asignado_id' in data:
+            if 'profesional_asignado_id' in data:
+                profesional_horario = data['profesional_asignado_id']
+            else:
+                profesional_horario = instance.profesional_asignado_id if instance else None
+            
+            if inicio and fin and not calendario.dentro_de_horario(profesional_horario, inicio, fin):
+                logger.error(f"Error de validación: Horario fuera de atención - Inicio: {inicio}, Fin: {fin}, Profesional ID: {profesional_horario}")
+                raise serializers.ValidationError({
+                    'fecha_hora_inicio': 'El horario está fuera del horario de atención (festivo, domingo o fuera de la jornada)'
+                })
+        
         logger.info("=== VALIDACIONES CRUZADAS COMPLETADAS ===")
         return data
 
 
-class ProductoProfesionalSerializer(serializers.ModelSerializer):
+class ProductoProfesionalSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador para el modelo ProductoProfesional"""
     producto = ProductoSerializer(read_only=True)
     producto_id = serializers.IntegerField(write_only=True)
@@ -443,7 +545,7 @@ class ProductoProfesionalSerializer(serializers.ModelSerializer):
         return data
 
 
-class ApiKeySerializer(serializers.ModelSerializer):
+class ApiKeySerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador para el modelo ApiKey"""
     key = serializers.CharField(read_only=True)
     
@@ -459,7 +561,7 @@ class ApiKeySerializer(serializers.ModelSerializer):
         return value.strip()
 
 
-class ApiKeyCreateSerializer(serializers.ModelSerializer):
+class ApiKeyCreateSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador para crear API Keys (muestra la key completa una sola vez)"""
     
     class Meta:
@@ -474,9 +576,10 @@ class ApiKeyCreateSerializer(serializers.ModelSerializer):
         return value.strip()
 
 
-class ApiKeyListSerializer(serializers.ModelSerializer):
+class ApiKeyListSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador simplificado para listados de API Keys (oculta la key completa)"""
     key_preview = serializers.SerializerMethodField()
+    campos_calculados = {'key_preview': ['key']}
     
     class Meta:
         model = ApiKey
@@ -490,7 +593,7 @@ class ApiKeyListSerializer(serializers.ModelSerializer):
 
 
 # Serializadores simplificados para listados
-class UsuarioListSerializer(serializers.ModelSerializer):
+class UsuarioListSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador simplificado para listados de usuarios"""
     
     class Meta:
@@ -498,22 +601,19 @@ class UsuarioListSerializer(serializers.ModelSerializer):
         fields = ['id', 'nombres', 'apellidos', 'tipo', 'email', 'celular']
 
 
-class ProductoListSerializer(serializers.ModelSerializer):
+class ProductoListSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador simplificado para listados de productos"""
     producto_id = serializers.IntegerField(source='id', read_only=True)
     profesionales = serializers.SerializerMethodField()
+    campos_calculados = {'profesionales': []}
     
     class Meta:
         model = Producto
         fields = ['producto_id', 'nombre', 'duracion_minutos', 'es_agendable_por_bot', 'profesionales']
 
     def get_profesionales(self, obj):
-        """Obtener profesionales asignados a este producto"""
-        # Ahora ProductoProfesional apunta directamente a Usuario
-        usuarios_profesionales = Usuario.objects.filter(
-            productoprofesional__producto=obj,
-            tipo=TipoUsuarioEnum.PROFESIONAL
-        ).select_related('profesional')
+        """Obtener profesionales asignados a este producto (ver prefetch_profesionales)"""
+        usuarios_profesionales = profesionales_de_producto(obj)
         return [{
             'profesional_id': usuario.id,
             'nombres': usuario.nombres,
@@ -523,7 +623,7 @@ class ProductoListSerializer(serializers.ModelSerializer):
         } for usuario in usuarios_profesionales]
 
 
-class CitaListSerializer(serializers.ModelSerializer):
+class CitaListSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     """Serializador simplificado para listados de citas"""
     cita_id = serializers.IntegerField(source='id', read_only=True)
     cliente_id = serializers.IntegerField(source='cliente.id', read_only=True)
@@ -533,7 +633,7 @@ class CitaListSerializer(serializers.ModelSerializer):
     producto_nombre = serializers.CharField(source='producto.nombre', read_only=True)
     profesional_id = serializers.IntegerField(source='profesional_asignado.id', read_only=True)
     profesional_nombre = serializers.CharField(source='profesional_asignado.nombres', read_only=True)
-    estado_cita = serializers.CharField(source='estado_actual.estado_cita', read_only=True)
+    estado_cita = serializers.CharField(source='estado', read_only=True)
     google_calendar_event_id = serializers.CharField(read_only=True)
     
     class Meta:
@@ -550,13 +650,23 @@ class CitaListSerializer(serializers.ModelSerializer):
         data = super().to_representation(instance)
         
         # Formatear fechas en la respuesta (dd/mm/aaaa hh:mm) - convertir de UTC a Colombia
-        if instance.fecha_hora_inicio:
+        if 'fecha_hora_inicio' in data and instance.fecha_hora_inicio:
             zona_colombia = ZoneInfo('America/Bogota')
             fecha_colombia = instance.fecha_hora_inicio.astimezone(zona_colombia)
             data['fecha_hora_inicio'] = fecha_colombia.strftime('%d/%m/%Y %H:%M')
-        if instance.fecha_hora_fin:
+        if 'fecha_hora_fin' in data and instance.fecha_hora_fin:
             zona_colombia = ZoneInfo('America/Bogota')
             fecha_colombia = instance.fecha_hora_fin.astimezone(zona_colombia)
             data['fecha_hora_fin'] = fecha_colombia.strftime('%d/%m/%Y %H:%M')
             
         return data
+
+
+class CitaRecordatorioSerializer(CitaListSerializer):
+    """Cita reclamada de la cola de recordatorios, con la acción pendiente y el celular del cliente"""
+    cliente_celular = serializers.CharField(source='cliente.celular', read_only=True)
+    accion = serializers.CharField(read_only=True)
+    campos_calculados = {'accion': []}
+    
+    class Meta(CitaListSerializer.Meta):
+        fields = CitaListSerializer.Meta.fields + ['cliente_celular', 'accion']
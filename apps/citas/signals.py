@@ -0,0 +1,101 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import (
+    ApiKey, Cita, DiaFestivo, ExcepcionHorario, HorarioAtencion,
+    Producto, ProductoProfesional, Profesional, Usuario,
+)
+from .authentication import invalidate_api_key
+from .agenda import agenda_cache
+from . import calendario, catalogo, sincronizacion_calendario, versiones
+
+
+@receiver(post_save, sender=ApiKey)
+@receiver(post_delete, sender=ApiKey)
+def invalidar_cache_api_key(sender, instance, **kwargs):
+    """Invalidar la caché de autenticación al guardar, desactivar o eliminar una API Key"""
+    invalidate_api_key(instance.key)
+
+
+def _horario_cita(instance):
+    # Leer de __dict__ para no disparar la carga de campos diferidos (.only/.defer)
+    datos = instance.__dict__
+    return (
+        datos.get('profesional_asignado_id'),
+        datos.get('fecha_hora_inicio'),
+        datos.get('fecha_hora_fin'),
+    )
+
+
+@receiver(post_init, sender=Cita)
+def recordar_horario_cita(sender, instance, **kwargs):
+    """Guardar el horario con el que se cargó la cita para invalidar también el anterior"""
+    instance._horario_original = _horario_cita(instance)
+
+
+# Debe conectarse antes que invalidar_agenda_cita, que actualiza _horario_original
+@receiver(post_save, sender=Cita)
+def encolar_evento_calendario(sender, instance, created, raw=False, **kwargs):
+    """Registrar en la outbox de calendario la creación, el cambio de horario o la cancelación"""
+    if raw:
+        return
+    estado_anterior = getattr(instance, '_accion_original', (None, None))[0]
+    horario_cambio = getattr(instance, '_horario_original', None) != _horario_cita(instance)
+    sincronizacion_calendario.registrar_cambio(instance, created, estado_anterior, horario_cambio)
+
+
+@receiver(post_delete, sender=Cita)
+def encolar_eliminacion_calendario(sender, instance, **kwargs):
+    sincronizacion_calendario.registrar_eliminacion(instance)
+
+
+@receiver(post_save, sender=Cita)
+@receiver(post_delete, sender=Cita)
+def invalidar_agenda_cita(sender, instance, **kwargs):
+    """Invalidar el índice de agenda al crear, mover, cambiar de estado o eliminar una cita"""
+    actual = _horario_cita(instance)
+    anterior = getattr(instance, '_horario_original', actual)
+    agenda_cache.invalidar(*actual)
+    if anterior != actual:
+        agenda_cache.invalidar(*anterior)
+    instance._horario_original = actual
+
+
+@receiver(post_save, sender=HorarioAtencion)
+@receiver(post_delete, sender=HorarioAtencion)
+@receiver(post_save, sender=DiaFestivo)
+@receiver(post_delete, sender=DiaFestivo)
+@receiver(post_save, sender=ExcepcionHorario)
+@receiver(post_delete, sender=ExcepcionHorario)
+def invalidar_calendario(sender, instance, **kwargs):
+    """Recalcular los meses del calendario laboral tras cualquier cambio de horario o festivo"""
+    calendario.invalidar()
+
+
+# Tablas de versiones.TABLAS_PRODUCTOS (las citas llevan su propia columna version)
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(post_save, sender=ProductoProfesional)
+@receiver(post_delete, sender=ProductoProfesional)
+@receiver(post_save, sender=Usuario)
+@receiver(post_delete, sender=Usuario)
+@receiver(post_save, sender=Profesional)
+@receiver(post_delete, sender=Profesional)
+def incrementar_version_tabla(sender, **kwargs):
+    """Cambiar el ETag de las respuestas que leen esta tabla"""
+    versiones.incrementar(sender)
+
+
+# Tablas de versiones.TABLAS_PRODUCTOS: en los demás workers el catálogo se
+# reconstruye al ver la nueva versión
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(post_save, sender=ProductoProfesional)
+@receiver(post_delete, sender=ProductoProfesional)
+@receiver(post_save, sender=Usuario)
+@receiver(post_delete, sender=Usuario)
+@receiver(post_save, sender=Profesional)
+@receiver(post_delete, sender=Profesional)
+def invalidar_catalogo(sender, **kwargs):
+    """Descartar el catálogo de productos de este worker"""
+    catalogo.invalidar()
@@ -0,0 +1,356 @@
+"""
+Sincronización de citas con Google Calendar mediante una outbox.
+
+Crear, mover o cancelar una cita inserta un EventoCalendario en la misma
+transacción (señal post_save de Cita y estados.cambiar_estados), así que un
+evento pendiente existe si y solo si el cambio de la cita se confirmó. El
+comando ``despachar_calendario`` los reclama en lotes con ``SELECT ... FOR
+UPDATE SKIP LOCKED`` (puede correr en varias réplicas), los envía por el
+transporte configurado en CALENDARIO_TRANSPORTE y, si falla, los reintenta con
+espera exponencial hasta CALENDARIO_SYNC_MAX_INTENTOS.
+
+Los eventos de una misma cita se envían en orden: uno no se reclama mientras
+haya otro anterior pendiente. Crear y actualizar envían el estado actual de la
+cita (no el del momento del cambio) y el event_id se lee de la cita al enviar,
+así que una actualización encolada antes de que exista el evento se resuelve
+bien.
+"""
+import http.client
+import json
+import logging
+import urllib.error
+import urllib.request
+from abc import ABC, abstractmethod
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .calendario import ZONA_COLOMBIA
+from .models import (
+    AccionCalendarioEnum, Cita, EstadoCitaEnum, EstadoEventoCalendarioEnum, EventoCalendario
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_LOTE = 50
+# Espera antes del reintento n: BACKOFF_BASE * 2^(n-1), como máximo BACKOFF_MAXIMO
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAXIMO = timedelta(hours=1)
+
+
+class ErrorTransporte(Exception):
+    """Fallo transitorio del calendario: el evento se reintenta"""
+
+
+class ErrorPermanente(ErrorTransporte):
+    """El calendario rechazó el evento: reintentar no sirve"""
+
+
+class TransporteCalendario(ABC):
+    """
+    Interfaz de los transportes de calendario.
+
+    ``datos`` es el diccionario de datos_cita(). Los errores se reportan con
+    ErrorTransporte / ErrorPermanente.
+    """
+
+    @abstractmethod
+    def crear(self, datos):
+        """Crear el evento; retorna (event_id, url)"""
+
+    @abstractmethod
+    def actualizar(self, event_id, datos):
+        """Actualizar el evento; retorna la url (o None si no cambia)"""
+
+    @abstractmethod
+    def eliminar(self, event_id):
+        """Eliminar el evento"""
+
+
+class TransporteFalso(TransporteCalendario):
+    """
+    Calendario en memoria para pruebas y desarrollo local.
+
+    ``fallar(n)`` hace fallar las siguientes n llamadas con ErrorTransporte.
+    """
+
+    def __init__(self):
+        self.eventos = {}
+        self.llamadas = []
+        self.fallos_pendientes = 0
+        self._siguiente_id = 1
+
+    def fallar(self, veces=1):
+        self.fallos_pendientes = veces
+
+    def _registrar(self, accion, *args):
+        self.llamadas.append((accion, *args))
+        if self.fallos_pendientes:
+            self.fallos_pendientes -= 1
+            raise ErrorTransporte('Fallo simulado del calendario')
+
+    def crear(self, datos):
+        self._registrar(AccionCalendarioEnum.CREAR, datos)
+        event_id = f'falso-{self._siguiente_id}'
+        self._siguiente_id += 1
+        self.eventos[event_id] = datos
+        return event_id, f'https://calendar.local/{event_id}'
+
+    def actualizar(self, event_id, datos):
+        self._registrar(AccionCalendarioEnum.ACTUALIZAR, event_id, datos)
+        if event_id not in self.eventos:
+            raise ErrorPermanente(f"No existe el evento '{event_id}'")
+        self.eventos[event_id] = datos
+        return None
+
+    def eliminar(self, event_id):
+        self._registrar(AccionCalendarioEnum.ELIMINAR, event_id)
+        self.eventos.pop(event_id, None)
+
+
+class TransporteWebhook(TransporteCalendario):
+    """
+    Envía cada evento por POST a CALENDARIO_WEBHOOK_URL (p. ej. un flujo de n8n
+    con las herramientas de Google Calendar).
+
+    Cuerpo: {"accion": "crear_cita" | "actualizar_cita" | "eliminar_cita",
+    "event_id": ..., "datos": {...}}. La respuesta sigue el formato del
+    sub-agente de calendario: {"status": "success" | "error", "data": {...},
+    "error_message": ...}.
+    """
+
+    ACCIONES = {
+        AccionCalendarioEnum.CREAR: 'crear_cita',
+        AccionCalendarioEnum.ACTUALIZAR: 'actualizar_cita',
+        AccionCalendarioEnum.ELIMINAR: 'eliminar_cita',
+    }
+
+    def __init__(self):
+        self.url = getattr(settings, 'CALENDARIO_WEBHOOK_URL', '')
+        self.token = getattr(settings, 'CALENDARIO_WEBHOOK_TOKEN', '')
+        self.timeout = getattr(settings, 'CALENDARIO_WEBHOOK_TIMEOUT', 10)
+
+    def _enviar(self, accion, event_id=None, datos=None):
+        if not self.url:
+            raise ErrorTransporte('CALENDARIO_WEBHOOK_URL no está configurada')
+        cuerpo = json.dumps(
+            {'accion': self.ACCIONES[accion], 'event_id': event_id, 'datos': datos}
+        ).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        solicitud = urllib.request.Request(self.url, data=cuerpo, headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(solicitud, timeout=self.timeout) as respuesta:
+                resultado = json.loads(respuesta.read() or b'{}')
+        except urllib.error.HTTPError as e:
+            if 400 <= e.code < 500 and e.code not in (408, 429):
+                raise ErrorPermanente(f'HTTP {e.code} del webhook de calendario')
+            raise ErrorTransporte(f'HTTP {e.code} del webhook de calendario')
+        except (urllib.error.URLError, http.client.HTTPException, OSError, ValueError) as e:
+            # URLError y TimeoutError son OSError; también llegan sin envolver
+            # ConnectionResetError al leer la respuesta e IncompleteRead /
+            # RemoteDisconnected de http.client
+            raise ErrorTransporte(f'Error llamando al webhook de calendario: {e}')
+
+        if resultado.get('status') != 'success':
+            raise ErrorTransporte(resultado.get('error_message') or 'Respuesta sin status success')
+        return resultado.get('data') or {}
+
+    def crear(self, datos):
+        data = self._enviar(AccionCalendarioEnum.CREAR, datos=datos)
+        if not data.get('google_calendar_event_id'):
+            raise ErrorTransporte('La respuesta no incluye google_calendar_event_id')
+        return data['google_calendar_event_id'], data.get('google_calendar_url_event')
+
+    def actualizar(self, event_id, datos):
+        return self._enviar(AccionCalendarioEnum.ACTUALIZAR, event_id, datos).get('google_calendar_url_event')
+
+    def eliminar(self, event_id):
+        self._enviar(AccionCalendarioEnum.ELIMINAR, event_id)
+
+
+def obtener_transporte():
+    return import_string(settings.CALENDARIO_TRANSPORTE)()
+
+
+def acciones_por_cambio(creada, estado_anterior, estado_nuevo, horario_cambio):
+    """Acciones de calendario que produce un cambio en una cita"""
+    cancelada = estado_nuevo == EstadoCitaEnum.CANCELADO
+    if creada:
+        return [] if cancelada else [AccionCalendarioEnum.CREAR]
+    if cancelada and estado_anterior != EstadoCitaEnum.CANCELADO:
+        return [AccionCalendarioEnum.ELIMINAR]
+    if estado_anterior == EstadoCitaEnum.CANCELADO and not cancelada:
+        # Reactivada: su evento se eliminó al cancelarla
+        return [AccionCalendarioEnum.CREAR]
+    if horario_cambio and not cancelada:
+        return [AccionCalendarioEnum.ACTUALIZAR]
+    return []
+
+
+def evento_para(cita, accion):
+    return EventoCalendario(
+        cita_id=cita.id, accion=accion, google_calendar_event_id=cita.google_calendar_event_id
+    )
+
+
+def registrar_cambio(cita, creada, estado_anterior, horario_cambio):
+    """Encolar los eventos de calendario de un guardado de Cita (se llama desde post_save)"""
+    acciones = acciones_por_cambio(creada, estado_anterior, cita.estado, horario_cambio)
+    if acciones:
+        EventoCalendario.objects.bulk_create([evento_para(cita, accion) for accion in acciones])
+
+
+def registrar_eliminacion(cita):
+    """Encolar la eliminación del evento de una cita borrada (post_delete)"""
+    if cita.google_calendar_event_id and cita.estado != EstadoCitaEnum.CANCELADO:
+        evento = evento_para(cita, AccionCalendarioEnum.ELIMINAR)
+        evento.cita_id = None
+        evento.save()
+
+
+def datos_cita(cita):
+    """Datos del evento de calendario de una cita"""
+    cliente = f"{cita.cliente.nombres} {cita.cliente.apellidos}"
+    profesional = cita.profesional_asignado
+    return {
+        'cita_id': cita.id,
+        'titulo': f"{cita.producto.nombre} - {cliente}",
+        'inicio': cita.fecha_hora_inicio.astimezone(ZONA_COLOMBIA).isoformat(),
+        'fin': cita.fecha_hora_fin.astimezone(ZONA_COLOMBIA).isoformat(),
+        'cliente': cliente,
+        'cliente_celular': cita.cliente.celular,
+        'profesional': f"{profesional.nombres} {profesional.apellidos}" if profesional else None,
+        'profesional_email': profesional.email if profesional else None,
+        'descripcion': cita.observaciones or '',
+    }
+
+
+def espera_reintento(intentos):
+    return min(BACKOFF_BASE * 2 ** (intentos - 1), BACKOFF_MAXIMO)
+
+
+def reclamar(limite, lease=None):
+    """
+    Reclamar hasta ``limite`` eventos pendientes y vencidos, en orden de creación.
+
+    Igual que recordatorios.reclamar: las filas bloqueadas por otra réplica se
+    saltan y las reclamadas se aplazan ``lease`` segundos, de modo que si el
+    proceso muere a mitad del envío el evento se reintenta al vencer el plazo.
+    """
+    lease = lease or getattr(settings, 'CALENDARIO_SYNC_LEASE_SEGUNDOS', 120)
+    ahora = timezone.now()
+    anterior_pendiente = EventoCalendario.objects.filter(
+        cita_id=OuterRef('cita_id'),
+        estado=EstadoEventoCalendarioEnum.PENDIENTE,
+        id__lt=OuterRef('id'),
+    )
+    with transaction.atomic():
+        eventos = list(
+            EventoCalendario.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(estado=EstadoEventoCalendarioEnum.PENDIENTE, proximo_intento__lte=ahora)
+            .exclude(Exists(anterior_pendiente))
+            .select_related('cita__cliente', 'cita__producto', 'cita__profesional_asignado')
+            .order_by('id')[:limite]
+        )
+        if eventos:
+            EventoCalendario.objects.filter(id__in=[evento.id for evento in eventos]).update(
+                proximo_intento=ahora + timedelta(seconds=lease)
+            )
+    return eventos
+
+
+def _actualizar_cita(cita, **campos):
+    # UPDATE directo (sin save) para no volver a encolar un evento; la versión
+    # de la cita (ETag) se incrementa a mano
+    Cita.objects.filter(pk=cita.pk).update(version=F('version') + 1, **campos)
+
+
+def _enviar(evento, transporte):
+    """
+    Ejecutar un evento en el transporte y reflejar el resultado en la cita.
+
+    Retorna el estado final del evento (ENVIADO o DESCARTADO).
+    """
+    cita = evento.cita
+    accion = evento.accion
+    if cita is None and accion != AccionCalendarioEnum.ELIMINAR:
+        return EstadoEventoCalendarioEnum.DESCARTADO
+
+    if accion == AccionCalendarioEnum.ELIMINAR:
+        event_id = cita.google_calendar_event_id if cita else evento.google_calendar_event_id
+        if event_id:
+            transporte.eliminar(event_id)
+        if cita:
+            _actualizar_cita(cita, google_calendar_event_id=None, google_calendar_url_event=None)
+        return EstadoEventoCalendarioEnum.ENVIADO
+
+    if cita.estado == EstadoCitaEnum.CANCELADO:
+        # Se canceló antes de sincronizar; la eliminación encolada no tendrá nada que borrar
+        return EstadoEventoCalendarioEnum.DESCARTADO
+
+    # Crear si la cita aún no tiene evento (p. ej. el crear inicial falló) y
+    # actualizar si ya lo tiene (p. ej. lo creó el agente directamente)
+    if cita.google_calendar_event_id:
+        url = transporte.actualizar(cita.google_calendar_event_id, datos_cita(cita))
+        if url:
+            _actualizar_cita(cita, google_calendar_url_event=url)
+    else:
+        event_id, url = transporte.crear(datos_cita(cita))
+        _actualizar_cita(cita, google_calendar_event_id=event_id, google_calendar_url_event=url)
+    return EstadoEventoCalendarioEnum.ENVIADO
+
+
+def _registrar_fallo(evento, error, max_intentos, resumen):
+    """Programar el reintento del evento o marcarlo FALLIDO si no hay más intentos"""
+    eventos = EventoCalendario.objects.filter(pk=evento.pk)
+    intentos = evento.intentos + 1
+    if isinstance(error, ErrorPermanente) or intentos >= max_intentos:
+        logger.error(f"Evento de calendario {evento.id} ({evento.accion}) fallido tras {intentos} intentos: {error}")
+        eventos.update(estado=EstadoEventoCalendarioEnum.FALLIDO, intentos=F('intentos') + 1, ultimo_error=str(error))
+        resumen['fallidos'] += 1
+    else:
+        logger.warning(f"Evento de calendario {evento.id} ({evento.accion}) falló, intento {intentos}: {error}")
+        eventos.update(
+            intentos=F('intentos') + 1, ultimo_error=str(error),
+            proximo_intento=timezone.now() + espera_reintento(intentos),
+        )
+        resumen['reintentos'] += 1
+
+
+def despachar(limite=MAX_LOTE, transporte=None):
+    """
+    Enviar un lote de eventos pendientes.
+
+    Retorna {'enviados', 'descartados', 'reintentos', 'fallidos'}.
+    """
+    transporte = transporte or obtener_transporte()
+    max_intentos = getattr(settings, 'CALENDARIO_SYNC_MAX_INTENTOS', 8)
+    resumen = {'enviados': 0, 'descartados': 0, 'reintentos': 0, 'fallidos': 0}
+
+    for evento in reclamar(limite):
+        eventos = EventoCalendario.objects.filter(pk=evento.pk)
+        try:
+            estado = _enviar(evento, transporte)
+        except ErrorTransporte as e:
+            _registrar_fallo(evento, e, max_intentos, resumen)
+            continue
+        except Exception as e:
+            # Un error no previsto (del transporte o de los datos de la cita) no
+            # debe cortar el lote ni dejar el evento reclamado hasta que venza el
+            # lease: se registra como un fallo transitorio más
+            logger.exception(f"Error inesperado enviando el evento de calendario {evento.id} ({evento.accion})")
+            _registrar_fallo(evento, ErrorTransporte(f'{type(e).__name__}: {e}'), max_intentos, resumen)
+            continue
+
+        eventos.update(
+            estado=estado, intentos=F('intentos') + 1, ultimo_error='', fecha_envio=timezone.now()
+        )
+        resumen['enviados' if estado == EstadoEventoCalendarioEnum.ENVIADO else 'descartados'] += 1
+
+    return resumen
@@ -1,3 +1,1069 @@
-from django.test import TestCase
+import http.client
+import threading
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections, transaction
+from django.db.models.signals import post_save
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import calendario, catalogo, programador, versiones
+from .agenda import agenda_cache
+from .authentication import ApiKeyAuthentication, api_key_cache, api_key_invalida_cache
+from .calendario import ZONA_COLOMBIA
+from .estados import ERROR_ESTADO_CAMBIADO, cambiar_estados
+from .filtros import filtrar_rango, rango_desde_parametros
+from .models import (
+    AccionCalendarioEnum, ApiKey, ApiKeyUsageRollup, Cita, Cliente, EstadoChat,
+    EstadoEventoCalendarioEnum, EventoCalendario, Producto, ProductoProfesional, Profesional, Usuario,
+)
+from .pagination import conteo_cache
+from .recordatorios import RECORDATORIO_24H, reclamar
+from .sincronizacion_calendario import (
+    ErrorPermanente, ErrorTransporte, TransporteFalso, TransporteWebhook, despachar,
+)
+from .throttling import CacheTokenBucketStore, verificar_configuracion
+from .usage import UsageBuffer
+
+
+def crear_usuario(tipo, documento):
+    return Usuario.objects.create(
+        nombres=f'{tipo} {documento}', apellidos='Prueba', tipo_documento='CC',
+        numero_documento=documento, celular='3000000000', tipo=tipo,
+    )
+
+
+class PorFechaCompletoTests(TestCase):
+    """GET /api/v1/citas/por-fecha-completo/ con número de consultas fijo"""
+
+    url = '/api/v1/citas/por-fecha-completo/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.producto = Producto.objects.create(nombre='Orientación Vocacional', duracion_minutos=30)
+        cls.profesionales = []
+        for i in range(5):
+            usuario = crear_usuario('Profesional', f'p{i}')
+            Profesional.objects.create(usuario=usuario, numero_whatsapp=f'57300000000{i}', cargo='Psicóloga')
+            cls.profesionales.append(usuario)
+        cls.clientes = []
+        for i in range(10):
+            usuario = crear_usuario('Cliente', f'c{i}')
+            # Un cliente sin perfil Cliente para cubrir el caso sin perfil
+            if i:
+                Cliente.objects.create(usuario=usuario, edad=15 + i, barrio='Centro')
+            cls.clientes.append(usuario)
+        cls.dia = datetime(2030, 3, 4, tzinfo=ZONA_COLOMBIA)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('consulta'))
+
+    def crear_citas(self, cantidad):
+        citas = []
+        for i in range(cantidad):
+            # Sin cruces por profesional: cada profesional encadena citas de 30 minutos
+            inicio = self.dia + timedelta(minutes=30 * (i // len(self.profesionales)))
+            citas.append(Cita(
+                cliente=self.clientes[i % len(self.clientes)],
+                producto=self.producto,
+                profesional_asignado=self.profesionales[i % len(self.profesionales)] if i % 7 else None,
+                fecha_hora_inicio=inicio,
+                fecha_hora_fin=inicio + timedelta(minutes=30),
+            ))
+        Cita.objects.bulk_create(citas)
+
+    def consultas_de_pagina(self, cantidad):
+        Cita.objects.all().delete()
+        self.crear_citas(cantidad)
+        # El total cacheado del llamado anterior ahorraría el conteo
+        conteo_cache.clear()
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(
+                self.url, {'fecha_inicio': '2030-03-01', 'fecha_fin': '2030-03-31', 'page_size': 500}
+            )
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.data['results']['results']), cantidad)
+        return len(consultas), respuesta.data['results']['results']
+
+    def test_consultas_constantes_con_1_o_500_citas(self):
+        consultas_una, _ = self.consultas_de_pagina(1)
+        consultas_quinientas, filas = self.consultas_de_pagina(500)
+        self.assertEqual(consultas_una, consultas_quinientas)
+
+        sin_profesional = [fila for fila in filas if fila['profesional'] is None]
+        self.assertTrue(sin_profesional)
+        sin_perfil = [fila for fila in filas if fila['cliente']['usuario_id'] == self.clientes[0].id]
+        self.assertIsNone(sin_perfil[0]['cliente']['edad'])
+        con_perfil = next(fila for fila in filas if fila['profesional'] and fila['cliente']['edad'])
+        self.assertEqual(con_perfil['profesional']['cargo'], 'Psicóloga')
+        self.assertEqual(con_perfil['cita']['estado_actual'], 'Sin estado')
+
+
+class FiltroRangoFechasTests(TestCase):
+    """Filtro fecha_inicio / fecha_fin como límites [desde, hasta) sobre fecha_hora_inicio"""
+
+    @classmethod
+    def setUpTestData(cls):
+        producto = Producto.objects.create(nombre='Orientación Vocacional', duracion_minutos=30)
+        cliente = crear_usuario('Cliente', 'c1')
+        inicio = datetime(2030, 1, 1, 8, tzinfo=ZONA_COLOMBIA)
+        # Un año de citas para que el planificador prefiera el índice a recorrer la tabla
+        Cita.objects.bulk_create(
+            Cita(
+                cliente=cliente, producto=producto,
+                fecha_hora_inicio=inicio + timedelta(hours=4 * i),
+                fecha_hora_fin=inicio + timedelta(hours=4 * i, minutes=30),
+            )
+            for i in range(6 * 365)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE citas_cita')
+
+    def test_dia_completo_en_hora_de_colombia(self):
+        desde, hasta = rango_desde_parametros({'fecha_inicio': '2030-03-04', 'fecha_fin': '2030-03-04'})
+        self.assertEqual(desde, datetime(2030, 3, 4, tzinfo=ZONA_COLOMBIA))
+        self.assertEqual(hasta, datetime(2030, 3, 5, tzinfo=ZONA_COLOMBIA))
+        # Una cita cada 4 horas; las de 20:00 ya son del día siguiente en UTC
+        self.assertEqual(filtrar_rango(Cita.objects.all(), desde, hasta).count(), 6)
+
+    def test_fecha_hora_sin_zona_es_hora_de_colombia(self):
+        desde, hasta = rango_desde_parametros({'fecha_inicio': '2030-03-04T12:00', 'fecha_fin': '2030-03-04T20:00:00'})
+        self.assertEqual(desde, datetime(2030, 3, 4, 12, tzinfo=ZONA_COLOMBIA))
+        self.assertEqual(filtrar_rango(Cita.objects.all(), desde, hasta).count(), 2)
+
+    def test_parametros_invalidos(self):
+        for parametros in (
+            {'fecha_inicio': '04/03/2030'},
+            {'fecha_fin': '2030-02-30'},
+            {'fecha_inicio': '2030-03-05', 'fecha_fin': '2030-03-04'},
+        ):
+            with self.subTest(parametros=parametros), self.assertRaises(ValueError):
+                rango_desde_parametros(parametros)
+        with self.assertRaises(ValueError):
+            rango_desde_parametros({'fecha_inicio': '2030-01-01'}, requerido=True)
+        with self.assertRaises(ValueError):
+            rango_desde_parametros({'fecha_inicio': '2030-01-01', 'fecha_fin': '2031-01-01'}, max_dias=365)
+
+    def test_endpoint_responde_400_con_fecha_invalida(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('consulta'))
+        respuesta = client.get('/api/v1/citas/por-fecha/', {'fecha_inicio': '2030-13-01'})
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('fecha_inicio', respuesta.data['error'])
+
+    def test_explain_usa_range_scan_del_indice(self):
+        desde, hasta = rango_desde_parametros({'fecha_inicio': '2030-03-04', 'fecha_fin': '2030-03-10'})
+        plan = filtrar_rango(Cita.objects.all(), desde, hasta).order_by('fecha_hora_inicio', 'id').explain()
+        self.assertRegex(plan, r'Index (Only )?Scan')
+        condicion = next(linea for linea in plan.splitlines() if 'Index Cond' in linea)
+        self.assertIn('fecha_hora_inicio >=', condicion)
+        self.assertIn('fecha_hora_inicio <', condicion)
+        self.assertNotIn('Seq Scan', plan)
+
+
+class CursorFechaPaginationTests(TestCase):
+    """Paginación por cursor (fecha_hora_inicio, id) de /api/v1/citas/por-fecha/"""
+
+    url = '/api/v1/citas/por-fecha/'
+
+    @classmethod
+    def setUpTestData(cls):
+        producto = Producto.objects.create(nombre='Orientación Vocacional', duracion_minutos=30)
+        cliente = crear_usuario('Cliente', 'c1')
+        inicio = datetime(2030, 3, 4, 9, tzinfo=ZONA_COLOMBIA)
+        # Tres citas con la misma hora de inicio (sin profesional, para no cruzarse) y una posterior
+        inicios = [inicio, inicio, inicio, inicio + timedelta(hours=1)]
+        cls.citas = [
+            Cita.objects.create(
+                cliente=cliente, producto=producto,
+                fecha_hora_inicio=hora, fecha_hora_fin=hora + timedelta(minutes=30),
+            )
+            for hora in inicios
+        ]
+
+    def setUp(self):
+        conteo_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('consulta'))
+
+    def test_recorre_dos_paginas_sin_duplicados_ni_huecos_con_fechas_iguales(self):
+        primera = self.client.get(self.url, {'fecha_inicio': '2030-03-04', 'fecha_fin': '2030-03-04', 'page_size': 2})
+        self.assertEqual(primera.status_code, 200)
+        self.assertEqual(primera.data['count'], 4)
+        self.assertIsNone(primera.data['previous'])
+        self.assertIsNotNone(primera.data['next'])
+
+        # El cursor de la primera página queda entre dos citas con la misma fecha_hora_inicio
+        segunda = self.client.get(primera.data['next'])
+        self.assertEqual(segunda.status_code, 200)
+        self.assertIsNone(segunda.data['next'])
+
+        ids = [fila['cita_id'] for fila in primera.data['results'] + segunda.data['results']]
+        self.assertEqual(ids, [cita.id for cita in self.citas])
+
+        anterior = self.client.get(segunda.data['previous'])
+        self.assertEqual(
+            [fila['cita_id'] for fila in anterior.data['results']],
+            [fila['cita_id'] for fila in primera.data['results']],
+        )
+
+    @override_settings(CONTEO_EXACTO_MAXIMO=2)
+    def test_rango_mayor_al_maximo_usa_la_estimacion_cacheada(self):
+        parametros = {'fecha_inicio': '2030-03-04', 'fecha_fin': '2030-03-04', 'page_size': 2}
+
+        with CaptureQueriesContext(connection) as consultas:
+            primera = self.client.get(self.url, parametros)
+
+        self.assertEqual(primera.status_code, 200)
+        self.assertFalse(primera.data['count_exacto'])
+        # La estimación nunca queda por debajo de las filas ya contadas (máximo + 1)
+        self.assertGreaterEqual(primera.data['count'], 3)
+        self.assertTrue(any(q['sql'].startswith('EXPLAIN') for q in consultas.captured_queries))
+
+        aciertos = conteo_cache.stats()['hits']
+        with CaptureQueriesContext(connection) as consultas:
+            segunda = self.client.get(self.url, parametros)
+
+        self.assertEqual(conteo_cache.stats()['hits'], aciertos + 1)
+        self.assertEqual(segunda.data['count'], primera.data['count'])
+        self.assertFalse(segunda.data['count_exacto'])
+        self.assertFalse([
+            q['sql'] for q in consultas.captured_queries if 'EXPLAIN' in q['sql'] or 'COUNT(' in q['sql']
+        ])
+
+
+class DespacharCalendarioTests(TestCase):
+    """Outbox de calendario: despachar() con TransporteFalso"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.producto = Producto.objects.create(nombre='Orientación Vocacional', duracion_minutos=30)
+        cls.cliente = crear_usuario('Cliente', 'c1')
+        cls.profesional = crear_usuario('Profesional', 'p1')
+
+    def setUp(self):
+        self.transporte = TransporteFalso()
+        inicio = datetime(2030, 3, 4, 9, tzinfo=ZONA_COLOMBIA)
+        # El post_save de la cita encola el evento de creación
+        self.cita = Cita.objects.create(
+            cliente=self.cliente, producto=self.producto, profesional_asignado=self.profesional,
+            fecha_hora_inicio=inicio, fecha_hora_fin=inicio + timedelta(minutes=30),
+        )
+        self.evento = EventoCalendario.objects.get(cita=self.cita)
+
+    def vencer_reintento(self):
+        EventoCalendario.objects.filter(pk=self.evento.pk).update(proximo_intento=timezone.now())
+
+    def test_encola_y_envia_la_creacion(self):
+        self.assertEqual(self.evento.accion, AccionCalendarioEnum.CREAR)
+        self.assertEqual(self.evento.estado, EstadoEventoCalendarioEnum.PENDIENTE)
+
+        resumen = despachar(transporte=self.transporte)
+
+        self.assertEqual(resumen, {'enviados': 1, 'descartados': 0, 'reintentos': 0, 'fallidos': 0})
+        self.evento.refresh_from_db()
+        self.assertEqual(self.evento.estado, EstadoEventoCalendarioEnum.ENVIADO)
+        self.assertEqual(self.evento.intentos, 1)
+        self.cita.refresh_from_db()
+        self.assertIn(self.cita.google_calendar_event_id, self.transporte.eventos)
+        self.assertEqual(self.transporte.eventos[self.cita.google_calendar_event_id]['cita_id'], self.cita.id)
+        # Ya no queda nada pendiente
+        self.assertEqual(despachar(transporte=self.transporte)['enviados'], 0)
+
+    def test_fallo_transitorio_se_reintenta_con_espera(self):
+        self.transporte.fallar(1)
+
+        resumen = despachar(transporte=self.transporte)
+
+        self.assertEqual(resumen['reintentos'], 1)
+        self.evento.refresh_from_db()
+        self.assertEqual(self.evento.estado, EstadoEventoCalendarioEnum.PENDIENTE)
+        self.assertEqual(self.evento.intentos, 1)
+        self.assertEqual(self.evento.ultimo_error, 'Fallo simulado del calendario')
+        self.assertGreater(self.evento.proximo_intento, timezone.now())
+        # Antes de vencer la espera no se vuelve a enviar
+        self.assertEqual(despachar(transporte=self.transporte)['enviados'], 0)
+        self.assertEqual(len(self.transporte.llamadas), 1)
+
+        self.vencer_reintento()
+        self.assertEqual(despachar(transporte=self.transporte)['enviados'], 1)
+        self.evento.refresh_from_db()
+        self.assertEqual(self.evento.estado, EstadoEventoCalendarioEnum.ENVIADO)
+        self.assertEqual(self.evento.intentos, 2)
+        self.assertEqual(self.evento.ultimo_error, '')
+
+    @override_settings(CALENDARIO_SYNC_MAX_INTENTOS=3)
+    def test_intentos_agotados_queda_fallido(self):
+        self.transporte.fallar(10)
+        for _ in range(2):
+            self.assertEqual(despachar(transporte=self.transporte)['reintentos'], 1)
+            self.vencer_reintento()
+
+        resumen = despachar(transporte=self.transporte)
+
+        self.assertEqual(resumen['fallidos'], 1)
+        self.evento.refresh_from_db()
+        self.assertEqual(self.evento.estado, EstadoEventoCalendarioEnum.FALLIDO)
+        self.assertEqual(self.evento.intentos, 3)
+        # Un evento fallido no se vuelve a reclamar
+        self.vencer_reintento()
+        self.assertEqual(despachar(transporte=self.transporte), {'enviados': 0, 'descartados': 0, 'reintentos': 0, 'fallidos': 0})
+        self.assertEqual(len(self.transporte.llamadas), 3)
+
+    def test_error_inesperado_se_reintenta_y_no_corta_el_lote(self):
+        inicio = datetime(2030, 3, 4, 10, tzinfo=ZONA_COLOMBIA)
+        otra = Cita.objects.create(
+            cliente=self.cliente, producto=self.producto, profesional_asignado=self.profesional,
+            fecha_hora_inicio=inicio, fecha_hora_fin=inicio + timedelta(minutes=30),
+        )
+        crear_original = self.transporte.crear
+
+        def crear(datos):
+            if datos['cita_id'] == self.cita.id:
+                raise RuntimeError('respuesta inesperada')
+            return crear_original(datos)
+
+        with mock.patch.object(self.transporte, 'crear', side_effect=crear):
+            with self.assertLogs('apps.citas.sincronizacion_calendario', 'ERROR'):
+                resumen = despachar(transporte=self.transporte)
+
+        self.assertEqual(resumen, {'enviados': 1, 'descartados': 0, 'reintentos': 1, 'fallidos': 0})
+        self.evento.refresh_from_db()
+        self.assertEqual(self.evento.estado, EstadoEventoCalendarioEnum.PENDIENTE)
+        self.assertEqual(self.evento.intentos, 1)
+        self.assertEqual(self.evento.ultimo_error, 'RuntimeError: respuesta inesperada')
+        self.assertGreater(self.evento.proximo_intento, timezone.now())
+        otra.refresh_from_db()
+        self.assertIsNotNone(otra.google_calendar_event_id)
+
+    @override_settings(CALENDARIO_WEBHOOK_URL='http://calendario.invalid/webhook')
+    def test_webhook_convierte_errores_de_red_en_error_transporte(self):
+        transporte = TransporteWebhook()
+        for error in (
+            ConnectionResetError('conexión reiniciada'),
+            http.client.RemoteDisconnected('cerrada sin respuesta'),
+            http.client.IncompleteRead(b''),
+        ):
+            with self.subTest(error=type(error).__name__):
+                with mock.patch('urllib.request.urlopen', side_effect=error):
+                    with self.assertRaises(ErrorTransporte) as contexto:
+                        transporte.eliminar('evento-1')
+                self.assertNotIsInstance(contexto.exception, ErrorPermanente)
+
+
+class CitaDetalleCondicionalTests(TestCase):
+    """GET /api/v1/citas/{id}/ con ETag de la versión de la cita y de las tablas embebidas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.producto = Producto.objects.create(nombre='Orientación Vocacional', duracion_minutos=30)
+        cls.cliente = crear_usuario('Cliente', 'c1')
+        inicio = datetime(2030, 3, 4, 9, tzinfo=ZONA_COLOMBIA)
+        cls.citas = [
+            Cita.objects.create(
+                cliente=cls.cliente, producto=cls.producto,
+                fecha_hora_inicio=inicio, fecha_hora_fin=inicio + timedelta(minutes=30),
+            )
+            for _ in range(2)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('consulta'))
+        self.url = f'/api/v1/citas/{self.citas[0].id}/'
+        self.etag = self.client.get(self.url)['ETag']
+
+    def test_304_sin_la_consulta_con_relaciones(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(respuesta.status_code, 304)
+        # La versión de la cita y los contadores de VersionTabla
+        self.assertEqual(len(consultas.captured_queries), 2)
+
+    def test_cambio_en_otra_cita_no_invalida_el_etag(self):
+        otra = self.citas[1]
+        otra.observaciones = 'Reprogramada'
+        with self.captureOnCommitCallbacks(execute=True):
+            otra.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag).status_code, 304)
+
+    def test_cambio_en_los_datos_embebidos_invalida_el_etag(self):
+        self.cliente.nombres = 'Otro nombre'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cliente.save()
+
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], self.etag)
+        self.assertEqual(respuesta.data['cliente']['nombres'], 'Otro nombre')
+
+    def test_cambio_de_la_cita_invalida_el_etag(self):
+        cita = Cita.objects.get(pk=self.citas[0].pk)
+        cita.cambiar_estado('Primer Confirmado')
+        self.assertEqual(cita.version, 2)
+
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], self.etag)
+        self.assertEqual(respuesta.data['estado_actual']['estado_cita'], 'Primer Confirmado')
+
+    def test_consultar_por_id_no_responde_304_a_post(self):
+        respuesta = self.client.post(
+            '/api/v1/citas/consultar-por-id/', {'cita_id': self.citas[0].id},
+            format='json', HTTP_IF_NONE_MATCH=self.etag,
+        )
+        self.assertEqual(respuesta.status_code, 200)
+
+
+class ProductoListadoCondicionalTests(TestCase):
+    """GET /api/v1/productos/ con ETag de las versiones de TABLAS_PRODUCTOS"""
+
+    url = '/api/v1/productos/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.producto = Producto.objects.create(nombre='Orientación Vocacional', duracion_minutos=30)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('consulta'))
+        self.etag = self.client.get(self.url)['ETag']
+
+    def test_304_con_una_sola_consulta(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertEqual(respuesta['ETag'], self.etag)
+        self.assertEqual(len(consultas.captured_queries), 1)
+
+    def test_cambio_de_producto_invalida_el_etag(self):
+        self.producto.nombre = 'Asesoría'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.producto.save()
+
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], self.etag)
+        self.assertEqual([fila['nombre'] for fila in respuesta.data['results']], ['Asesoría'])
+
+    def test_el_etag_depende_de_los_parametros(self):
+        respuesta = self.client.get(self.url, {'page': 1}, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(respuesta.status_code, 200)
+
+
+class CatalogoProductosTests(TestCase):
+    """Catálogo de productos en memoria detrás de GET /api/v1/productos/"""
+
+    url = '/api/v1/productos/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.producto = Producto.objects.create(nombre='Orientación Vocacional', duracion_minutos=30)
+        cls.usuario = crear_usuario('Profesional', 'p1')
+        cls.profesional = Profesional.objects.create(usuario=cls.usuario, numero_whatsapp='573000000001', cargo='Psicóloga')
+
+    def setUp(self):
+        # El catálogo es global del worker: no heredar el de otra prueba con las mismas versiones
+        catalogo.invalidar()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('consulta'))
+
+    def profesionales(self):
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        return [(fila['profesional_id'], fila['cargo']) for fila in respuesta.data['results'][0]['profesionales']]
+
+    def test_sin_cambios_se_sirve_de_memoria_con_una_consulta(self):
+        self.client.get(self.url)
+
+        with mock.patch.object(catalogo, 'construir', wraps=catalogo.construir) as construir:
+            with CaptureQueriesContext(connection) as consultas:
+                respuesta = self.client.get(self.url)
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.data['results'][0]['nombre'], 'Orientación Vocacional')
+        construir.assert_not_called()
+        # Solo la lectura de VersionTabla
+        self.assertEqual(len(consultas.captured_queries), 1)
+
+    def test_se_reconstruye_al_asignar_un_profesional(self):
+        self.assertEqual(self.profesionales(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductoProfesional.objects.create(producto=self.producto, profesional=self.usuario)
+
+        self.assertEqual(self.profesionales(), [(self.usuario.id, 'Psicóloga')])
+
+    def test_se_reconstruye_al_cambiar_el_profesional(self):
+        ProductoProfesional.objects.create(producto=self.producto, profesional=self.usuario)
+        self.assertEqual(self.profesionales(), [(self.usuario.id, 'Psicóloga')])
+
+        self.profesional.cargo = 'Orientadora'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profesional.save()
+
+        self.assertEqual(self.profesionales(), [(self.usuario.id, 'Orientadora')])
+
+    def test_se_reconstruye_con_la_version_incrementada_en_otro_worker(self):
+        ProductoProfesional.objects.create(producto=self.producto, profesional=self.usuario)
+        self.assertEqual(self.profesionales(), [(self.usuario.id, 'Psicóloga')])
+
+        # Sin señales en este worker: solo cambia el contador de VersionTabla
+        Profesional.objects.filter(pk=self.profesional.pk).update(cargo='Orientadora')
+        with self.captureOnCommitCallbacks(execute=True):
+            versiones.incrementar(Profesional)
+
+        with mock.patch.object(catalogo, 'construir', wraps=catalogo.construir) as construir:
+            self.assertEqual(self.profesionales(), [(self.usuario.id, 'Orientadora')])
+        construir.assert_called_once()
+
+
+class GuardarEstadoChatTests(TestCase):
+    """PUT /api/v1/estados-chat/guardar-por-numero/ (INSERT ... ON CONFLICT en una consulta)"""
+
+    url = '/api/v1/estados-chat/guardar-por-numero/'
+    numero = '573001234567'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('bot'))
+
+    def guardar(self, numero, estado_conversacion):
+        return self.client.put(
+            self.url, {'numero_whatsapp': numero, 'estado_conversacion': estado_conversacion}, format='json'
+        )
+
+    def test_crea_y_luego_reemplaza_en_una_consulta(self):
+        with CaptureQueriesContext(connection) as consultas:
+            creado = self.guardar(self.numero, {'fase': 'inicio', 'paso': 1})
+        self.assertEqual(creado.status_code, 201)
+        self.assertEqual(len(consultas.captured_queries), 1)
+
+        with CaptureQueriesContext(connection) as consultas:
+            reemplazado = self.guardar(self.numero, {'fase': 'confirmacion_cita'})
+        self.assertEqual(reemplazado.status_code, 200)
+        self.assertEqual(len(consultas.captured_queries), 1)
+
+        self.assertEqual(reemplazado.data['data']['id'], creado.data['data']['id'])
+        estado_chat = EstadoChat.objects.get(numero_whatsapp=self.numero)
+        # Reemplaza el estado completo: la clave paso desaparece
+        self.assertEqual(estado_chat.estado_conversacion, {'fase': 'confirmacion_cita'})
+
+    def test_numero_mas_largo_que_la_columna_responde_400(self):
+        respuesta = self.guardar('5' * 21, {'fase': 'inicio'})
+
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('numero_whatsapp', respuesta.data['detalles'])
+        self.assertFalse(EstadoChat.objects.exists())
+
+
+class FusionarEstadoChatTests(TestCase):
+    """PATCH /api/v1/estados-chat/fusionar-por-numero/ (merge patch RFC 7396 y rutas en SQL)"""
+
+    url = '/api/v1/estados-chat/fusionar-por-numero/'
+    numero = '573001234567'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('bot'))
+        EstadoChat.objects.guardar(self.numero, {
+            'fase': 'inicio',
+            'datos': {'horario': '10:00', 'producto_id': 3, 'temporal': {'paso': 1}},
+            'opciones': [1, 2, 3],
+        })
+
+    def fusionar(self, **cambios):
+        respuesta = self.client.patch(self.url, {'numero_whatsapp': self.numero, **cambios}, format='json')
+        self.assertEqual(respuesta.status_code, 200, respuesta.data)
+        guardado = EstadoChat.objects.get(numero_whatsapp=self.numero).estado_conversacion
+        self.assertEqual(respuesta.data['data']['estado_conversacion'], guardado)
+        return guardado
+
+    def test_fusiona_objetos_anidados(self):
+        estado = self.fusionar(parche={'fase': 'pago', 'datos': {'horario': '11:00', 'temporal': {'nuevo': True}}})
+        self.assertEqual(estado, {
+            'fase': 'pago',
+            'datos': {'horario': '11:00', 'producto_id': 3, 'temporal': {'paso': 1, 'nuevo': True}},
+            'opciones': [1, 2, 3],
+        })
+
+    def test_null_elimina_la_clave(self):
+        estado = self.fusionar(parche={'fase': None, 'datos': {'temporal': None}})
+        self.assertEqual(estado, {'datos': {'horario': '10:00', 'producto_id': 3}, 'opciones': [1, 2, 3]})
+
+    def test_los_arreglos_se_reemplazan(self):
+        estado = self.fusionar(parche={'opciones': [4], 'datos': {'temporal': ['x']}})
+        self.assertEqual(estado['opciones'], [4])
+        self.assertEqual(estado['datos']['temporal'], ['x'])
+
+    def test_rutas_despues_del_parche(self):
+        estado = self.fusionar(
+            parche={'datos': {'horario': None}},
+            rutas=[
+                {'ruta': ['datos', 'producto_id'], 'valor': 7},
+                {'ruta': ['datos', 'temporal'], 'eliminar': True},
+                {'ruta': ['opciones', '0'], 'valor': None},
+            ],
+        )
+        self.assertEqual(estado, {'fase': 'inicio', 'datos': {'producto_id': 7}, 'opciones': [None, 2, 3]})
+
+    def test_rutas_no_aplicables_responden_409_sin_modificar(self):
+        respuesta = self.client.patch(self.url, {
+            'numero_whatsapp': self.numero,
+            'parche': {'fase': 'pago'},
+            'rutas': [
+                {'ruta': ['datos', 'horario'], 'valor': '11:00'},
+                {'ruta': ['fase', 'paso'], 'valor': 2},
+                {'ruta': ['no_existe', 'clave'], 'valor': 1},
+                {'ruta': ['opciones', 'primera'], 'valor': 1},
+                {'ruta': ['datos', 'no_existe'], 'eliminar': True},
+            ],
+        }, format='json')
+
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertEqual(respuesta.data['rutas_no_aplicables'], [1, 2, 3, 4])
+        estado = EstadoChat.objects.get(numero_whatsapp=self.numero).estado_conversacion
+        self.assertEqual(estado['fase'], 'inicio')
+        self.assertEqual(estado['datos']['horario'], '10:00')
+
+    def test_parche_que_no_es_objeto_responde_400(self):
+        for parche in (['fase'], 'pago', 3):
+            with self.subTest(parche=parche):
+                respuesta = self.client.patch(
+                    self.url, {'numero_whatsapp': self.numero, 'parche': parche}, format='json'
+                )
+                self.assertEqual(respuesta.status_code, 400)
+                self.assertIn('parche', respuesta.data['detalles'])
+        self.assertEqual(EstadoChat.objects.get(numero_whatsapp=self.numero).estado_conversacion['fase'], 'inicio')
+
+    def test_valor_rechazado_por_jsonb_responde_400_sin_detalles(self):
+        respuesta = self.client.patch(
+            self.url, {'numero_whatsapp': self.numero, 'parche': {'fase': 'a\u0000b'}}, format='json'
+        )
+
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(respuesta.data, {'error': 'Datos de estado chat inválidos'})
+        self.assertEqual(EstadoChat.objects.get(numero_whatsapp=self.numero).estado_conversacion['fase'], 'inicio')
+
+    def test_numero_sin_estado_responde_404(self):
+        respuesta = self.client.patch(
+            self.url, {'numero_whatsapp': '573009999999', 'parche': {'fase': 'pago'}}, format='json'
+        )
+        self.assertEqual(respuesta.status_code, 404)
+        self.assertFalse(EstadoChat.objects.filter(numero_whatsapp='573009999999').exists())
+
+
+class ApiKeyCacheTests(TestCase):
+    """Caché por worker de API Keys válidas e inválidas"""
+
+    def setUp(self):
+        api_key_cache.clear()
+        api_key_invalida_cache.clear()
+        self.api_key = ApiKey.objects.create(name='Bot')
+        self.autenticacion = ApiKeyAuthentication()
+
+    def test_keys_invalidas_no_expulsan_las_validas(self):
+        self.assertEqual(self.autenticacion.get_api_key(self.api_key.key), self.api_key)
+        for i in range(api_key_cache.max_size + 1):
+            self.assertIsNone(self.autenticacion.get_api_key(f'invalida-{i}'))
+
+        self.assertLessEqual(len(api_key_invalida_cache), api_key_invalida_cache.max_size)
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self.autenticacion.get_api_key(self.api_key.key), self.api_key)
+        self.assertEqual(len(consultas.captured_queries), 0)
+
+    def test_key_invalida_cacheada_no_consulta_la_bd(self):
+        self.assertIsNone(self.autenticacion.get_api_key('invalida'))
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertIsNone(self.autenticacion.get_api_key('invalida'))
+        self.assertEqual(len(consultas.captured_queries), 0)
+
+
+@override_settings(API_KEY_RATE_LIMIT_STORE='postgres', API_KEY_DEFAULT_RATE_LIMIT=1)
+class ApiKeyRateThrottleTests(TestCase):
+    """Límite por API Key: 429 con Retry-After y límite propio definido en el admin"""
+
+    url = '/api/v1/estados-chat/por-numero/?numero=573001234567'
+
+    def setUp(self):
+        api_key_cache.clear()
+        self.client = APIClient()
+
+    def pedir(self, api_key, veces):
+        return [
+            self.client.get(self.url, HTTP_AUTHORIZATION=f'Api-Key {api_key.key}')
+            for _ in range(veces)
+        ]
+
+    def test_supera_el_limite_global_responde_429_con_retry_after(self):
+        api_key = ApiKey.objects.create(name='Sin límite propio')
+        primera, segunda = self.pedir(api_key, 2)
+        self.assertEqual(primera.status_code, 404)
+        self.assertEqual(segunda.status_code, 429)
+        # 1 solicitud por minuto: el siguiente token llega en ~60 s
+        self.assertTrue(55 <= int(segunda['Retry-After']) <= 60, segunda['Retry-After'])
+
+    def test_limite_propio_de_la_key(self):
+        api_key = ApiKey.objects.create(name='Bot', rate_limit_per_minute=60, rate_limit_burst=3)
+        estados = [respuesta.status_code for respuesta in self.pedir(api_key, 4)]
+        self.assertEqual(estados, [404, 404, 404, 429])
+
+    def test_limite_cero_no_limita(self):
+        api_key = ApiKey.objects.create(name='Interna', rate_limit_per_minute=0)
+        estados = {respuesta.status_code for respuesta in self.pedir(api_key, 5)}
+        self.assertEqual(estados, {404})
+
+    def test_las_keys_no_comparten_bucket(self):
+        primera = ApiKey.objects.create(name='Bot 1')
+        segunda = ApiKey.objects.create(name='Bot 2')
+        self.assertEqual(self.pedir(primera, 2)[1].status_code, 429)
+        self.assertEqual(self.pedir(segunda, 1)[0].status_code, 404)
+
+
+class CacheTokenBucketStoreTests(TestCase):
+    """Store 'cache': ventana deslizante con add / incr y validación al arrancar"""
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_rafaga_y_rechazo_sin_consumir(self):
+        store = CacheTokenBucketStore()
+        resultados = [store.consume(1, 2, 1 / 60)[0] for _ in range(3)]
+        self.assertEqual(resultados, [True, True, False])
+        # El rechazo se descontó: el contador sigue en la capacidad
+        self.assertFalse(store.consume(1, 2, 1 / 60)[0])
+        self.assertTrue(store.consume(2, 2, 1 / 60)[0])
+
+    @override_settings(API_KEY_RATE_LIMIT_STORE='cache')
+    def test_cache_local_al_proceso_falla_al_arrancar(self):
+        with self.assertRaises(ImproperlyConfigured):
+            verificar_configuracion()
+
+    @override_settings(API_KEY_RATE_LIMIT_STORE='postgres')
+    def test_store_postgres_no_requiere_cache(self):
+        verificar_configuracion()
+
+
+class UsageBufferTests(TestCase):
+    """Vaciado en lote del uso de API Keys"""
+
+    def test_key_eliminada_no_descarta_el_resto_del_lote(self):
+        activa = ApiKey.objects.create(name='Activa')
+        eliminada = ApiKey.objects.create(name='Eliminada')
+        buffer = UsageBuffer(flush_interval=3600)
+        ahora = timezone.now()
+        for api_key in (activa, activa, eliminada):
+            buffer.record(api_key.pk, ahora)
+            buffer.record_request(api_key.pk, '/api/v1/citas/hoy/', 200, 12.5, ahora)
+        eliminada_id = eliminada.pk
+        eliminada.delete()
+
+        self.assertEqual(buffer.flush(), 2)
+
+        activa.refresh_from_db()
+        self.assertEqual(activa.usage_count, 2)
+        rollup = ApiKeyUsageRollup.objects.get()
+        self.assertEqual((rollup.api_key_id, rollup.request_count), (activa.pk, 2))
+        self.assertFalse(ApiKeyUsageRollup.objects.filter(api_key_id=eliminada_id).exists())
+        self.assertEqual(buffer.pending(), {})
+        self.assertEqual(buffer.pending_rollups(), {})
+
+
+class SolapamientoCitasTests(TestCase):
+    """Restricción cita_profesional_sin_solape: 409 en la API, sin contar citas canceladas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.producto = Producto.objects.create(nombre='Orientación Vocacional', duracion_minutos=60)
+        cls.profesional = crear_usuario('Profesional', 'p1')
+        Profesional.objects.create(usuario=cls.profesional, numero_whatsapp='573000000001', cargo='Psicóloga')
+        ProductoProfesional.objects.create(producto=cls.producto, profesional=cls.profesional)
+        cls.cliente = crear_usuario('Cliente', 'c1')
+        Cliente.objects.create(usuario=cls.cliente)
+
+    def setUp(self):
+        calendario.invalidar()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('bot'))
+        self.cita = self.crear_cita(9)
+
+    def crear_cita(self, hora):
+        inicio = datetime(2030, 3, 4, hora, tzinfo=ZONA_COLOMBIA)
+        return Cita.objects.create(
+            cliente=self.cliente, producto=self.producto, profesional_asignado=self.profesional,
+            fecha_hora_inicio=inicio, fecha_hora_fin=inicio + timedelta(hours=1),
+        )
+
+    def crear_por_api(self, inicio, fin):
+        return self.client.post('/api/v1/citas/', {
+            'cliente_id': self.cliente.id, 'producto_id': self.producto.id,
+            'profesional_asignado_id': self.profesional.id,
+            'fecha_hora_inicio': f'04/03/2030 {inicio}', 'fecha_hora_fin': f'04/03/2030 {fin}',
+        }, format='json')
+
+    def test_crear_cita_cruzada_responde_409(self):
+        respuesta = self.crear_por_api('09:30', '10:30')
+        self.assertEqual(respuesta.status_code, 409, respuesta.data)
+        self.assertEqual(respuesta.data['error'], 'El profesional ya tiene una cita en ese horario')
+        self.assertEqual(Cita.objects.count(), 1)
+
+    def test_cita_contigua_no_se_cruza(self):
+        self.assertEqual(self.crear_por_api('10:00', '11:00').status_code, 201)
+
+    def test_cita_cancelada_no_bloquea_el_horario(self):
+        self.cita.cambiar_estado('Cancelado')
+        self.assertEqual(self.crear_por_api('09:00', '10:00').status_code, 201)
+
+    def test_actualizar_por_id_hacia_un_horario_ocupado_responde_409(self):
+        otra = self.crear_cita(10)
+        respuesta = self.client.patch('/api/v1/citas/actualizar-por-id/', {
+            'cita_id': otra.id, 'fecha_hora_inicio': '04/03/2030 09:30', 'fecha_hora_fin': '04/03/2030 10:30',
+        }, format='json')
+        self.assertEqual(respuesta.status_code, 409, respuesta.data)
+        otra.refresh_from_db()
+        self.assertEqual(otra.fecha_hora_inicio, datetime(2030, 3, 4, 10, tzinfo=ZONA_COLOMBIA))
+
+    def test_reactivar_cita_cancelada_con_el_horario_tomado_responde_409(self):
+        self.cita.cambiar_estado('Cancelado')
+        self.crear_cita(9)
+        respuesta = self.client.post('/api/v1/citas/cambiar-estado-por-id/', {
+            'cita_id': self.cita.id, 'cliente_id': self.cliente.id, 'estado_cita': 'Agendado',
+        }, format='json')
+        self.assertEqual(respuesta.status_code, 409, respuesta.data)
+        self.cita.refresh_from_db()
+        self.assertEqual(self.cita.estado, 'Cancelado')
+
+
+class ActualizarFechasCitaTests(TestCase):
+    """PATCH /api/v1/citas/actualizar-por-id/ con solo una de las dos fechas"""
+
+    url = '/api/v1/citas/actualizar-por-id/'
+
+    @classmethod
+    def setUpTestData(cls):
+        producto = Producto.objects.create(nombre='Orientación Vocacional', duracion_minutos=30)
+        inicio = datetime(2030, 3, 4, 9, tzinfo=ZONA_COLOMBIA)
+        cls.cita = Cita.objects.create(
+            cliente=crear_usuario('Cliente', 'c1'), producto=producto,
+            fecha_hora_inicio=inicio, fecha_hora_fin=inicio + timedelta(minutes=30),
+        )
+
+    def setUp(self):
+        calendario.invalidar()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('bot'))
+
+    def test_inicio_posterior_al_fin_guardado_responde_400(self):
+        respuesta = self.client.patch(
+            self.url, {'cita_id': self.cita.id, 'fecha_hora_inicio': '04/03/2030 11:00'}, format='json'
+        )
+        self.assertEqual(respuesta.status_code, 400, respuesta.data)
+        self.assertIn('fecha_hora_fin', respuesta.data['detalles'])
+
+    def test_fin_anterior_al_inicio_guardado_responde_400(self):
+        respuesta = self.client.patch(
+            self.url, {'cita_id': self.cita.id, 'fecha_hora_fin': '04/03/2030 08:00'}, format='json'
+        )
+        self.assertEqual(respuesta.status_code, 400, respuesta.data)
+
+    def test_fin_posterior_al_inicio_guardado_se_acepta(self):
+        respuesta = self.client.patch(
+            self.url, {'cita_id': self.cita.id, 'fecha_hora_fin': '04/03/2030 10:00'}, format='json'
+        )
+        self.assertEqual(respuesta.status_code, 200, respuesta.data)
+
+
+
+def en_otra_conexion(funcion, *args):
+    """Ejecutar ``funcion`` en un hilo (con su propia conexión a la BD) y retornar su resultado"""
+    resultado = {}
+
+    def ejecutar():
+        try:
+            resultado['valor'] = funcion(*args)
+        finally:
+            connections.close_all()
+
+    hilo = threading.Thread(target=ejecutar)
+    hilo.start()
+    hilo.join()
+    return resultado['valor']
+
+
+class ReclamarRecordatoriosTests(TransactionTestCase):
+    """Cola de recordatorios: SELECT ... FOR UPDATE SKIP LOCKED entre conexiones"""
+
+    def setUp(self):
+        producto = Producto.objects.create(nombre='Orientación Vocacional', duracion_minutos=30)
+        cliente = crear_usuario('Cliente', 'c1')
+        # Inicio en 2 horas: el recordatorio de 24h ya venció
+        inicio = timezone.now() + timedelta(hours=2)
+        self.citas = [
+            Cita.objects.create(
+                cliente=cliente, producto=producto,
+                fecha_hora_inicio=inicio, fecha_hora_fin=inicio + timedelta(minutes=30),
+            )
+            for _ in range(2)
+        ]
+
+    def test_salta_las_citas_bloqueadas_por_otra_conexion(self):
+        bloqueada, libre = self.citas
+        with transaction.atomic():
+            Cita.objects.select_for_update().get(pk=bloqueada.pk)
+            reclamadas = en_otra_conexion(reclamar, 10)
+
+        self.assertEqual([cita.id for cita in reclamadas], [libre.id])
+        self.assertEqual(reclamadas[0].accion, RECORDATORIO_24H)
+        # Liberado el bloqueo se entrega la que faltaba; la reclamada sigue aplazada
+        self.assertEqual([cita.id for cita in reclamar(10)], [bloqueada.id])
+        self.assertEqual(reclamar(10), [])
+
+    def test_reclamos_simultaneos_no_entregan_la_misma_cita(self):
+        barrera = threading.Barrier(2)
+        reclamadas = []
+
+        def trabajador():
+            try:
+                barrera.wait()
+                reclamadas.append([cita.id for cita in reclamar(1)])
+            finally:
+                connections.close_all()
+
+        hilos = [threading.Thread(target=trabajador) for _ in range(2)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(sorted(sum(reclamadas, [])), sorted(cita.id for cita in self.citas))
+
+
+class CambiarEstadosLoteTests(TestCase):
+    """estados.cambiar_estados: efectos del bulk_update que no pasan por post_save"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.producto = Producto.objects.create(nombre='Orientación Vocacional', duracion_minutos=30)
+        cls.cliente = crear_usuario('Cliente', 'c1')
+        cls.profesional = crear_usuario('Profesional', 'p1')
+
+    def setUp(self):
+        agenda_cache.clear()
+        self.inicio = datetime(2030, 3, 4, 9, tzinfo=ZONA_COLOMBIA)
+        self.fin = self.inicio + timedelta(minutes=30)
+        self.cita = Cita.objects.create(
+            cliente=self.cliente, producto=self.producto, profesional_asignado=self.profesional,
+            fecha_hora_inicio=self.inicio, fecha_hora_fin=self.fin,
+            google_calendar_event_id='evento-1',
+        )
+        self.guardados = []
+        post_save.connect(self.registrar_guardado, sender=Cita)
+        self.addCleanup(post_save.disconnect, self.registrar_guardado, sender=Cita)
+
+    def registrar_guardado(self, sender, instance, **kwargs):
+        self.guardados.append(instance.pk)
+
+    def test_cancelar_en_lote_encola_evento_incrementa_version_e_invalida_agenda(self):
+        self.assertFalse(agenda_cache.esta_libre(self.profesional.id, self.inicio, self.fin))
+
+        resultado, = cambiar_estados([{'cita_id': self.cita.id, 'estado_cita': 'Cancelado'}])
+
+        self.assertTrue(resultado['exito'], resultado)
+        self.assertEqual(self.guardados, [])
+        eliminar = EventoCalendario.objects.get(cita=self.cita, accion=AccionCalendarioEnum.ELIMINAR)
+        self.assertEqual(eliminar.google_calendar_event_id, 'evento-1')
+        self.cita.refresh_from_db()
+        self.assertEqual((self.cita.estado, self.cita.version), ('Cancelado', 2))
+        self.assertEqual(self.cita.estado_actual_id, resultado['historial_id'])
+        # Sin esperar el TTL de la agenda
+        self.assertTrue(agenda_cache.esta_libre(self.profesional.id, self.inicio, self.fin))
+
+    def test_reactivar_en_lote_encola_la_creacion(self):
+        cambiar_estados([{'cita_id': self.cita.id, 'estado_cita': 'Cancelado'}])
+        resultado, = cambiar_estados([{'cita_id': self.cita.id, 'estado_cita': 'Agendado'}])
+
+        self.assertTrue(resultado['exito'], resultado)
+        self.assertEqual(
+            EventoCalendario.objects.filter(cita=self.cita, accion=AccionCalendarioEnum.CREAR).count(), 2
+        )
+        self.assertFalse(agenda_cache.esta_libre(self.profesional.id, self.inicio, self.fin))
+        self.cita.refresh_from_db()
+        self.assertEqual(self.cita.version, 3)
+
+    def test_cambio_sin_accion_de_calendario_no_encola_eventos(self):
+        eventos = EventoCalendario.objects.count()
+        resultado, = cambiar_estados([{'cita_id': self.cita.id, 'estado_cita': 'Primer Confirmado'}])
+        self.assertTrue(resultado['exito'], resultado)
+        self.assertEqual(EventoCalendario.objects.count(), eventos)
+
+
+class ProgramadorTests(TransactionTestCase):
+    """Programador de transiciones: liderazgo por advisory lock y revalidación del estado"""
+
+    def setUp(self):
+        producto = Producto.objects.create(nombre='Orientación Vocacional', duracion_minutos=30)
+        inicio = timezone.now() + timedelta(hours=2)
+        # Agendada e inicia en menos de 24 h: le corresponde pasar a Pendiente 24h
+        self.cita = Cita.objects.create(
+            cliente=crear_usuario('Cliente', 'c1'), producto=producto,
+            fecha_hora_inicio=inicio, fecha_hora_fin=inicio + timedelta(minutes=30),
+        )
+
+    def test_solo_una_conexion_obtiene_el_liderazgo(self):
+        self.assertTrue(programador.tomar_liderazgo())
+        try:
+            self.assertFalse(en_otra_conexion(programador.tomar_liderazgo))
+        finally:
+            programador.soltar_liderazgo()
+
+        def tomar_y_soltar():
+            obtenido = programador.tomar_liderazgo()
+            if obtenido:
+                programador.soltar_liderazgo()
+            return obtenido
+
+        self.assertTrue(en_otra_conexion(tomar_y_soltar))
+
+    def test_ciclo_aplica_la_transicion_vencida(self):
+        movidas = programador.ejecutar_ciclo(lote=10)
+        self.assertEqual(movidas['pendiente_24h'], 1)
+        self.cita.refresh_from_db()
+        self.assertEqual(self.cita.estado, 'Pendiente Primer Confirmación 24 Horas')
+
+    def test_cambio_entre_la_lectura_y_el_bloqueo_no_se_pisa(self):
+        cambiar_estados_original = programador.cambiar_estados
+
+        def cancelar_antes(cambios):
+            # Otro proceso cancela la cita después de que el programador leyó los IDs
+            Cita.objects.get(pk=self.cita.pk).cambiar_estado('Cancelado')
+            return cambiar_estados_original(cambios)
+
+        with mock.patch.object(programador, 'cambiar_estados', side_effect=cancelar_antes) as cambiar:
+            movidas = programador.ejecutar_ciclo(lote=10)
+
+        self.assertEqual(movidas['pendiente_24h'], 0)
+        self.assertEqual(cambiar.call_count, 1)
+        self.cita.refresh_from_db()
+        self.assertEqual(self.cita.estado, 'Cancelado')
+        self.assertEqual(self.cita.historial_estados.count(), 2)
+
+    def test_estados_origen_se_revalida_con_la_cita_bloqueada(self):
+        resultado, = cambiar_estados([{
+            'cita_id': self.cita.id,
+            'estado_cita': 'Pendiente Primer Confirmación 24 Horas',
+            'estados_origen': ['Primer Confirmado'],
+        }])
+        self.assertFalse(resultado['exito'])
+        self.assertEqual(resultado['error'], ERROR_ESTADO_CAMBIADO)
+        self.cita.refresh_from_db()
+        self.assertEqual(self.cita.estado, 'Agendado')
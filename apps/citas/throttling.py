@@ -0,0 +1,155 @@
+"""
+Rate limiting por API Key compartido entre workers.
+
+Según API_KEY_RATE_LIMIT_STORE el estado vive en PostgreSQL (por defecto: un
+token bucket exacto, una sentencia ``INSERT ... ON CONFLICT DO UPDATE ...
+RETURNING`` por request) o en una caché de Django compartida (Redis,
+Memcached, DatabaseCache), con un contador de ventana deslizante que solo usa
+operaciones atómicas (``add`` / ``incr``). Una caché por proceso (LocMem) no
+se acepta: cada worker tendría su propio límite.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from rest_framework.throttling import BaseThrottle
+
+from .models import ApiKey, ApiKeyTokenBucket
+
+
+class PostgresTokenBucketStore:
+    """
+    Token bucket atómico en la tabla ApiKeyTokenBucket.
+
+    La recarga, el consumo y la decisión se calculan en la misma sentencia,
+    así que dos workers nunca consumen el mismo token.
+    """
+    sql = """
+        INSERT INTO {table} AS b (api_key_id, tokens, updated_at, allowed)
+        VALUES (%(api_key_id)s, %(capacity)s - 1, statement_timestamp(), TRUE)
+        ON CONFLICT (api_key_id) DO UPDATE SET
+            tokens = CASE
+                WHEN LEAST(%(capacity)s, b.tokens + EXTRACT(EPOCH FROM statement_timestamp() - b.updated_at) * %(rate)s) >= 1
+                THEN LEAST(%(capacity)s, b.tokens + EXTRACT(EPOCH FROM statement_timestamp() - b.updated_at) * %(rate)s) - 1
+                ELSE LEAST(%(capacity)s, b.tokens + EXTRACT(EPOCH FROM statement_timestamp() - b.updated_at) * %(rate)s)
+            END,
+            allowed = LEAST(%(capacity)s, b.tokens + EXTRACT(EPOCH FROM statement_timestamp() - b.updated_at) * %(rate)s) >= 1,
+            updated_at = statement_timestamp()
+        RETURNING tokens, allowed
+    """.format(table=ApiKeyTokenBucket._meta.db_table)
+
+    def consume(self, api_key_id, capacity, rate):
+        """Consumir un token; retorna (permitido, tokens restantes)"""
+        with connection.cursor() as cursor:
+            cursor.execute(self.sql, {
+                'api_key_id': api_key_id,
+                'capacity': float(capacity),
+                'rate': float(rate),
+            })
+            tokens, allowed = cursor.fetchone()
+        return allowed, tokens
+
+
+class CacheTokenBucketStore:
+    """
+    Límite en la caché de Django (API_KEY_RATE_LIMIT_CACHE) con un contador de
+    ventana deslizante, aproximación del token bucket con las mismas
+    capacidad y tasa.
+
+    La ventana dura lo que tarda el bucket en llenarse (capacidad / tasa). Se
+    cuentan las solicitudes de la ventana actual con ``incr`` (atómico) y las
+    de la anterior se ponderan por la parte de ella que sigue dentro de la
+    ventana deslizante. Una solicitud rechazada se descuenta con ``decr``, así
+    que reintentar no alarga el bloqueo.
+    """
+
+    def consume(self, api_key_id, capacity, rate):
+        cache = caches[getattr(settings, 'API_KEY_RATE_LIMIT_CACHE', 'default')]
+        window = capacity / rate
+        ventana, transcurrido = divmod(time.time(), window)
+        cache_key = f'apikey-bucket:{api_key_id}:{int(ventana)}'
+        timeout = int(2 * window) + 1
+        cache.add(cache_key, 0, timeout=timeout)
+        try:
+            actuales = cache.incr(cache_key)
+        except ValueError:
+            # Expiró entre add e incr
+            cache.add(cache_key, 0, timeout=timeout)
+            actuales = cache.incr(cache_key)
+        anteriores = cache.get(f'apikey-bucket:{api_key_id}:{int(ventana) - 1}', 0)
+        usados = anteriores * (1 - transcurrido / window) + actuales
+        if usados <= capacity:
+            return True, capacity - usados
+        cache.decr(cache_key)
+        return False, capacity - usados + 1
+
+
+def verificar_configuracion():
+    """
+    Fallar al arrancar si el store 'cache' usa una caché que no se comparte
+    entre workers (LocMem, Dummy): cada proceso aplicaría su propio límite.
+    """
+    if getattr(settings, 'API_KEY_RATE_LIMIT_STORE', 'postgres') != 'cache':
+        return
+    alias = getattr(settings, 'API_KEY_RATE_LIMIT_CACHE', 'default')
+    if isinstance(caches[alias], (LocMemCache, DummyCache)):
+        raise ImproperlyConfigured(
+            f"API_KEY_RATE_LIMIT_STORE='cache' necesita una caché compartida entre workers "
+            f"(Redis, Memcached o DatabaseCache); CACHES['{alias}'] es local al proceso. "
+            f"Configure CACHES o use API_KEY_RATE_LIMIT_STORE='postgres'."
+        )
+
+
+TOKEN_BUCKET_STORES = {
+    'postgres': PostgresTokenBucketStore,
+    'cache': CacheTokenBucketStore,
+}
+
+
+class ApiKeyRateThrottle(BaseThrottle):
+    """
+    Throttle de DRF para requests autenticados con API Key.
+
+    El límite de cada key se toma de ApiKey.rate_limit_per_minute /
+    rate_limit_burst, o de API_KEY_DEFAULT_RATE_LIMIT si no tiene uno propio.
+    Al superarlo DRF responde 429 con el header Retry-After.
+    """
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def get_store(self):
+        store = getattr(settings, 'API_KEY_RATE_LIMIT_STORE', 'postgres')
+        return TOKEN_BUCKET_STORES[store]()
+
+    def get_limits(self, api_key):
+        """Retorna (capacidad, tokens por segundo) o None si la key no tiene límite"""
+        per_minute = api_key.rate_limit_per_minute
+        if per_minute is None:
+            per_minute = getattr(settings, 'API_KEY_DEFAULT_RATE_LIMIT', 0)
+        if not per_minute:
+            return None
+        capacity = api_key.rate_limit_burst or per_minute
+        return capacity, per_minute / 60.0
+
+    def allow_request(self, request, view):
+        api_key = request.auth
+        if not isinstance(api_key, ApiKey):
+            return True
+
+        limits = self.get_limits(api_key)
+        if limits is None:
+            return True
+
+        capacity, rate = limits
+        allowed, tokens = self.get_store().consume(api_key.pk, capacity, rate)
+        if not allowed:
+            self.wait_seconds = (1 - tokens) / rate
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
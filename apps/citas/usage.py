@@ -0,0 +1,200 @@
+"""
+Acumulación en memoria (write-behind) de estadísticas de uso de API Keys.
+
+Cada worker suma en memoria:
+
+- los usos por API Key (``usage_count`` / ``last_used``), escritos con un único
+  ``UPDATE ... SET usage_count = usage_count + n`` por key;
+- los agregados por hora y endpoint (ApiKeyUsageRollup) registrados por
+  ApiKeyUsageMiddleware, escritos con un ``INSERT ... ON CONFLICT DO UPDATE``.
+
+Ambos se vacían juntos cada API_KEY_USAGE_FLUSH_INTERVAL segundos.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import DateTimeField, F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class UsageBuffer:
+    """
+    Buffer de usos pendientes por API Key.
+
+    El vaciado es oportunista: ocurre al registrar un uso cuando ya pasó el
+    intervalo configurado, y al terminar el proceso (hook ``atexit``). Con un
+    intervalo de 0 cada uso se escribe inmediatamente.
+    """
+
+    def __init__(self, flush_interval=None):
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pendientes = {}
+        self._rollups = {}
+        self._ultimo_flush = time.monotonic()
+
+    @property
+    def flush_interval(self):
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return getattr(settings, 'API_KEY_USAGE_FLUSH_INTERVAL', 30)
+
+    def record(self, api_key_id, when=None):
+        """Registrar un uso de la API Key y vaciar el buffer si corresponde"""
+        when = when or timezone.now()
+        with self._lock:
+            count, last_used = self._pendientes.get(api_key_id, (0, when))
+            self._pendientes[api_key_id] = (count + 1, max(last_used, when))
+            debe_vaciar = self._debe_vaciar()
+        if debe_vaciar:
+            self.flush()
+
+    def record_request(self, api_key_id, endpoint, status_code, latency_ms, when=None):
+        """Sumar un request al agregado (API Key, hora, endpoint)"""
+        when = when or timezone.now()
+        hora = when.replace(minute=0, second=0, microsecond=0)
+        es_error = 1 if status_code >= 400 else 0
+        with self._lock:
+            requests, errores, latencia = self._rollups.get((api_key_id, hora, endpoint), (0, 0, 0.0))
+            self._rollups[(api_key_id, hora, endpoint)] = (
+                requests + 1, errores + es_error, latencia + latency_ms
+            )
+            debe_vaciar = self._debe_vaciar()
+        if debe_vaciar:
+            self.flush()
+
+    def _debe_vaciar(self):
+        return time.monotonic() - self._ultimo_flush >= self.flush_interval
+
+    def pending(self):
+        """Copia de los usos pendientes: {api_key_id: (conteo, último uso)}"""
+        with self._lock:
+            return dict(self._pendientes)
+
+    def pending_rollups(self):
+        """Copia de los agregados pendientes: {(api_key_id, hora, endpoint): (requests, errores, latencia)}"""
+        with self._lock:
+            return dict(self._rollups)
+
+    def flush(self):
+        """
+        Escribir los usos y agregados acumulados en la base de datos.
+
+        Retorna el número de filas (keys + agregados) escritas. Los datos de
+        keys que ya no existen se descartan antes de escribir, sin afectar al
+        resto del lote. Si la escritura falla por un error transitorio los
+        datos se devuelven al buffer para el siguiente intento; si aun así
+        viola integridad se descartan para no bloquear los siguientes vaciados.
+        """
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+            rollups, self._rollups = self._rollups, {}
+            self._ultimo_flush = time.monotonic()
+        if not pendientes and not rollups:
+            return 0
+
+        try:
+            with transaction.atomic():
+                pendientes, rollups = self._solo_existentes(pendientes, rollups)
+                self._write_usage(pendientes)
+                self._write_rollups(rollups)
+        except IntegrityError as e:
+            logger.error(f"Uso de API Keys descartado por error de integridad: {str(e)}")
+            return 0
+        except DatabaseError as e:
+            logger.error(f"Error guardando uso de API Keys, se reintentará: {str(e)}")
+            self._restore(pendientes, rollups)
+            return 0
+
+        logger.debug(f"Uso de API Keys guardado - Keys: {len(pendientes)}, Agregados: {len(rollups)}")
+        return len(pendientes) + len(rollups)
+
+    def _solo_existentes(self, pendientes, rollups):
+        """
+        Quitar los datos de keys eliminadas. Las keys restantes quedan
+        bloqueadas (FOR NO KEY UPDATE) hasta el final de la transacción, así
+        que no pueden eliminarse antes de que se escriban sus agregados.
+        """
+        from .models import ApiKey
+
+        ids = set(pendientes) | {api_key_id for api_key_id, _, _ in rollups}
+        existentes = set(
+            ApiKey.objects.select_for_update(no_key=True)
+            .filter(pk__in=ids).order_by('pk').values_list('pk', flat=True)
+        )
+        eliminadas = ids - existentes
+        if not eliminadas:
+            return pendientes, rollups
+        logger.warning(f"Uso descartado de API Keys eliminadas: {sorted(eliminadas)}")
+        return (
+            {api_key_id: uso for api_key_id, uso in pendientes.items() if api_key_id in existentes},
+            {clave: agregado for clave, agregado in rollups.items() if clave[0] in existentes},
+        )
+
+    def _write_usage(self, pendientes):
+        from .models import ApiKey
+
+        for api_key_id, (count, last_used) in sorted(pendientes.items()):
+            ApiKey.objects.filter(pk=api_key_id).update(
+                usage_count=F('usage_count') + count,
+                last_used=Greatest(
+                    F('last_used'), Value(last_used, output_field=DateTimeField())
+                ),
+            )
+
+    def _write_rollups(self, rollups):
+        if not rollups:
+            return
+
+        from .models import ApiKeyUsageRollup
+
+        filas = sorted(rollups.items())
+        valores = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(filas))
+        params = []
+        for (api_key_id, hora, endpoint), (requests, errores, latencia) in filas:
+            params.extend([api_key_id, hora, endpoint, requests, errores, latencia])
+
+        sql = f"""
+            INSERT INTO {ApiKeyUsageRollup._meta.db_table} AS r
+                (api_key_id, hour, endpoint, request_count, error_count, total_latency_ms)
+            VALUES {valores}
+            ON CONFLICT (api_key_id, hour, endpoint) DO UPDATE SET
+                request_count = r.request_count + EXCLUDED.request_count,
+                error_count = r.error_count + EXCLUDED.error_count,
+                total_latency_ms = r.total_latency_ms + EXCLUDED.total_latency_ms
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def _restore(self, pendientes, rollups):
+        with self._lock:
+            for api_key_id, (count, last_used) in pendientes.items():
+                actual_count, actual_last_used = self._pendientes.get(api_key_id, (0, last_used))
+                self._pendientes[api_key_id] = (
+                    actual_count + count, max(actual_last_used, last_used)
+                )
+            for clave, (requests, errores, latencia) in rollups.items():
+                actual = self._rollups.get(clave, (0, 0, 0.0))
+                self._rollups[clave] = (
+                    actual[0] + requests, actual[1] + errores, actual[2] + latencia
+                )
+
+
+usage_buffer = UsageBuffer()
+
+
+@atexit.register
+def _flush_on_shutdown():
+    """Vaciar el buffer cuando el worker termina (apagado o reinicio de gunicorn)"""
+    try:
+        usage_buffer.flush()
+    except Exception:
+        # El proceso está terminando; no hay a quién reportar el error
+        pass
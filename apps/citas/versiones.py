@@ -0,0 +1,132 @@
+"""
+Lecturas condicionales (ETag / Last-Modified) a partir de versiones por tabla.
+
+Cada tabla que alimenta una respuesta tiene un contador en VersionTabla que
+las señales incrementan al guardar o eliminar (y los UPDATE masivos llamando a
+``incrementar()``). El ETag de una respuesta es un hash de su clave (ruta,
+parámetros, id consultado) y de los contadores de sus tablas, así que
+responder 304 cuesta una consulta por PK a VersionTabla: no se ejecuta la
+consulta principal ni el serializador.
+
+Las lecturas de una sola fila (GET /api/citas/{id}/) usan en cambio la
+columna version de la fila (``validadores_fila()``), para que un cambio en
+otra cita no invalide su ETag, junto con los contadores de las tablas de las
+que la respuesta embebe datos (cliente, producto y profesional).
+
+El incremento se hace al confirmar la transacción (on_commit), en su propio
+UPDATE, para no mantener bloqueada la fila del contador mientras dura la
+transacción que modificó los datos.
+"""
+import hashlib
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Producto, ProductoProfesional, Profesional, Usuario, VersionTabla
+
+# Tablas de las que depende cada respuesta
+TABLAS_PRODUCTOS = (Producto, ProductoProfesional, Usuario, Profesional)
+# Datos embebidos en el detalle de una cita: cliente y profesional (Usuario,
+# Profesional) y producto con sus profesionales (Producto, ProductoProfesional)
+TABLAS_CITA = TABLAS_PRODUCTOS
+
+_SQL_INCREMENTAR = (
+    f'INSERT INTO {VersionTabla._meta.db_table} (tabla, version, fecha_modificacion) '
+    f'VALUES (%s, 1, %s) '
+    f'ON CONFLICT (tabla) DO UPDATE SET version = {VersionTabla._meta.db_table}.version + 1, '
+    f'fecha_modificacion = EXCLUDED.fecha_modificacion'
+)
+
+
+def _tablas(modelos):
+    return sorted({modelo._meta.db_table for modelo in modelos})
+
+
+def _incrementar(tablas):
+    ahora = timezone.now()
+    with connection.cursor() as cursor:
+        for tabla in tablas:
+            cursor.execute(_SQL_INCREMENTAR, [tabla, ahora])
+
+
+def incrementar(*modelos):
+    """Incrementar la versión de las tablas de ``modelos`` cuando se confirme la transacción"""
+    tablas = _tablas(modelos)
+    transaction.on_commit(lambda: _incrementar(tablas))
+
+
+def leer(modelos):
+    """{tabla: (versión, fecha de modificación)} de las tablas de ``modelos``, en una consulta"""
+    tablas = _tablas(modelos)
+    versiones = {tabla: (0, None) for tabla in tablas}
+    versiones.update(
+        (tabla, (version, fecha))
+        for tabla, version, fecha in VersionTabla.objects.filter(tabla__in=tablas).values_list(
+            'tabla', 'version', 'fecha_modificacion'
+        )
+    )
+    return versiones
+
+
+def validadores(clave, modelos, versiones=None):
+    """
+    (etag, última modificación o None) de ``clave`` con las versiones actuales
+    de ``modelos`` (o las ya leídas con ``leer()``).
+    """
+    if versiones is None:
+        versiones = leer(modelos)
+    huella = '|'.join([clave] + [f'{tabla}:{versiones[tabla][0]}' for tabla in sorted(versiones)])
+    etag = quote_etag(hashlib.sha1(huella.encode('utf-8')).hexdigest())
+    fechas = [fecha for _, fecha in versiones.values() if fecha]
+    return etag, max(fechas) if fechas else None
+
+
+def validadores_fila(clave, version, modelos=()):
+    """
+    (etag, None) de ``clave`` con la versión de la fila y las de las tablas
+    ``modelos`` cuyos datos embebe la respuesta; sin Last-Modified
+    """
+    versiones = leer(modelos) if modelos else {}
+    huella = '|'.join([f'{clave}|v{version}'] + [f'{tabla}:{versiones[tabla][0]}' for tabla in sorted(versiones)])
+    return quote_etag(hashlib.sha1(huella.encode('utf-8')).hexdigest()), None
+
+
+def con_validadores(response, etag, ultima_modificacion):
+    """Agregar ETag / Last-Modified; no-cache obliga al cliente a revalidar en cada uso"""
+    response['ETag'] = etag
+    if ultima_modificacion:
+        response['Last-Modified'] = http_date(ultima_modificacion.timestamp())
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _sin_debil(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def no_modificado(request, etag, ultima_modificacion):
+    """
+    Respuesta 304 si el cliente ya tiene esta versión, o None.
+
+    If-None-Match (comparación débil) tiene prioridad sobre If-Modified-Since.
+    Solo aplica a GET / HEAD: en otros métodos las precondiciones no
+    significan "no modificado".
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        coincide = '*' in etags or _sin_debil(etag) in {_sin_debil(valor) for valor in etags}
+    else:
+        desde = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+        coincide = (
+            desde is not None and ultima_modificacion is not None
+            and int(ultima_modificacion.timestamp()) <= desde
+        )
+    if not coincide:
+        return None
+    return con_validadores(Response(status=status.HTTP_304_NOT_MODIFIED), etag, ultima_modificacion)
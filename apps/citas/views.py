@@ -2,9 +2,11 @@ from rest_framework import viewsets, status, filters, mixins
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db import DataError, IntegrityError, transaction
 from django.db.models import Q
+from django.http import StreamingHttpResponse
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiResponse, OpenApiParameter
-from zoneinfo import ZoneInfo
+from datetime import timedelta
 import logging
 
 # Logger específico para este módulo
@@ -13,18 +15,30 @@ logger = logging.getLogger(__name__)
 from .models import (
     Usuario, EstadoChat, Profesional, Cliente, Producto,
     HistorialEstadoCita, Cita, ProductoProfesional,
-    TipoUsuarioEnum
+    RutasNoAplicables, TipoUsuarioEnum, es_solapamiento_profesional
 )
 from .serializers import (
     UsuarioSerializer,
-    EstadoChatSerializer,
+    EstadoChatSerializer, EstadoChatGuardarSerializer, EstadoChatFusionarSerializer,
     ProfesionalSerializer,
     ClienteSerializer,
     ProductoSerializer, ProductoListSerializer,
     HistorialEstadoCitaSerializer,
-    CitaSerializer, CitaListSerializer
+    CitaSerializer, CitaListSerializer, CitaRecordatorioSerializer
 )
 from .permissions import IsApiKeyOrAuthenticated
+from .exportacion import citas_completas, filas_citas_completas
+from .campos import filtrar_dict
+from .filtros import filtrar_rango, rango_desde_parametros
+from .renderers import CSVRenderer, NDJSONRenderer
+from .pagination import CursorFechaPagination
+from . import catalogo, versiones
+
+
+def respuesta_solapamiento():
+    return Response({
+        'error': 'El profesional ya tiene una cita en ese horario'
+    }, status=status.HTTP_409_CONFLICT)
 
 @extend_schema_view()
 class EstadoChatViewSet(viewsets.GenericViewSet,mixins.CreateModelMixin):
@@ -95,57 +109,200 @@ class EstadoChatViewSet(viewsets.GenericViewSet,mixins.CreateModelMixin):
                 'error': 'numero_whatsapp es requerido en el JSON'
             }, status=status.HTTP_400_BAD_REQUEST)
         
+        # numero_whatsapp es el identificador; lo único actualizable es estado_conversacion
+        if not any(key != 'numero_whatsapp' for key in data):
+            return Response({
+                'error': 'No hay datos para actualizar'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # partial: estado_conversacion es opcional, como en un PATCH
+        estado_chat_serializer = EstadoChatGuardarSerializer(data=data, partial=True)
+        if not estado_chat_serializer.is_valid():
+            logger.error(f"Error validando estado chat: {estado_chat_serializer.errors}")
+            return Response({
+                'error': 'Datos de estado chat inválidos', 
+                'detalles': estado_chat_serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
         try:
-            # Buscar el estado de chat por número de WhatsApp
-            estado_chat = EstadoChat.objects.get(numero_whatsapp=numero_whatsapp)
-            logger.info(f"EstadoChat encontrado - ID: {estado_chat.id}, WhatsApp: {estado_chat.numero_whatsapp}")
+            if 'estado_conversacion' in estado_chat_serializer.validated_data:
+                # UPDATE ... RETURNING: una consulta, sin leer antes ni después
+                estado_chat = EstadoChat.objects.actualizar(**estado_chat_serializer.validated_data)
+            else:
+                # Sin campos actualizables no hay nada que escribir: se retorna el estado actual
+                estado_chat = EstadoChat.objects.filter(numero_whatsapp=numero_whatsapp).first()
+            if estado_chat is None:
+                logger.error(f"Estado de chat no encontrado para número: {numero_whatsapp}")
+                return Response({
+                    'error': 'Estado de chat no encontrado con ese número de WhatsApp'
+                }, status=status.HTTP_404_NOT_FOUND)
+            logger.info(f"EstadoChat actualizado exitosamente - ID: {estado_chat.id}")
             
-            # Actualizar el estado de chat (excluir numero_whatsapp de los datos a procesar ya que es el identificador)
-            datos_actualizacion = {key: value for key, value in data.items() if key != 'numero_whatsapp'}
+            response_serializer = EstadoChatSerializer(estado_chat, context=self.get_serializer_context())
             
-            logger.info(f"Datos para actualización: {datos_actualizacion}")
+            logger.info("=== FIN - Estado de chat actualizado exitosamente por número de WhatsApp ===")
+            return Response({
+                'message': 'Estado de chat actualizado exitosamente',
+                'data': response_serializer.data
+            })
             
-            if not datos_actualizacion:
-                return Response({
-                    'error': 'No hay datos para actualizar'
-                }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error actualizando estado de chat por número: {str(e)}")
+            return Response({
+                'error': 'Error interno del servidor', 
+                'detalles': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @extend_schema(
+        description="Crear o reemplazar el estado de chat de un número de WhatsApp en una sola consulta",
+        request=EstadoChatGuardarSerializer,
+        responses={200: EstadoChatSerializer, 201: EstadoChatSerializer}
+    )
+    @action(detail=False, methods=['put'], url_path='guardar-por-numero')
+    def guardar_por_numero(self, request):
+        """
+        Guardar (upsert) el estado de chat de un número de WhatsApp
+        
+        Si el número no tiene estado lo crea (201); si ya tiene, reemplaza
+        estado_conversacion (200). Se resuelve con un único
+        INSERT ... ON CONFLICT (numero_whatsapp) DO UPDATE ... RETURNING, así
+        que dos mensajes simultáneos del mismo número no fallan por la
+        restricción única.
+        
+        URL FIJA: /api/estados-chat/guardar-por-numero/
+        
+        Estructura esperada del JSON:
+        {
+            "numero_whatsapp": "573001234567",
+            "estado_conversacion": {
+                "fase": "confirmacion_cita",
+                "step": "seleccion_horario"
+            }
+        }
+        """
+        logger.info("=== INICIO - Guardando estado de chat por número de WhatsApp ===")
+        
+        estado_chat_serializer = EstadoChatGuardarSerializer(data=request.data)
+        if not estado_chat_serializer.is_valid():
+            logger.error(f"Error validando estado chat: {estado_chat_serializer.errors}")
+            return Response({
+                'error': 'Datos de estado chat inválidos', 
+                'detalles': estado_chat_serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            estado_chat, creado = EstadoChat.objects.guardar(**estado_chat_serializer.validated_data)
+            logger.info(f"EstadoChat {'creado' if creado else 'actualizado'} - ID: {estado_chat.id}, WhatsApp: {estado_chat.numero_whatsapp}")
             
-            estado_chat_serializer = EstadoChatSerializer(
-                estado_chat, 
-                data=datos_actualizacion, 
-                partial=True
-            )
+            response_serializer = EstadoChatSerializer(estado_chat, context=self.get_serializer_context())
             
-            if not estado_chat_serializer.is_valid():
-                logger.error(f"Error validando estado chat: {estado_chat_serializer.errors}")
-                return Response({
-                    'error': 'Datos de estado chat inválidos', 
-                    'detalles': estado_chat_serializer.errors
-                }, status=status.HTTP_400_BAD_REQUEST)
+            logger.info("=== FIN - Estado de chat guardado exitosamente ===")
+            return Response({
+                'message': 'Estado de chat creado exitosamente' if creado else 'Estado de chat actualizado exitosamente',
+                'data': response_serializer.data
+            }, status=status.HTTP_201_CREATED if creado else status.HTTP_200_OK)
             
-            estado_chat_serializer.save()
-            logger.info(f"EstadoChat actualizado exitosamente - ID: {estado_chat.id}")
+        except Exception as e:
+            logger.error(f"Error guardando estado de chat por número: {str(e)}")
+            return Response({
+                'error': 'Error interno del servidor', 
+                'detalles': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @extend_schema(
+        description="Modificar parcialmente estado_conversacion (merge patch RFC 7396 y/o rutas) en la base de datos",
+        request=EstadoChatFusionarSerializer,
+        responses={
+            200: EstadoChatSerializer,
+            400: OpenApiResponse(description="Datos inválidos (el parche debe ser un objeto JSON)"),
+            404: OpenApiResponse(description="Estado de chat no encontrado con ese número de WhatsApp"),
+            409: OpenApiResponse(
+                description="Rutas no aplicables al estado guardado; no se modifica nada: "
+                            "{'error': ..., 'rutas_no_aplicables': [1]}"
+            )
+        }
+    )
+    @action(detail=False, methods=['patch'], url_path='fusionar-por-numero')
+    def fusionar_por_numero(self, request):
+        """
+        Fusionar cambios en el estado de chat de un número de WhatsApp
+        
+        Solo se envían las claves que cambian; el servidor las aplica sobre el
+        estado guardado con || / jsonb_set en un único UPDATE, sin leer el
+        estado antes. Webhooks simultáneos del mismo número no se pisan las
+        claves. Si el número no tiene estado responde 404 (para crearlo usar
+        guardar-por-numero).
+        
+        - parche: merge patch RFC 7396 (un objeto JSON). Las claves se
+          fusionan recursivamente; null elimina la clave; un valor que no es
+          objeto reemplaza.
+        - rutas: operaciones aplicadas después del parche, en orden.
+          {"ruta": [...], "valor": x} asigna (el objeto o arreglo padre debe
+          existir) y {"ruta": [...], "eliminar": true} elimina (la ruta debe
+          existir; para borrar una clave que puede no estar se usa null en el
+          parche). Si alguna no es aplicable se responde 409 con sus
+          posiciones en rutas_no_aplicables y no se modifica nada.
+        
+        URL FIJA: /api/estados-chat/fusionar-por-numero/
+        
+        Estructura esperada del JSON:
+        {
+            "numero_whatsapp": "573001234567",
+            "parche": {
+                "fase": "confirmacion_cita",
+                "datos": {"horario": "10:00", "producto_id": null}
+            },
+            "rutas": [
+                {"ruta": ["intentos"], "valor": 2},
+                {"ruta": ["datos", "temporal"], "eliminar": true}
+            ]
+        }
+        """
+        logger.info("=== INICIO - Fusionando estado de chat por número de WhatsApp ===")
+        
+        fusionar_serializer = EstadoChatFusionarSerializer(data=request.data)
+        if not fusionar_serializer.is_valid():
+            logger.error(f"Error validando cambios de estado chat: {fusionar_serializer.errors}")
+            return Response({
+                'error': 'Datos de estado chat inválidos', 
+                'detalles': fusionar_serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            # Un error de datos no debe dejar inutilizable una transacción externa
+            with transaction.atomic():
+                estado_chat = EstadoChat.objects.fusionar(**fusionar_serializer.validated_data)
+            if estado_chat is None:
+                logger.error(f"Estado de chat no encontrado para número: {fusionar_serializer.validated_data['numero_whatsapp']}")
+                return Response({
+                    'error': 'Estado de chat no encontrado con ese número de WhatsApp'
+                }, status=status.HTTP_404_NOT_FOUND)
+            logger.info(f"EstadoChat fusionado - ID: {estado_chat.id}, WhatsApp: {estado_chat.numero_whatsapp}")
             
-            # Retornar el estado de chat actualizado
-            estado_chat_actualizado = EstadoChat.objects.get(id=estado_chat.id)
-            response_serializer = EstadoChatSerializer(estado_chat_actualizado)
+            response_serializer = EstadoChatSerializer(estado_chat, context=self.get_serializer_context())
             
-            logger.info("=== FIN - Estado de chat actualizado exitosamente por número de WhatsApp ===")
+            logger.info("=== FIN - Estado de chat fusionado exitosamente ===")
             return Response({
                 'message': 'Estado de chat actualizado exitosamente',
                 'data': response_serializer.data
             })
             
-        except EstadoChat.DoesNotExist:
-            logger.error(f"Estado de chat no encontrado para número: {numero_whatsapp}")
+        except RutasNoAplicables as e:
+            logger.warning(f"Rutas no aplicables al estado de chat: {e.indices}")
             return Response({
-                'error': 'Estado de chat no encontrado con ese número de WhatsApp'
-            }, status=status.HTTP_404_NOT_FOUND)
+                'error': 'Rutas no aplicables al estado guardado',
+                'rutas_no_aplicables': e.indices
+            }, status=status.HTTP_409_CONFLICT)
+        except DataError as e:
+            # P. ej. el carácter \u0000, que jsonb no admite
+            logger.warning(f"Datos rechazados por la base de datos al fusionar estado de chat: {str(e)}")
+            return Response({
+                'error': 'Datos de estado chat inválidos'
+            }, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
-            logger.error(f"Error actualizando estado de chat por número: {str(e)}")
+            logger.exception(f"Error fusionando estado de chat por número: {str(e)}")
             return Response({
-                'error': 'Error interno del servidor', 
-                'detalles': str(e)
+                'error': 'Error interno del servidor'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -244,7 +401,7 @@ class ProfesionalViewSet(viewsets.GenericViewSet):
             }
             
             logger.info("=== FIN - Profesional encontrado y retornado en formato flat ===")
-            return Response(response_data)
+            return Response(filtrar_dict(response_data, request))
             
         except Usuario.DoesNotExist:
             logger.error(f"Usuario no encontrado con ID: {profesional_id}")
@@ -431,16 +588,23 @@ class ClienteViewSet(viewsets.GenericViewSet):
                         return Response({'error': 'numero_whatsapp es requerido en estado_chat'}, 
                                       status=status.HTTP_400_BAD_REQUEST)
                     
-                    # Verificar si ya existe un EstadoChat con ese número
-                    try:
-                        estado_chat = EstadoChat.objects.get(numero_whatsapp=numero_whatsapp)
-                        # Si existe, actualizar solo el estado_conversacion
-                        if estado_conversacion is not None:
-                            estado_chat.estado_conversacion = estado_conversacion
-                            estado_chat.save()
-                        logger.info(f"EstadoChat actualizado - ID: {estado_chat.id}, WhatsApp: {estado_chat.numero_whatsapp}")
-                    except EstadoChat.DoesNotExist:
-                        # Si no existe, crear uno nuevo
+                    if estado_conversacion is not None:
+                        # Crear o reemplazar el estado en una sola consulta (ON CONFLICT)
+                        estado_chat_serializer = EstadoChatGuardarSerializer(data=estado_chat_data)
+                        if not estado_chat_serializer.is_valid():
+                            logger.error(f"Error validando estado chat: {estado_chat_serializer.errors}")
+                            return Response({'error': 'Datos de estado chat inválidos', 'detalles': estado_chat_serializer.errors}, 
+                                          status=status.HTTP_400_BAD_REQUEST)
+                        
+                        estado_chat, creado = EstadoChat.objects.guardar(**estado_chat_serializer.validated_data)
+                        logger.info(f"EstadoChat {'creado' if creado else 'actualizado'} - ID: {estado_chat.id}, WhatsApp: {estado_chat.numero_whatsapp}")
+                    else:
+                        # Sin estado_conversacion solo se asocia un estado existente
+                        estado_chat = EstadoChat.objects.filter(numero_whatsapp=numero_whatsapp).first()
+                        if estado_chat is not None:
+                            logger.info(f"EstadoChat existente - ID: {estado_chat.id}, WhatsApp: {estado_chat.numero_whatsapp}")
+                    if estado_chat is None:
+                        # No existe y no hay estado_conversacion con qué crearlo: reportar el error de validación
                         estado_chat_serializer = EstadoChatSerializer(data=estado_chat_data)
                         if not estado_chat_serializer.is_valid():
                             logger.error(f"Error validando estado chat: {estado_chat_serializer.errors}")
@@ -761,7 +925,7 @@ class ClienteViewSet(viewsets.GenericViewSet):
                 }
             
             logger.info("=== FIN - Cliente encontrado y retornado en estructura flat ===")
-            return Response(response_data)
+            return Response(filtrar_dict(response_data, request))
             
         except Cliente.DoesNotExist:
             logger.warning(f"Cliente no encontrado para numero_documento: {numero_documento}")
@@ -789,23 +953,42 @@ class ProductoViewSet(viewsets.GenericViewSet, mixins.ListModelMixin):
         return ProductoSerializer
 
     def list(self, request, *args, **kwargs):
-        """Listar productos con profesionales incluidos"""
+        """
+        Listar productos con profesionales incluidos
+        
+        Se sirve del catálogo materializado en memoria (ver catalogo.py), que
+        solo se reconstruye cuando cambian productos o profesionales.
+        
+        Responde con ETag / Last-Modified; con If-None-Match o
+        If-Modified-Since vigentes responde 304 sin armar la respuesta.
+        """
         logger.info("=== INICIO - Listando productos con profesionales ===")
         
-        queryset = self.filter_queryset(self.get_queryset())
+        # Las mismas versiones de tabla dan el ETag y la versión del catálogo
+        versiones_catalogo = versiones.leer(versiones.TABLAS_PRODUCTOS)
+        etag, ultima_modificacion = versiones.validadores(
+            f'productos|{request.get_full_path()}|{request.accepted_renderer.format}',
+            versiones.TABLAS_PRODUCTOS, versiones_catalogo
+        )
+        respuesta = versiones.no_modificado(request, etag, ultima_modificacion)
+        if respuesta is not None:
+            logger.info("=== FIN - Productos sin cambios (304) ===")
+            return respuesta
         
-        # Optimizar consulta para incluir profesionales
-        queryset = queryset.prefetch_related('productoprofesional_set__profesional')
+        productos = catalogo.obtener(versiones_catalogo).listado
         
-        page = self.paginate_queryset(queryset)
+        page = self.paginate_queryset(productos)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
+            # ?fields= / ?exclude= sobre las filas ya armadas del catálogo
+            filas = [filtrar_dict(producto, request) for producto in page]
             logger.info(f"Productos paginados con profesionales - Items: {len(page)}")
-            return self.get_paginated_response(serializer.data)
+            return versiones.con_validadores(
+                self.get_paginated_response(filas), etag, ultima_modificacion
+            )
 
-        serializer = self.get_serializer(queryset, many=True)
-        logger.info(f"=== FIN - {len(serializer.data)} productos listados con profesionales ===")
-        return Response(serializer.data)
+        filas = [filtrar_dict(producto, request) for producto in productos]
+        logger.info(f"=== FIN - {len(filas)} productos listados con profesionales ===")
+        return versiones.con_validadores(Response(filas), etag, ultima_modificacion)
 
     @extend_schema(
         description="Consultar producto por ID con profesionales (enviado en JSON)",
@@ -860,36 +1043,32 @@ class ProductoViewSet(viewsets.GenericViewSet, mixins.ListModelMixin):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            # Buscar el producto con optimización para profesionales
-            producto = Producto.objects.prefetch_related(
-                'productoprofesional_set__profesional'
-            ).get(id=producto_id)
-            
-            logger.info(f"Producto encontrado - ID: {producto.id}, Nombre: {producto.nombre}")
-            
-            # Usar ProductoSerializer que incluye profesionales
-            serializer = ProductoSerializer(producto)
-            response_data = serializer.data
-            
-            logger.info(f"Profesionales incluidos: {len(response_data.get('profesionales', []))}")
-            logger.info("=== FIN - Producto encontrado y retornado con profesionales ===")
-            
-            return Response(response_data)
-            
-        except Producto.DoesNotExist:
+            producto_id = int(producto_id)
+        except (TypeError, ValueError):
+            return Response({
+                'error': 'producto_id debe ser un número entero'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Producto con profesionales ya armado en el catálogo en memoria
+        producto = catalogo.obtener().por_id.get(producto_id)
+        if producto is None:
             logger.error(f"Producto no encontrado con ID: {producto_id}")
             return Response({
                 'error': 'Producto no encontrado'
             }, status=status.HTTP_404_NOT_FOUND)
-        except Exception as e:
-            logger.error(f"Error consultando producto por ID: {str(e)}")
-            return Response({
-                'error': 'Error interno del servidor',
-                'detalles': str(e)
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        logger.info(f"Producto encontrado - ID: {producto_id}, Nombre: {producto['nombre']}")
+        logger.info(f"Profesionales incluidos: {len(producto['profesionales'])}")
+        logger.info("=== FIN - Producto encontrado y retornado con profesionales ===")
+        
+        return Response(filtrar_dict(producto, request))
 
 @extend_schema_view(
     create=extend_schema(description="Crear una nueva cita"),
+    retrieve=extend_schema(
+        description="Obtener una cita por ID. Responde con ETag; con If-None-Match vigente responde 304 sin cuerpo",
+        responses={200: CitaSerializer, 304: OpenApiResponse(description="La cita no ha cambiado")}
+    ),
 )
 class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
     """
@@ -909,20 +1088,83 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
             return CitaListSerializer
         return CitaSerializer
 
+    def create(self, request, *args, **kwargs):
+        """
+        Crear cita
+        
+        El cruce de horarios del profesional lo valida la base de datos al
+        insertar (restricción cita_profesional_sin_solape); si hay cruce se
+        responde 409.
+        """
+        try:
+            with transaction.atomic():
+                return super().create(request, *args, **kwargs)
+        except IntegrityError as e:
+            if not es_solapamiento_profesional(e):
+                raise
+            logger.warning(f"Cruce de horario al crear cita: {str(e)}")
+            return respuesta_solapamiento()
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Obtener cita por ID
+        
+        El ETag se calcula con la columna version de la cita, que se incrementa
+        en cada modificación de la fila (estado, horario, observaciones,
+        evento de calendario), y con las versiones de las tablas de usuarios,
+        productos y profesionales, cuyos datos van embebidos en la respuesta.
+        Con If-None-Match vigente se responde 304 tras leer esa columna y los
+        contadores, sin la consulta con relaciones ni el serializador.
+        """
+        logger.info(f"=== INICIO - Obtener cita {kwargs.get('pk')} ===")
+        
+        try:
+            cita_id = int(kwargs.get('pk'))
+        except (TypeError, ValueError):
+            cita_id = None
+        version = None
+        if cita_id is not None:
+            version = Cita.objects.filter(pk=cita_id).values_list('version', flat=True).first()
+        if version is None:
+            return Response({
+                'error': 'Cita no encontrada'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        etag, ultima_modificacion = versiones.validadores_fila(
+            f'cita:{cita_id}|{request.get_full_path()}|{request.accepted_renderer.format}', version,
+            versiones.TABLAS_CITA
+        )
+        respuesta = versiones.no_modificado(request, etag, ultima_modificacion)
+        if respuesta is not None:
+            logger.info("=== FIN - Cita sin cambios (304) ===")
+            return respuesta
+        
+        serializer = self.get_serializer(self.get_object())
+        logger.info("=== FIN - Cita obtenida ===")
+        return versiones.con_validadores(Response(serializer.data), etag, ultima_modificacion)
+
     @extend_schema(
         description="Obtener citas por rango de fechas",
         responses={200: CitaListSerializer(many=True)}
     )
-    @action(detail=False, methods=['get'],url_path='por-fecha')
+    @action(detail=False, methods=['get'], url_path='por-fecha', pagination_class=CursorFechaPagination)
     def por_fecha(self, request):
         """
         Filtrar citas por rango de fechas
         
         Parámetros:
         - fecha_inicio: Fecha de inicio del rango (YYYY-MM-DD o YYYY-MM-DDTHH:MM:SS)
-        - fecha_fin: Fecha de fin del rango (YYYY-MM-DD o YYYY-MM-DDTHH:MM:SS)
+        - fecha_fin: Fecha de fin del rango, día inclusive (YYYY-MM-DD) o instante
+          exclusivo (YYYY-MM-DDTHH:MM:SS)
+        
+        Las fechas sin zona horaria se interpretan en hora de Colombia; un
+        formato inválido responde 400.
         
         Ambos parámetros filtran por la fecha de inicio de la cita.
+        
+        Paginación por cursor ordenada por (fecha_hora_inicio, id): seguir el
+        enlace ``next``; ``page_size`` hasta 500 e ``incluir_total=false`` para
+        omitir el conteo.
         """
         logger.info("=== INICIO - Endpoint por_fecha llamado ===")
         
@@ -932,34 +1174,34 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
         logger.info(f"Parámetros recibidos - fecha_inicio: {fecha_inicio}, fecha_fin: {fecha_fin}")
         
         # Usar queryset optimizado que incluye el usuario del cliente para el número de documento
+        # (el orden lo fija la paginación por cursor)
         queryset = Cita.objects.select_related(
-            'cliente', 'producto', 'profesional_asignado', 'estado_actual'
-        ).all()
+            'cliente', 'producto', 'profesional_asignado'
+        )
+        # Solo las columnas de los campos pedidos (?fields= / ?exclude=); la
+        # fecha de inicio siempre, la usa el cursor
+        queryset = CitaListSerializer(context=self.get_serializer_context()).limitar_queryset(
+            queryset, 'fecha_hora_inicio'
+        )
         
-        if fecha_inicio:
-            logger.info(f"APLICANDO FILTRO fecha_inicio >= {fecha_inicio}")
-            # Usar __date para comparar solo la fecha, sin hora
-            queryset = queryset.filter(fecha_hora_inicio__date__gte=fecha_inicio)
-            
-        if fecha_fin:
-            logger.info(f"APLICANDO FILTRO fecha_fin <= {fecha_fin}")
-            # Usar __date para comparar solo la fecha, sin hora
-            queryset = queryset.filter(fecha_hora_inicio__date__lte=fecha_fin)
+        try:
+            desde, hasta = rango_desde_parametros(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Contar resultados antes de la paginación
-        total_resultados = queryset.count()
-        logger.info(f"Total de resultados encontrados: {total_resultados}")
+        # Límites [desde, hasta) en hora de Colombia sobre la columna (range scan del índice)
+        logger.info(f"APLICANDO FILTRO {desde} <= fecha_hora_inicio < {hasta}")
+        queryset = filtrar_rango(queryset, desde, hasta)
         
-
-        # Usar paginación como en el list normal
+        # Paginación por cursor (el total, si se pide, lo cuenta el paginador)
         page = self.paginate_queryset(queryset)
         if page is not None:
-            logger.info(f"Aplicando paginación - Items en página actual: {len(page)}")
-            serializer = CitaListSerializer(page, many=True)
+            logger.info(f"Aplicando paginación - Items en página actual: {len(page)} de {self.paginator.total}")
+            serializer = CitaListSerializer(page, many=True, context=self.get_serializer_context())
             logger.info("=== FIN - Retornando resultados paginados ===")
             return self.get_paginated_response(serializer.data)
             
-        serializer = CitaListSerializer(queryset, many=True)
+        serializer = CitaListSerializer(queryset, many=True, context=self.get_serializer_context())
         logger.info(f"=== FIN - Retornando todos los resultados ({len(serializer.data)} items) ===")
         return Response(serializer.data)
 
@@ -969,16 +1211,37 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
             OpenApiParameter(
                 name='fecha_inicio',
                 location=OpenApiParameter.QUERY,
-                description='Fecha de inicio del rango (YYYY-MM-DD)',
+                description='Fecha de inicio del rango (YYYY-MM-DD o YYYY-MM-DDTHH:MM:SS, hora de Colombia)',
                 type=str,
                 required=False
             ),
             OpenApiParameter(
                 name='fecha_fin', 
                 location=OpenApiParameter.QUERY,
-                description='Fecha de fin del rango (YYYY-MM-DD)',
+                description='Fecha de fin del rango, inclusive (YYYY-MM-DD) o instante final exclusivo (YYYY-MM-DDTHH:MM:SS)',
+                type=str,
+                required=False
+            ),
+            OpenApiParameter(
+                name='cursor',
+                location=OpenApiParameter.QUERY,
+                description='Cursor de paginación (tomado de next / previous)',
                 type=str,
                 required=False
+            ),
+            OpenApiParameter(
+                name='page_size',
+                location=OpenApiParameter.QUERY,
+                description='Resultados por página (máximo 500)',
+                type=int,
+                required=False
+            ),
+            OpenApiParameter(
+                name='incluir_total',
+                location=OpenApiParameter.QUERY,
+                description='false para omitir el total (count) y su consulta',
+                type=bool,
+                required=False
             )
         ],
         responses={
@@ -1048,16 +1311,24 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
             )
         }
     )
-    @action(detail=False, methods=['get'], url_path='por-fecha-completo')
+    @action(detail=False, methods=['get'], url_path='por-fecha-completo', pagination_class=CursorFechaPagination)
     def por_fecha_completo(self, request):
         """
         Filtrar citas por rango de fechas con información completa de cita, cliente, profesional y producto
         
         Parámetros:
         - fecha_inicio: Fecha de inicio del rango (YYYY-MM-DD o YYYY-MM-DDTHH:MM:SS)
-        - fecha_fin: Fecha de fin del rango (YYYY-MM-DD o YYYY-MM-DDTHH:MM:SS)
+        - fecha_fin: Fecha de fin del rango, día inclusive (YYYY-MM-DD) o instante
+          exclusivo (YYYY-MM-DDTHH:MM:SS)
+        
+        Las fechas sin zona horaria se interpretan en hora de Colombia; un
+        formato inválido responde 400.
         
         Retorna información completa estructurada por separado para cada entidad.
+        
+        Paginación por cursor ordenada por (fecha_hora_inicio, id): seguir el
+        enlace ``next``; ``page_size`` hasta 500 e ``incluir_total=false`` para
+        omitir el conteo.
         """
         logger.info("=== INICIO - Endpoint por_fecha_completo llamado ===")
         
@@ -1066,150 +1337,29 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
         
         logger.info(f"Parámetros recibidos - fecha_inicio: {fecha_inicio}, fecha_fin: {fecha_fin}")
         
-        # Usar queryset optimizado con todas las relaciones necesarias
-        queryset = Cita.objects.select_related(
-            'cliente', 'producto', 'profesional_asignado', 'estado_actual'
-        ).all()
+        # Perfiles Cliente / Profesional por select_related inverso: la página
+        # completa sale en una consulta (más el conteo del paginador)
+        queryset = citas_completas()
         
-        if fecha_inicio:
-            logger.info(f"APLICANDO FILTRO fecha_inicio >= {fecha_inicio}")
-            queryset = queryset.filter(fecha_hora_inicio__date__gte=fecha_inicio)
-            
-        if fecha_fin:
-            logger.info(f"APLICANDO FILTRO fecha_fin <= {fecha_fin}")
-            queryset = queryset.filter(fecha_hora_inicio__date__lte=fecha_fin)
+        try:
+            desde, hasta = rango_desde_parametros(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        total_resultados = queryset.count()
-        logger.info(f"Total de resultados encontrados: {total_resultados}")
+        # Límites [desde, hasta) en hora de Colombia sobre la columna (range scan del índice)
+        logger.info(f"APLICANDO FILTRO {desde} <= fecha_hora_inicio < {hasta}")
+        queryset = filtrar_rango(queryset, desde, hasta)
         
         # Aplicar paginación si está configurada
         page = self.paginate_queryset(queryset)
         citas_a_procesar = page if page is not None else queryset
         
         # Construir respuesta con información completa
-        resultados = []
-        
-        for cita in citas_a_procesar:
-            logger.info(f"Procesando cita ID: {cita.id}")
-            
-            # Información básica de la cita
-            # Convertir fechas de UTC a zona horaria de Colombia (UTC-5)
-            zona_colombia = ZoneInfo('America/Bogota')
-            
-            fecha_inicio_colombia = None
-            if cita.fecha_hora_inicio:
-                fecha_inicio_colombia = cita.fecha_hora_inicio.astimezone(zona_colombia).strftime('%d/%m/%Y %H:%M')
-            
-            fecha_fin_colombia = None
-            if cita.fecha_hora_fin:
-                fecha_fin_colombia = cita.fecha_hora_fin.astimezone(zona_colombia).strftime('%d/%m/%Y %H:%M')
-            
-            cita_data = {
-                'id': cita.id,
-                'fecha_hora_inicio': fecha_inicio_colombia,
-                'fecha_hora_fin': fecha_fin_colombia,
-                'observaciones': cita.observaciones,
-                'google_calendar_event_id': cita.google_calendar_event_id,
-                'google_calendar_url_event': cita.google_calendar_url_event,
-                'estado_actual': cita.get_estado_actual_nombre() if hasattr(cita, 'get_estado_actual_nombre') else 'Sin estado'
-            }
-            
-            # Información del cliente (Usuario que es cliente)
-            cliente_data = None
-            if cita.cliente:
-                # Buscar el perfil Cliente asociado al Usuario
-                try:
-                    from .models import Cliente
-                    cliente_perfil = Cliente.objects.select_related('usuario', 'estado_chat').get(usuario=cita.cliente)
-                    cliente_data = {
-                        'usuario_id': cita.cliente.id,
-                        'nombres': cita.cliente.nombres,
-                        'apellidos': cita.cliente.apellidos,
-                        'tipo_documento': cita.cliente.tipo_documento,
-                        'numero_documento': cita.cliente.numero_documento,
-                        'email': cita.cliente.email,
-                        'celular': cita.cliente.celular,
-                        'edad': cliente_perfil.edad,
-                        'barrio': cliente_perfil.barrio,
-                        'direccion': cliente_perfil.direccion,
-                        'nombre_acudiente': cliente_perfil.nombre_acudiente,
-                        'remitido_colegio': cliente_perfil.remitido_colegio,
-                        'colegio': cliente_perfil.colegio
-                    }
-                except Cliente.DoesNotExist:
-                    logger.warning(f"No se encontró perfil Cliente para usuario ID: {cita.cliente.id}")
-                    cliente_data = {
-                        'usuario_id': cita.cliente.id,
-                        'nombres': cita.cliente.nombres,
-                        'apellidos': cita.cliente.apellidos,
-                        'tipo_documento': cita.cliente.tipo_documento,
-                        'numero_documento': cita.cliente.numero_documento,
-                        'email': cita.cliente.email,
-                        'celular': cita.cliente.celular,
-                        'edad': None,
-                        'barrio': None,
-                        'direccion': None,
-                        'nombre_acudiente': None,
-                        'remitido_colegio': None,
-                        'colegio': None
-                    }
-            
-            # Información del profesional (Usuario que es profesional)
-            profesional_data = None
-            if cita.profesional_asignado:
-                # Buscar el perfil Profesional asociado al Usuario
-                try:
-                    from .models import Profesional
-                    profesional_perfil = Profesional.objects.select_related('usuario').get(usuario=cita.profesional_asignado)
-                    profesional_data = {
-                        'profesional_id': cita.profesional_asignado.id,
-                        'nombres': cita.profesional_asignado.nombres,
-                        'apellidos': cita.profesional_asignado.apellidos,
-                        'tipo_documento': cita.profesional_asignado.tipo_documento,
-                        'numero_documento': cita.profesional_asignado.numero_documento,
-                        'email': cita.profesional_asignado.email,
-                        'celular': cita.profesional_asignado.celular,
-                        'cargo': profesional_perfil.cargo,
-                        'numero_whatsapp': profesional_perfil.numero_whatsapp
-                    }
-                except Profesional.DoesNotExist:
-                    logger.warning(f"No se encontró perfil Profesional para usuario ID: {cita.profesional_asignado.id}")
-                    profesional_data = {
-                        'profesional_id': cita.profesional_asignado.id,
-                        'nombres': cita.profesional_asignado.nombres,
-                        'apellidos': cita.profesional_asignado.apellidos,
-                        'tipo_documento': cita.profesional_asignado.tipo_documento,
-                        'numero_documento': cita.profesional_asignado.numero_documento,
-                        'email': cita.profesional_asignado.email,
-                        'celular': cita.profesional_asignado.celular,
-                        'cargo': None,
-                        'numero_whatsapp': None
-                    }
-            
-            # Información del producto
-            producto_data = None
-            if cita.producto:
-                producto_data = {
-                    'producto_id': cita.producto.id,
-                    'nombre': cita.producto.nombre,
-                    'descripcion': cita.producto.descripcion,
-                    'es_agendable_por_bot': cita.producto.es_agendable_por_bot,
-                    'duracion_minutos': cita.producto.duracion_minutos
-                }
-            
-            # Agregar al resultado
-            resultado_cita = {
-                'cita': cita_data,
-                'cliente': cliente_data,
-                'profesional': profesional_data,
-                'producto': producto_data
-            }
-            
-            resultados.append(resultado_cita)
+        resultados = filas_citas_completas(citas_a_procesar)
         
         # Preparar respuesta
         if page is not None:
-            logger.info(f"Aplicando paginación - Items en página actual: {len(resultados)}")
+            logger.info(f"Aplicando paginación - Items en página actual: {len(resultados)} de {self.paginator.total}")
             response_data = {
                 'results': resultados,
                 'count': len(resultados)
@@ -1223,6 +1373,595 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
                 'count': len(resultados)
             })
 
+    @extend_schema(
+        description=(
+            "Exportar en streaming todas las citas de un rango de fechas, con la misma "
+            "información que por-fecha-completo. Formato por header Accept "
+            "(application/x-ndjson o text/csv) o por ?format=ndjson|csv; por defecto NDJSON."
+        ),
+        parameters=[
+            OpenApiParameter(
+                name='fecha_inicio',
+                location=OpenApiParameter.QUERY,
+                description='Primer día del rango, hora de Colombia (YYYY-MM-DD)',
+                type=str,
+                required=True
+            ),
+            OpenApiParameter(
+                name='fecha_fin',
+                location=OpenApiParameter.QUERY,
+                description='Último día del rango, inclusive (YYYY-MM-DD). Máximo 366 días',
+                type=str,
+                required=True
+            ),
+            OpenApiParameter(
+                name='format',
+                location=OpenApiParameter.QUERY,
+                description='ndjson o csv (alternativa al header Accept)',
+                type=str,
+                required=False,
+                enum=['ndjson', 'csv']
+            ),
+        ],
+        responses={
+            (200, 'application/x-ndjson'): OpenApiResponse(
+                description="Una línea JSON por cita: {cita, cliente, profesional, producto}",
+                response={
+                    "type": "string",
+                    "example": '{"cita": {"id": 123, "fecha_hora_inicio": "25/12/2024 14:30", ...}, "cliente": {...}, "profesional": {...}, "producto": {...}}'
+                }
+            ),
+            (200, 'text/csv'): OpenApiResponse(
+                description="Encabezado con columnas cita_*, cliente_*, profesional_*, producto_* y una fila por cita",
+                response={
+                    "type": "string",
+                    "example": "cita_id,cita_fecha_hora_inicio,...,producto_duracion_minutos\n123,25/12/2024 14:30,...,60"
+                }
+            ),
+            400: OpenApiResponse(description="Fechas faltantes o inválidas: {'error': ...}"),
+        }
+    )
+    @action(
+        detail=False, methods=['get'], url_path='exportar',
+        renderer_classes=[NDJSONRenderer, CSVRenderer]
+    )
+    def exportar(self, request):
+        """
+        Exportar citas por rango de fechas en NDJSON o CSV
+        
+        URL FIJA: /api/citas/exportar/?fecha_inicio=2025-07-01&fecha_fin=2025-07-31&format=csv
+        
+        La respuesta se genera mientras se envía: las citas se leen con un
+        cursor del servidor en bloques de CHUNK_SIZE, así que la memoria no
+        depende del tamaño del rango. Los errores se devuelven en el formato
+        negociado.
+        """
+        from .exportacion import MAX_DIAS_EXPORTACION, lineas_csv, lineas_ndjson
+        
+        logger.info("=== INICIO - Exportando citas ===")
+        
+        fecha_inicio = request.query_params.get('fecha_inicio')
+        fecha_fin = request.query_params.get('fecha_fin')
+        try:
+            desde, hasta = rango_desde_parametros(
+                request.query_params, requerido=True, max_dias=MAX_DIAS_EXPORTACION
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        queryset = filtrar_rango(citas_completas(), desde, hasta)
+        formato = request.accepted_renderer.format
+        lineas = lineas_csv(queryset) if formato == 'csv' else lineas_ndjson(queryset)
+        
+        response = StreamingHttpResponse(lineas, content_type=request.accepted_renderer.media_type + '; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="citas_{fecha_inicio}_{fecha_fin}.{formato}"'
+        response['Vary'] = 'Accept'
+        logger.info(f"=== FIN - Exportación {formato} de {fecha_inicio} a {fecha_fin} iniciada ===")
+        return response
+
+    @extend_schema(
+        description="Consultar horarios libres para un producto (opcionalmente para un profesional)",
+        parameters=[
+            OpenApiParameter(
+                name='producto_id',
+                location=OpenApiParameter.QUERY,
+                description='ID del producto a agendar',
+                type=int,
+                required=True
+            ),
+            OpenApiParameter(
+                name='profesional_id',
+                location=OpenApiParameter.QUERY,
+                description='ID de usuario del profesional (si se omite se consideran todos los profesionales del producto)',
+                type=int,
+                required=False
+            ),
+            OpenApiParameter(
+                name='fecha_inicio',
+                location=OpenApiParameter.QUERY,
+                description='Inicio del rango (YYYY-MM-DD o YYYY-MM-DDTHH:MM, hora de Colombia)',
+                type=str,
+                required=True
+            ),
+            OpenApiParameter(
+                name='fecha_fin',
+                location=OpenApiParameter.QUERY,
+                description='Fin del rango (YYYY-MM-DD: día incluido; con hora: exclusivo). Por defecto igual a fecha_inicio',
+                type=str,
+                required=False
+            )
+        ],
+        responses={
+            200: {
+                "description": "Horarios libres",
+                "content": {
+                    "application/json": {
+                        "example": {
+                            "producto_id": 10,
+                            "duracion_minutos": 60,
+                            "profesional_id": None,
+                            "fecha_inicio": "2025-07-21",
+                            "fecha_fin": "2025-07-21",
+                            "total": 1,
+                            "slots": [
+                                {
+                                    "fecha_hora_inicio": "21/07/2025 08:00",
+                                    "fecha_hora_fin": "21/07/2025 09:00",
+                                    "profesionales": [2, 5]
+                                }
+                            ]
+                        }
+                    }
+                }
+            }
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='disponibilidad')
+    def disponibilidad(self, request):
+        """
+        Calcular horarios libres para un producto dentro de un rango de fechas
+        
+        Reemplaza las consultas repetidas a por-fecha para verificar cruces: el
+        servidor cruza en una sola consulta las citas no canceladas de los
+        profesionales del producto con el horario de atención (HorarioAtencion,
+        festivos y excepciones de cada profesional) y la duración del producto.
+        
+        URL FIJA: /api/citas/disponibilidad/?producto_id=10&fecha_inicio=2025-07-21&fecha_fin=2025-07-25
+        
+        Cada slot indica qué profesionales están libres en ese horario.
+        """
+        logger.info("=== INICIO - Consultando disponibilidad ===")
+        
+        from . import disponibilidad
+        
+        producto_id = request.query_params.get('producto_id')
+        profesional_id = request.query_params.get('profesional_id')
+        fecha_inicio = request.query_params.get('fecha_inicio')
+        fecha_fin = request.query_params.get('fecha_fin') or fecha_inicio
+        
+        logger.info(f"Parámetros recibidos - producto_id: {producto_id}, profesional_id: {profesional_id}, fecha_inicio: {fecha_inicio}, fecha_fin: {fecha_fin}")
+        
+        if not producto_id or not fecha_inicio:
+            return Response({
+                'error': 'producto_id y fecha_inicio son requeridos'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            desde, hasta, fecha_desde, fecha_hasta = disponibilidad.rango_consulta(request.query_params)
+        except ValueError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            producto = Producto.objects.get(id=producto_id)
+        except (Producto.DoesNotExist, ValueError):
+            return Response({
+                'error': 'Producto no encontrado'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        profesional_ids = disponibilidad.profesionales_del_producto(producto.id)
+        if profesional_id:
+            if not profesional_id.isdigit() or int(profesional_id) not in profesional_ids:
+                return Response({
+                    'error': 'El profesional no está autorizado para atender este producto'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            profesional_ids = [int(profesional_id)]
+        
+        libres = disponibilidad.disponibilidad_por_profesional(
+            producto, profesional_ids, fecha_desde, fecha_hasta, limites=(desde, hasta)
+        )
+        slots = [
+            {
+                'fecha_hora_inicio': disponibilidad.formatear_fecha(inicio),
+                'fecha_hora_fin': disponibilidad.formatear_fecha(fin),
+                'profesionales': ids,
+            }
+            for inicio, fin, ids in disponibilidad.combinar_slots(libres)
+        ]
+        
+        logger.info(f"=== FIN - {len(slots)} horarios libres para {len(profesional_ids)} profesionales ===")
+        return Response({
+            'producto_id': producto.id,
+            'duracion_minutos': producto.duracion_minutos,
+            'profesional_id': int(profesional_id) if profesional_id else None,
+            'fecha_inicio': fecha_desde.isoformat(),
+            'fecha_fin': fecha_hasta.isoformat(),
+            'total': len(slots),
+            'slots': slots
+        })
+
+    @extend_schema(
+        description="Horarios libres de cada profesional que atiende un producto, en una sola consulta",
+        parameters=[
+            OpenApiParameter(
+                name='producto_id',
+                location=OpenApiParameter.QUERY,
+                description='ID del producto (define la duración y los profesionales autorizados)',
+                type=int,
+                required=True
+            ),
+            OpenApiParameter(
+                name='fecha_inicio',
+                location=OpenApiParameter.QUERY,
+                description='Inicio del rango (YYYY-MM-DD o YYYY-MM-DDTHH:MM, hora de Colombia)',
+                type=str,
+                required=True
+            ),
+            OpenApiParameter(
+                name='fecha_fin',
+                location=OpenApiParameter.QUERY,
+                description='Fin del rango (YYYY-MM-DD: día incluido; con hora: exclusivo). Por defecto igual a fecha_inicio',
+                type=str,
+                required=False
+            )
+        ],
+        responses={
+            200: {
+                "description": "Horarios libres por profesional",
+                "content": {
+                    "application/json": {
+                        "example": {
+                            "producto_id": 10,
+                            "duracion_minutos": 60,
+                            "fecha_inicio": "2025-07-24",
+                            "fecha_fin": "2025-07-24",
+                            "total_profesionales": 1,
+                            "profesionales": [
+                                {
+                                    "profesional_id": 2,
+                                    "nombres": "Ana",
+                                    "apellidos": "Gómez",
+                                    "total": 1,
+                                    "slots": [
+                                        {
+                                            "fecha_hora_inicio": "24/07/2025 08:00",
+                                            "fecha_hora_fin": "24/07/2025 09:00"
+                                        }
+                                    ]
+                                }
+                            ]
+                        }
+                    }
+                }
+            }
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='disponibilidad-profesionales')
+    def disponibilidad_profesionales(self, request):
+        """
+        Matriz de disponibilidad: horarios libres agrupados por profesional
+        
+        Reemplaza una consulta de disponibilidad por cada profesional del
+        producto: las citas de todos los profesionales se leen en una sola
+        consulta y los huecos se calculan por profesional.
+        
+        URL FIJA: /api/citas/disponibilidad-profesionales/?producto_id=10&fecha_inicio=2025-07-24
+        """
+        logger.info("=== INICIO - Consultando disponibilidad por profesional ===")
+        
+        from . import disponibilidad
+        
+        producto_id = request.query_params.get('producto_id')
+        fecha_inicio = request.query_params.get('fecha_inicio')
+        fecha_fin = request.query_params.get('fecha_fin') or fecha_inicio
+        
+        logger.info(f"Parámetros recibidos - producto_id: {producto_id}, fecha_inicio: {fecha_inicio}, fecha_fin: {fecha_fin}")
+        
+        if not producto_id or not fecha_inicio:
+            return Response({
+                'error': 'producto_id y fecha_inicio son requeridos'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            desde, hasta, fecha_desde, fecha_hasta = disponibilidad.rango_consulta(request.query_params)
+        except ValueError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            producto = Producto.objects.get(id=producto_id)
+        except (Producto.DoesNotExist, ValueError):
+            return Response({
+                'error': 'Producto no encontrado'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        profesionales = disponibilidad.profesionales_con_nombre(producto.id)
+        libres = disponibilidad.disponibilidad_por_profesional(
+            producto, [p['profesional_id'] for p in profesionales], fecha_desde, fecha_hasta,
+            limites=(desde, hasta)
+        )
+        for profesional in profesionales:
+            slots = libres[profesional['profesional_id']]
+            profesional['total'] = len(slots)
+            profesional['slots'] = [
+                {
+                    'fecha_hora_inicio': disponibilidad.formatear_fecha(inicio),
+                    'fecha_hora_fin': disponibilidad.formatear_fecha(fin),
+                }
+                for inicio, fin in slots
+            ]
+        
+        logger.info(f"=== FIN - Disponibilidad de {len(profesionales)} profesionales ===")
+        return Response({
+            'producto_id': producto.id,
+            'duracion_minutos': producto.duracion_minutos,
+            'fecha_inicio': fecha_desde.isoformat(),
+            'fecha_fin': fecha_hasta.isoformat(),
+            'total_profesionales': len(profesionales),
+            'profesionales': profesionales
+        })
+
+    @extend_schema(
+        description="Verificar si un horario está libre para un profesional y sugerir el siguiente horario libre",
+        parameters=[
+            OpenApiParameter(
+                name='profesional_id',
+                location=OpenApiParameter.QUERY,
+                description='ID de usuario del profesional',
+                type=int,
+                required=True
+            ),
+            OpenApiParameter(
+                name='producto_id',
+                location=OpenApiParameter.QUERY,
+                description='ID del producto (define la duración de la cita)',
+                type=int,
+                required=True
+            ),
+            OpenApiParameter(
+                name='fecha_hora_inicio',
+                location=OpenApiParameter.QUERY,
+                description='Inicio propuesto en formato dd/mm/aaaa hh:mm (hora de Colombia)',
+                type=str,
+                required=True
+            )
+        ],
+        responses={
+            200: {
+                "description": "Resultado de la verificación",
+                "content": {
+                    "application/json": {
+                        "example": {
+                            "profesional_id": 2,
+                            "fecha_hora_inicio": "21/07/2025 09:00",
+                            "fecha_hora_fin": "21/07/2025 10:00",
+                            "libre": False,
+                            "dentro_de_horario": True,
+                            "siguiente_libre": {
+                                "fecha_hora_inicio": "21/07/2025 10:30",
+                                "fecha_hora_fin": "21/07/2025 11:30"
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='horario-libre')
+    def horario_libre(self, request):
+        """
+        Verificar un horario mientras el cliente negocia la cita
+        
+        Responde desde el índice en memoria de la agenda del profesional
+        (agenda.agenda_cache) y el calendario laboral precalculado, sin
+        consultar la BD cuando el día ya está cargado. El horario está libre si
+        cabe en la jornada del profesional (horario semanal, festivos y
+        excepciones; ver dentro_de_horario) y no se cruza con otra cita. Si no
+        está libre sugiere el siguiente horario libre dentro del horario laboral.
+        
+        URL FIJA: /api/citas/horario-libre/?profesional_id=2&producto_id=10&fecha_hora_inicio=21/07/2025 09:00
+        """
+        logger.info("=== INICIO - Verificando horario libre ===")
+        
+        from . import calendario, disponibilidad
+        from .agenda import agenda_cache
+        
+        profesional_id = request.query_params.get('profesional_id')
+        producto_id = request.query_params.get('producto_id')
+        fecha_hora_inicio = request.query_params.get('fecha_hora_inicio')
+        
+        logger.info(f"Parámetros recibidos - profesional_id: {profesional_id}, producto_id: {producto_id}, fecha_hora_inicio: {fecha_hora_inicio}")
+        
+        if not profesional_id or not producto_id or not fecha_hora_inicio:
+            return Response({
+                'error': 'profesional_id, producto_id y fecha_hora_inicio son requeridos'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not profesional_id.isdigit():
+            return Response({
+                'error': 'profesional_id debe ser un número entero'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        profesional_id = int(profesional_id)
+        
+        try:
+            inicio = disponibilidad.parse_fecha_hora(fecha_hora_inicio)
+        except ValueError:
+            return Response({
+                'error': 'El formato de fecha debe ser dd/mm/aaaa hh:mm (ejemplo: 20/07/2025 14:30)'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            producto = Producto.objects.get(id=producto_id)
+        except (Producto.DoesNotExist, ValueError):
+            return Response({
+                'error': 'Producto no encontrado'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        duracion = timedelta(minutes=producto.duracion_minutos)
+        fin = inicio + duracion
+        # Mismo criterio que CitaSerializer.validate: fuera de la jornada (domingo,
+        # festivo, excepción o fuera de hora) no está libre aunque no haya citas
+        dentro_de_horario = calendario.dentro_de_horario(profesional_id, inicio, fin)
+        libre = dentro_de_horario and agenda_cache.esta_libre(profesional_id, inicio, fin)
+        
+        siguiente = None
+        if not libre:
+            encontrado = agenda_cache.siguiente_libre(profesional_id, inicio, duracion)
+            if encontrado:
+                siguiente = {
+                    'fecha_hora_inicio': disponibilidad.formatear_fecha(encontrado[0]),
+                    'fecha_hora_fin': disponibilidad.formatear_fecha(encontrado[1]),
+                }
+        
+        logger.info(f"=== FIN - Horario libre: {libre} - Caché agenda: {agenda_cache.stats()} ===")
+        return Response({
+            'profesional_id': profesional_id,
+            'fecha_hora_inicio': disponibilidad.formatear_fecha(inicio),
+            'fecha_hora_fin': disponibilidad.formatear_fecha(fin),
+            'libre': libre,
+            'dentro_de_horario': dentro_de_horario,
+            'siguiente_libre': siguiente
+        })
+
+    @extend_schema(
+        description="Estadísticas de las cachés en memoria del worker que atiende la petición",
+        responses={
+            200: {
+                "description": "Contadores por caché",
+                "content": {
+                    "application/json": {
+                        "example": {
+                            "pid": 12345,
+                            "agenda": {"size": 40, "hits": 1520, "misses": 40},
+                            "api_keys": {"size": 3, "hits": 9800, "misses": 3},
+                            "api_keys_invalidas": {"size": 12, "hits": 40, "misses": 12}
+                        }
+                    }
+                }
+            }
+        }
+    )
+    @action(detail=False, methods=['get'], url_path='estadisticas-cache')
+    def estadisticas_cache(self, request):
+        """
+        Aciertos/fallos de las cachés por worker
+        
+        Cada worker de gunicorn tiene sus propios contadores; el pid indica qué
+        worker respondió.
+        """
+        import os
+        from .agenda import agenda_cache
+        from .authentication import api_key_cache, api_key_invalida_cache
+        
+        return Response({
+            'pid': os.getpid(),
+            'agenda': agenda_cache.stats(),
+            'api_keys': api_key_cache.stats(),
+            'api_keys_invalidas': api_key_invalida_cache.stats()
+        })
+
+    @extend_schema(
+        description="Reclamar un lote de citas con recordatorio vencido (24h / 6h / 3h)",
+        request={
+            "application/json": {
+                "example": {
+                    "limite": 20,
+                    "lease_segundos": 300
+                }
+            }
+        },
+        responses={
+            200: {
+                "description": "Citas reclamadas",
+                "content": {
+                    "application/json": {
+                        "example": {
+                            "total": 1,
+                            "citas": [
+                                {
+                                    "cita_id": 123,
+                                    "cliente_id": 456,
+                                    "fecha_hora_inicio": "21/07/2025 09:00",
+                                    "fecha_hora_fin": "21/07/2025 10:00",
+                                    "cliente_nombre": "Juan Carlos",
+                                    "cliente_apellidos": "Pérez García",
+                                    "cliente_numero_documento": "12345678",
+                                    "producto_nombre": "Consulta",
+                                    "profesional_id": 2,
+                                    "profesional_nombre": "Ana",
+                                    "estado_cita": "Agendado",
+                                    "google_calendar_event_id": None,
+                                    "cliente_celular": "3001234567",
+                                    "accion": "recordatorio_24h"
+                                }
+                            ]
+                        }
+                    }
+                }
+            }
+        }
+    )
+    @action(detail=False, methods=['post'], url_path='reclamar-recordatorios')
+    def reclamar_recordatorios(self, request):
+        """
+        Reclamar citas con recordatorio vencido para enviarlas por WhatsApp
+        
+        Varios workers pueden llamar este endpoint en paralelo: cada cita se
+        entrega a un solo worker (SELECT ... FOR UPDATE SKIP LOCKED) y queda
+        reservada durante lease_segundos. El worker debe registrar el siguiente
+        estado con cambiar-estado-por-id (p. ej. "Pendiente Primer Confirmación
+        24 Horas Mensaje Enviado"); si no lo hace, la cita vuelve a la cola al
+        vencer la reserva.
+        
+        URL FIJA: /api/citas/reclamar-recordatorios/
+        
+        Acciones: recordatorio_24h, recordatorio_6h, informar_agente_3h
+        """
+        logger.info("=== INICIO - Reclamando recordatorios ===")
+        
+        from . import recordatorios
+        
+        limite = request.data.get('limite', 20)
+        lease = request.data.get('lease_segundos')
+        
+        try:
+            limite = int(limite)
+            lease = int(lease) if lease is not None else None
+        except (TypeError, ValueError):
+            return Response({
+                'error': 'limite y lease_segundos deben ser números enteros'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not 1 <= limite <= recordatorios.MAX_LOTE:
+            return Response({
+                'error': f'limite debe estar entre 1 y {recordatorios.MAX_LOTE}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if lease is not None and lease < 1:
+            return Response({
+                'error': 'lease_segundos debe ser mayor que 0'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        citas = recordatorios.reclamar(limite, lease)
+        
+        logger.info(f"=== FIN - {len(citas)} citas reclamadas ===")
+        return Response({
+            'total': len(citas),
+            'citas': CitaRecordatorioSerializer(citas, many=True, context=self.get_serializer_context()).data
+        })
+
     @extend_schema(
         description="Cambiar estado de una cita por ID (enviado en JSON)",
         request={
@@ -1376,7 +2115,7 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
             logger.info(f"Historial creado - ID: {historial_creado.id}")
             
             # Retornar la cita actualizada
-            serializer = CitaSerializer(cita)
+            serializer = CitaSerializer(cita, context=self.get_serializer_context())
             
             response_data = {
                 'message': 'Estado de cita actualizado exitosamente',
@@ -1396,6 +2135,12 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
             return Response({
                 'error': 'Cita no encontrada o no pertenece al cliente especificado'
             }, status=status.HTTP_404_NOT_FOUND)
+        except IntegrityError as e:
+            if not es_solapamiento_profesional(e):
+                raise
+            # Reactivar una cita cancelada cuyo horario ya fue tomado
+            logger.warning(f"Cruce de horario al cambiar estado de cita ID {cita_id}: {str(e)}")
+            return respuesta_solapamiento()
         except ValueError as e:
             logger.error(f"Error de validación: {str(e)}")
             return Response({
@@ -1408,6 +2153,100 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
                 'detalles': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @extend_schema(
+        description="Cambiar el estado de varias citas en una sola transacción",
+        request={
+            "application/json": {
+                "example": {
+                    "cambios": [
+                        {
+                            "cita_id": 123,
+                            "estado_cita": "Pendiente Primer Confirmación 24 Horas Mensaje Enviado",
+                            "observaciones": "Recordatorio enviado por WhatsApp"
+                        },
+                        {
+                            "cita_id": 124,
+                            "cliente_id": 456,
+                            "estado_cita": "Pendiente Primer Confirmación 24 Horas Mensaje Enviado"
+                        }
+                    ]
+                }
+            }
+        },
+        responses={
+            200: {
+                "description": "Resultado por cita, en el mismo orden de la petición",
+                "content": {
+                    "application/json": {
+                        "example": {
+                            "total": 2,
+                            "exitosos": 1,
+                            "fallidos": 1,
+                            "resultados": [
+                                {
+                                    "cita_id": 123,
+                                    "exito": True,
+                                    "estado_anterior": "Agendado",
+                                    "estado_actual": "Pendiente Primer Confirmación 24 Horas Mensaje Enviado",
+                                    "historial_id": 987,
+                                    "fecha_cambio": "2024-12-25T10:30:00Z"
+                                },
+                                {
+                                    "cita_id": 124,
+                                    "exito": False,
+                                    "error": "Cita no encontrada o no pertenece al cliente especificado"
+                                }
+                            ]
+                        }
+                    }
+                }
+            }
+        }
+    )
+    @action(detail=False, methods=['post'], url_path='cambiar-estado-lote')
+    def cambiar_estado_lote(self, request):
+        """
+        Cambiar el estado de varias citas (p. ej. tras un envío masivo de recordatorios)
+        
+        Inserta todo el historial con un bulk_create y actualiza las citas con
+        un solo UPDATE dentro de una transacción. cliente_id y observaciones son
+        opcionales en cada cambio. Un cambio inválido no impide aplicar los demás.
+        
+        URL FIJA: /api/citas/cambiar-estado-lote/
+        """
+        logger.info("=== INICIO - Cambio de estado en lote ===")
+        
+        from .estados import MAX_CAMBIOS_LOTE, cambiar_estados
+        
+        cambios = request.data.get('cambios')
+        if not isinstance(cambios, list) or not cambios:
+            return Response({
+                'error': 'cambios es requerido y debe ser una lista no vacía'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if len(cambios) > MAX_CAMBIOS_LOTE:
+            return Response({
+                'error': f'Máximo {MAX_CAMBIOS_LOTE} cambios por lote'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            resultados = cambiar_estados(cambios)
+        except Exception as e:
+            logger.error(f"Error cambiando estados en lote: {str(e)}")
+            return Response({
+                'error': 'Error interno del servidor',
+                'detalles': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        exitosos = sum(1 for resultado in resultados if resultado['exito'])
+        logger.info(f"=== FIN - Cambio de estado en lote: {exitosos} de {len(resultados)} aplicados ===")
+        return Response({
+            'total': len(resultados),
+            'exitosos': exitosos,
+            'fallidos': len(resultados) - exitosos,
+            'resultados': resultados
+        })
+
     @extend_schema(
         description="Obtener historial de estados de una cita",
         responses={200: HistorialEstadoCitaSerializer(many=True)}
@@ -1422,7 +2261,7 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
         
         # Obtener historial completo ordenado por fecha
         historial = cita.get_historial_completo()
-        serializer = HistorialEstadoCitaSerializer(historial, many=True)
+        serializer = HistorialEstadoCitaSerializer(historial, many=True, context=self.get_serializer_context())
         
         logger.info(f"Historial encontrado: {len(serializer.data)} registros")
         logger.info("=== FIN - Historial de estados consultado ===")
@@ -1524,7 +2363,7 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
                 logger.info(f"Campos actualizados: {list(update_data.keys())}")
                 
                 # Retornar la cita actualizada con el formato mejorado
-                response_serializer = CitaSerializer(cita_actualizada)
+                response_serializer = CitaSerializer(cita_actualizada, context=self.get_serializer_context())
                 
                 logger.info("=== FIN - Cita actualizada exitosamente por ID (desde JSON) ===")
                 return Response({
@@ -1537,6 +2376,15 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
             return Response({
                 'error': 'Cita no encontrada'
             }, status=status.HTTP_404_NOT_FOUND)
+        except IntegrityError as e:
+            if not es_solapamiento_profesional(e):
+                logger.error(f"Error actualizando cita por ID: {str(e)}")
+                return Response({
+                    'error': 'Error interno del servidor',
+                    'detalles': str(e)
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            logger.warning(f"Cruce de horario al actualizar cita ID {cita_id}: {str(e)}")
+            return respuesta_solapamiento()
         except Exception as e:
             logger.error(f"Error actualizando cita por ID: {str(e)}")
             return Response({
@@ -1622,6 +2470,8 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
         
         URL FIJA: /api/citas/consultar-por-id/
         
+        Para lecturas condicionales (ETag / 304) usar GET /api/citas/{id}/.
+        
         Estructura esperada del JSON:
         {
             "cita_id": 123
@@ -1670,7 +2520,7 @@ class CitaViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
             logger.info(f"Estado actual: {cita.get_estado_actual_nombre()}")
             
             # Serializar la cita
-            serializer = CitaSerializer(cita)
+            serializer = CitaSerializer(cita, context=self.get_serializer_context())
             
             logger.info("=== FIN - Cita consultada exitosamente por ID (desde JSON) ===")
             return Response({
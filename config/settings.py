@@ -57,6 +57,7 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'apps.citas.middleware.ApiKeyUsageMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -176,6 +177,9 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'apps.citas.permissions.IsApiKeyOrAuthenticated',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'apps.citas.throttling.ApiKeyRateThrottle',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': int(os.getenv('PAGE_SIZE', '20')),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
@@ -185,6 +189,66 @@ REST_FRAMEWORK = {
     ],
 }
 
+# ========================================
+# API Keys Configuration
+# ========================================
+
+# Caché por worker de API Keys (segundos / número máximo de entradas).
+# Una key revocada puede seguir aceptándose en otros workers hasta API_KEY_CACHE_TTL.
+API_KEY_CACHE_TTL = int(os.getenv('API_KEY_CACHE_TTL', '60'))
+API_KEY_CACHE_MAX_SIZE = int(os.getenv('API_KEY_CACHE_MAX_SIZE', '1024'))
+API_KEY_NEGATIVE_CACHE_TTL = int(os.getenv('API_KEY_NEGATIVE_CACHE_TTL', '10'))
+# Las keys inválidas van en una caché aparte, para no expulsar las válidas
+API_KEY_NEGATIVE_CACHE_MAX_SIZE = int(os.getenv('API_KEY_NEGATIVE_CACHE_MAX_SIZE', '256'))
+
+# Cada cuántos segundos cada worker escribe en BD el uso acumulado de las API Keys
+# y sus agregados por hora/endpoint (0 = escribir en cada request)
+API_KEY_USAGE_FLUSH_INTERVAL = int(os.getenv('API_KEY_USAGE_FLUSH_INTERVAL', '30'))
+
+# Rate limiting por API Key (token bucket). El límite propio de cada key se define
+# en el admin; este es el valor para keys sin límite propio (0 = sin límite).
+# Store: 'postgres' (atómico y compartido entre workers; una escritura en BD por
+# request) o 'cache' (usa API_KEY_RATE_LIMIT_CACHE, que debe ser compartida entre
+# workers: Redis, Memcached o DatabaseCache; con LocMem la app no arranca).
+API_KEY_DEFAULT_RATE_LIMIT = int(os.getenv('API_KEY_DEFAULT_RATE_LIMIT', '600'))
+API_KEY_RATE_LIMIT_STORE = os.getenv('API_KEY_RATE_LIMIT_STORE', 'postgres')
+API_KEY_RATE_LIMIT_CACHE = os.getenv('API_KEY_RATE_LIMIT_CACHE', 'default')
+
+# Minutos entre horarios candidatos del motor de disponibilidad de citas
+DISPONIBILIDAD_INTERVALO_MINUTOS = int(os.getenv('DISPONIBILIDAD_INTERVALO_MINUTOS', '30'))
+
+# Caché por worker de horarios ocupados por (profesional, día). Se invalida al
+# guardar una cita en el mismo worker; en los demás puede tardar hasta AGENDA_CACHE_TTL.
+AGENDA_CACHE_TTL = int(os.getenv('AGENDA_CACHE_TTL', '30'))
+AGENDA_CACHE_MAX_SIZE = int(os.getenv('AGENDA_CACHE_MAX_SIZE', '4096'))
+
+# Caché por worker del calendario laboral precalculado por mes (horario semanal,
+# festivos y excepciones). Un cambio en el admin tarda hasta CALENDARIO_CACHE_TTL
+# en verse en los demás workers.
+CALENDARIO_CACHE_TTL = int(os.getenv('CALENDARIO_CACHE_TTL', '300'))
+CALENDARIO_CACHE_MAX_SIZE = int(os.getenv('CALENDARIO_CACHE_MAX_SIZE', '64'))
+
+# Total de los listados paginados (citas por fecha, productos): se cachea por
+# worker CONTEO_CACHE_TTL segundos por endpoint y filtros, y por encima de
+# CONTEO_EXACTO_MAXIMO filas se usa la estimación del planificador de PostgreSQL.
+CONTEO_CACHE_TTL = int(os.getenv('CONTEO_CACHE_TTL', '30'))
+CONTEO_CACHE_MAX_SIZE = int(os.getenv('CONTEO_CACHE_MAX_SIZE', '512'))
+CONTEO_EXACTO_MAXIMO = int(os.getenv('CONTEO_EXACTO_MAXIMO', '10000'))
+
+# Segundos que una cita reclamada de la cola de recordatorios queda reservada
+# para el worker que la reclamó antes de volver a la cola
+RECORDATORIOS_LEASE_SEGUNDOS = int(os.getenv('RECORDATORIOS_LEASE_SEGUNDOS', '300'))
+
+# Sincronización con Google Calendar (outbox, ver apps.citas.sincronizacion_calendario).
+# CALENDARIO_TRANSPORTE es la ruta de la clase que envía los eventos; para
+# desarrollo local y pruebas: apps.citas.sincronizacion_calendario.TransporteFalso
+CALENDARIO_TRANSPORTE = os.getenv('CALENDARIO_TRANSPORTE', 'apps.citas.sincronizacion_calendario.TransporteWebhook')
+CALENDARIO_WEBHOOK_URL = os.getenv('CALENDARIO_WEBHOOK_URL', '')
+CALENDARIO_WEBHOOK_TOKEN = os.getenv('CALENDARIO_WEBHOOK_TOKEN', '')
+CALENDARIO_WEBHOOK_TIMEOUT = int(os.getenv('CALENDARIO_WEBHOOK_TIMEOUT', '10'))
+CALENDARIO_SYNC_MAX_INTENTOS = int(os.getenv('CALENDARIO_SYNC_MAX_INTENTOS', '8'))
+CALENDARIO_SYNC_LEASE_SEGUNDOS = int(os.getenv('CALENDARIO_SYNC_LEASE_SEGUNDOS', '120'))
+
 # drf-spectacular configuration
 SPECTACULAR_SETTINGS = {
     'TITLE': 'OrientandoSAS API',